@@ -0,0 +1,175 @@
+"""
+
+BuildingIndex.py mail code and building name lookup indexes for the ShortestPath buildings
+"""
+
+from bisect import bisect_left
+import difflib
+
+# minimum similarity of a fuzzy building name match
+FUZZY_CUTOFF = 0.6
+
+
+class BuildingIndex:
+    """
+    hash indexes from the mail code and the building name to the building node,
+    a sorted word index for the partial names and a trigram index for the misspelled ones.
+    the sorted mail code listing is cached until a building is added or removed
+    """
+
+    def __init__(self):
+        self.mail_codes = {}
+        # mail code -> buildings sharing it in the insertion order, the first one is in mail_codes
+        self.mail_code_names = {}
+        self.names = {}
+        self.lower_names = {}
+        self.words = []
+        self.trigrams = {}
+        self.listing = None
+
+    @classmethod
+    def from_digraph(cls, path_graph):
+        """
+        index the building nodes of the path_graph, when two buildings share a mail code
+        the first one in the path_graph wins like the node scan did
+
+        :param path_graph: graph built by ShortestPath
+        :return: BuildingIndex
+        """
+        index = cls()
+        words = []
+        for node, attr in path_graph.node.items():
+            if attr["type"] == "building":
+                words += index.insert(node, attr["mail_code"])
+        index.words = sorted(words)
+        return index
+
+    @staticmethod
+    def trigrams_of(text: str):
+        """
+        :return: set of the 3 letter fragments of the padded lower case text
+        """
+        text = "  {} ".format(text.lower())
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def insert(self, name: str, mail_code: int):
+        """
+        add the building to the hash and trigram indexes
+
+        :return: (word, name) entries for the word index
+        """
+        self.mail_codes.setdefault(int(mail_code), name)
+        self.mail_code_names.setdefault(int(mail_code), []).append(name)
+        self.names[name] = int(mail_code)
+        self.lower_names.setdefault(name.lower(), name)
+        for trigram in self.trigrams_of(name):
+            self.trigrams.setdefault(trigram, set()).add(name)
+        self.listing = None
+        # every word starts a partial name, "hall" finds "Lincoln Hall" as well
+        words = name.lower().split()
+        return [(" ".join(words[i:]), name) for i in range(len(words))]
+
+    def add(self, name: str, mail_code: int):
+        """
+        add a building at runtime
+
+        :param name: building node
+        :param mail_code: building mail code
+        :return: None
+        """
+        if name in self.names:
+            return
+        for entry in self.insert(name, mail_code):
+            self.words.insert(bisect_left(self.words, entry), entry)
+
+    def remove(self, name: str):
+        """
+        remove a building at runtime, a mail code shared with other buildings goes to the next one
+
+        :param name: building node
+        :return: None
+        >>> index = BuildingIndex()
+        >>> for name, mail_code in (("Lincoln Hall", 1), ("Lincoln Annex", 1), ("Ice Arena", 2)):
+        ...     index.add(name, mail_code)
+        >>> index.remove("Lincoln Hall")
+        >>> index.node_by_mail_code(1), index.search("lincoln"), index.sorted_mail_codes()
+        ('Lincoln Annex', ['Lincoln Annex'], [(2, 'Ice Arena'), (1, 'Lincoln Annex')])
+        """
+        mail_code = self.names.pop(name, None)
+        if mail_code is None:
+            return
+        shared = self.mail_code_names[mail_code]
+        shared.remove(name)
+        if len(shared) > 0:
+            self.mail_codes[mail_code] = shared[0]
+        else:
+            del self.mail_codes[mail_code], self.mail_code_names[mail_code]
+        if self.lower_names.get(name.lower()) == name:
+            del self.lower_names[name.lower()]
+        for trigram in self.trigrams_of(name):
+            self.trigrams[trigram].discard(name)
+        words = name.lower().split()
+        for i in range(len(words)):
+            del self.words[bisect_left(self.words, (" ".join(words[i:]), name))]
+        self.listing = None
+
+    def node_by_mail_code(self, mail_code: int):
+        """
+        :return: building node or None
+        """
+        return self.mail_codes.get(mail_code)
+
+    def node_by_name(self, name: str):
+        """
+        :return: building node with the exact or case insensitive name, None if it is not found
+        """
+        if name in self.names:
+            return name
+        return self.lower_names.get(name.lower())
+
+    def search(self, text: str, limit: int = 10):
+        """
+        building nodes matching the text, the exact name first, then the names having a word
+        starting with the text and the similar names when nothing else is found
+
+        :param text: full, partial or misspelled building name
+        :param limit: maximum number of buildings
+        :return: list of building nodes
+        """
+        text = text.strip().lower()
+        if len(text) == 0:
+            return []
+        result = []
+        exact = self.lower_names.get(text)
+        if exact is not None:
+            result.append(exact)
+        i = bisect_left(self.words, (text, ""))
+        while i < len(self.words) and len(result) < limit and self.words[i][0].startswith(text):
+            if self.words[i][1] not in result:
+                result.append(self.words[i][1])
+            i += 1
+        if len(result) == 0:
+            result = self.fuzzy(text, limit)
+        return result[:limit]
+
+    def fuzzy(self, text: str, limit: int):
+        """
+        :return: building nodes sharing trigrams with the text ordered by similarity
+        """
+        shared = {}
+        for trigram in self.trigrams_of(text):
+            for name in self.trigrams.get(trigram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        # only the names sharing the most trigrams are compared character by character
+        candidates = sorted(shared, key=lambda name: (-shared[name], name))[:limit * 5]
+        scored = [(difflib.SequenceMatcher(None, text, name.lower()).ratio(), name) for name in candidates]
+        return [name for score, name in sorted(scored, key=lambda x: (-x[0], x[1])) if score >= FUZZY_CUTOFF][:limit]
+
+    def sorted_mail_codes(self):
+        """
+        :return: cached list of (mail_code, name) sorted by the building name
+        """
+        if self.listing is None:
+            self.listing = sorted(((mail_code, name) for name, mail_code in self.names.items()),
+                                  key=lambda x: x[1])
+        return self.listing
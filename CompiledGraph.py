@@ -0,0 +1,335 @@
+"""
+
+CompiledGraph.py versioned binary file for a finished ShortestPath path_graph
+"""
+
+from collections.abc import Mapping
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+# file layout: MAGIC, uint32 version, uint64 header length, json header,
+# then every array as raw bytes aligned to ALIGNMENT so they can be memory-mapped
+MAGIC = b"SPGRAPH\0"
+VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct("<8sIQ")
+
+NODE_TYPES = ("building", "intersection")
+GOTO_LABELS = ("North", "East", "South", "West")
+
+
+def hash_source_files(file_names: list):
+    """
+    given the dataset csv file names, compute the content hash of all of them,
+    a missing file is hashed as missing so adding it later changes the hash as well
+
+    :param file_names: csv file names
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    for file_name in file_names:
+        try:
+            with open(file_name, "rb") as f:
+                data = f.read()
+            digest.update(struct.pack("<Q", len(data)))
+            digest.update(data)
+        except OSError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+class StringTable:
+    """
+    all the strings of the compiled graph (node ids, street names, coordinates),
+    each string is stored once and referred by its index
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def add(self, value: str):
+        """
+        add the string to the table if it is not there yet
+
+        :param value: string, "" is stored as -1
+        :return: index of the string
+        """
+        if value == "":
+            return -1
+        if value not in self.index:
+            self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return self.index[value]
+
+    def to_arrays(self):
+        """
+        :return: utf-8 data blob and the offsets of every string in the blob
+        """
+        encoded = [value.encode("utf-8") for value in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class CompiledNodes(Mapping):
+    """
+    node -> attribute dictionary of a compiled graph, like path_graph.node, built on access
+    """
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+
+    def __getitem__(self, node: str):
+        return self.compiled.node_attributes(self.compiled.node_index[node])
+
+    def __contains__(self, node):
+        return node in self.compiled.node_index
+
+    def __iter__(self):
+        return iter(self.compiled.nodes)
+
+    def __len__(self):
+        return self.compiled.node_count
+
+
+class CompiledEdges(Mapping):
+    """
+    node -> {target: edge attributes} of a compiled graph, like path_graph.edge, built on access
+    """
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+
+    def __getitem__(self, node: str):
+        compiled = self.compiled
+        i = compiled.node_index[node]
+        start, end = int(compiled.offsets[i]), int(compiled.offsets[i + 1])
+        return {compiled.nodes[target]: {"weight": weight, "bearing": bearing, "goto": GOTO_LABELS[goto]}
+                for target, weight, bearing, goto in zip(compiled.targets[start:end].tolist(),
+                                                         compiled.weight[start:end].tolist(),
+                                                         compiled.bearing[start:end].tolist(),
+                                                         compiled.goto[start:end].tolist())}
+
+    def __contains__(self, node):
+        return node in self.compiled.node_index
+
+    def __iter__(self):
+        return iter(self.compiled.nodes)
+
+    def __len__(self):
+        return self.compiled.node_count
+
+
+class CompiledGraphView:
+    """
+    read-only path_graph.node and path_graph.edge of a compiled graph, enough to render the routes
+    without building the networkx graph
+    """
+
+    def __init__(self, compiled):
+        self.node = CompiledNodes(compiled)
+        self.edge = CompiledEdges(compiled)
+        self.succ = self.edge
+
+
+class CompiledGraph:
+    """
+    read-only arrays of a compiled path_graph, node i is the string i of the string table
+    and the out edges of node i are targets[offsets[i]:offsets[i + 1]] (CSR adjacency)
+    """
+
+    def __init__(self, header: dict, arrays: dict):
+        self.header = header
+        self.arrays = arrays
+        self.strings = self.decode_strings(arrays["strings_data"], arrays["strings_offsets"])
+        self.node_count = int(header["node_count"])
+        self.nodes = self.strings[:self.node_count]
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+
+    def __getattr__(self, name: str):
+        try:
+            return self.__dict__["arrays"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @staticmethod
+    def decode_strings(data: np.ndarray, offsets: np.ndarray):
+        """
+        :return: list of strings stored in the utf-8 blob
+        """
+        blob = data.tobytes()
+        bounds = offsets.tolist()
+        return [blob[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(len(bounds) - 1)]
+
+    def string(self, ref: int):
+        """
+        :return: the string of the reference, "" for -1
+        """
+        return self.strings[ref] if ref >= 0 else ""
+
+    @classmethod
+    def from_digraph(cls, path_graph: "nx.DiGraph", datasets: dict, source_files: list, options: dict,
+                     coordinates: np.ndarray = None):
+        """
+        given the finished path_graph, build the compiled arrays
+
+        :param path_graph: graph built by ShortestPath
+        :param datasets: small datasets kept with the graph, streets, one_direction and inactive_road
+        :param source_files: csv file names the graph is built from
+        :param options: constructor options used to build the graph
+        :param coordinates: (lat, long) array in the path_graph.nodes() order, parsed from the nodes if not given
+        :return: CompiledGraph
+        """
+        table = StringTable()
+        nodes = list(path_graph.nodes())
+        for node in nodes:
+            table.add(node)
+        node_index = {node: i for i, node in enumerate(nodes)}
+        node_count = len(nodes)
+
+        node_type = np.zeros(node_count, dtype=np.uint8)
+        mail_code = np.zeros(node_count, dtype=np.int64)
+        parse = coordinates is None
+        if parse:
+            coordinates = np.zeros((node_count, 2), dtype=np.float64)
+        refs = {key: np.full(node_count, -1, dtype=np.int64) for key in ("coor", "a", "b", "N", "S", "E", "W")}
+        for i, node in enumerate(nodes):
+            attr = path_graph.node[node]
+            node_type[i] = NODE_TYPES.index(attr["type"])
+            if parse:
+                coordinates[i] = [float(x) for x in attr["coor"].split(",")]
+            refs["coor"][i] = table.add(attr["coor"])
+            if attr["type"] == "building":
+                mail_code[i] = attr["mail_code"]
+            else:
+                for key in ("a", "b", "N", "S", "E", "W"):
+                    refs[key][i] = table.add(attr[key])
+
+        offsets = np.zeros(node_count + 1, dtype=np.int64)
+        targets, weight, bearing, goto = [], [], [], []
+        for i, node in enumerate(nodes):
+            for target, edge in path_graph.edge[node].items():
+                targets.append(node_index[target])
+                weight.append(edge["weight"])
+                bearing.append(edge["bearing"])
+                goto.append(GOTO_LABELS.index(edge["goto"]))
+            offsets[i + 1] = len(targets)
+
+        arrays = {"node_type": node_type, "mail_code": mail_code,
+                  "coordinates": np.ascontiguousarray(coordinates, dtype=np.float64),
+                  "offsets": offsets, "targets": np.array(targets, dtype=np.int64),
+                  "weight": np.array(weight, dtype=np.float64), "bearing": np.array(bearing, dtype=np.float64),
+                  "goto": np.array(goto, dtype=np.uint8)}
+        for key, ref in refs.items():
+            arrays["{}_ref".format(key)] = ref
+        arrays["streets_ref"] = np.array([table.add(name) for name in datasets["streets"]], dtype=np.int64)
+        for key in ("one_direction", "inactive_road"):
+            arrays["{}_ref".format(key)] = np.array([[table.add(a), table.add(b)] for a, b in datasets[key]],
+                                                    dtype=np.int64).reshape(-1, 2)
+        arrays["strings_data"], arrays["strings_offsets"] = table.to_arrays()
+
+        header = {"version": VERSION, "node_count": node_count, "source_files": list(source_files),
+                  "source_hash": hash_source_files(source_files), "options": options}
+        return cls(header, arrays)
+
+    def write(self, file_name: str):
+        """
+        write the compiled graph to file_name, the file is written next to it first
+        and renamed so a running reader never sees a half written file
+
+        :param file_name: compiled graph file name
+        :return: None
+        """
+        layout = {}
+        offset = 0
+        for key, array in self.arrays.items():
+            layout[key] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header = dict(self.header, arrays=layout)
+        encoded = json.dumps(header).encode("utf-8")
+        data_start = -(-(PREAMBLE.size + len(encoded)) // ALIGNMENT) * ALIGNMENT
+
+        temp_name = "{}.tmp{}".format(file_name, os.getpid())
+        with open(temp_name, "wb") as f:
+            f.write(PREAMBLE.pack(MAGIC, VERSION, len(encoded)))
+            f.write(encoded)
+            for key, array in self.arrays.items():
+                f.seek(data_start + layout[key]["offset"])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + offset)
+        os.replace(temp_name, file_name)
+
+    @staticmethod
+    def read_header(file_name: str):
+        """
+        read only the json header of a compiled graph file
+
+        :param file_name: compiled graph file name
+        :return: header dict and the offset of the array data
+        """
+        with open(file_name, "rb") as f:
+            magic, version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a compiled graph file".format(file_name))
+            if version != VERSION:
+                raise ValueError("{} has compiled graph version {}, expected {}".format(file_name, version, VERSION))
+            header = json.loads(f.read(header_length).decode("utf-8"))
+        data_start = -(-(PREAMBLE.size + header_length) // ALIGNMENT) * ALIGNMENT
+        return header, data_start
+
+    @classmethod
+    def load(cls, file_name: str):
+        """
+        memory-map the compiled graph file, the arrays are read-only views on the mapping
+        so forked workers share the same pages
+
+        :param file_name: compiled graph file name
+        :return: CompiledGraph
+        """
+        header, data_start = cls.read_header(file_name)
+        mapping = np.memmap(file_name, dtype=np.uint8, mode="r")
+        arrays = {}
+        for key, layout in header.pop("arrays").items():
+            dtype = np.dtype(layout["dtype"])
+            count = int(np.prod(layout["shape"]))
+            start = data_start + layout["offset"]
+            arrays[key] = mapping[start:start + count * dtype.itemsize].view(dtype).reshape(layout["shape"])
+        return cls(header, arrays)
+
+    def node_attributes(self, i: int):
+        """
+        :return: the path_graph attribute dictionary of node i
+        """
+        if self.node_type[i] == 0:
+            return {"type": "building", "coor": self.string(self.coor_ref[i]), "mail_code": int(self.mail_code[i])}
+        attr = {"type": "intersection", "coor": self.string(self.coor_ref[i])}
+        for key in ("a", "b", "N", "S", "E", "W"):
+            attr[key] = self.string(self.arrays["{}_ref".format(key)][i])
+        return attr
+
+    def view(self):
+        """
+        :return: CompiledGraphView of the arrays
+        """
+        return CompiledGraphView(self)
+
+    def to_digraph(self):
+        """
+        rebuild the networkx path_graph from the arrays, no csv or geodesic work is needed
+
+        :return: nx.DiGraph
+        """
+        import networkx as nx
+        path_graph = nx.DiGraph()
+        path_graph.add_nodes_from((node, self.node_attributes(i)) for i, node in enumerate(self.nodes))
+        sources = np.repeat(np.arange(self.node_count), np.diff(self.offsets)).tolist()
+        path_graph.add_edges_from(
+            (self.nodes[source], self.nodes[target], {"weight": weight, "bearing": bearing, "goto": GOTO_LABELS[goto]})
+            for source, target, weight, bearing, goto in zip(sources, self.targets.tolist(), self.weight.tolist(),
+                                                             self.bearing.tolist(), self.goto.tolist()))
+        return path_graph
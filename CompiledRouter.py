@@ -0,0 +1,94 @@
+"""
+
+CompiledRouter.py startup optimized queries on a compiled graph file, only numpy is imported
+(no pandas, networkx, matplotlib or pygeodesy) so a command line call or a spawned worker
+answers in a fraction of the ShortestPath import time
+
+python CompiledRouter.py uiuc.graph "Lincoln Hall" 525
+"""
+
+import argparse
+import math
+
+import numpy as np
+
+from CompiledGraph import CompiledGraph
+from RoutingEngine import RoutingEngine, NoPath
+
+
+class CompiledRouter:
+    """
+    routing engine over the memory-mapped arrays of a compiled graph. the graph is used as it was
+    compiled, the runtime road rules and the rendered route steps need the ShortestPath of load_compiled
+    """
+
+    def __init__(self, file_name: str, algorithm: str = "dijkstra"):
+        if algorithm not in ("dijkstra", "astar", "ch"):
+            raise ValueError("unknown routing algorithm {}".format(algorithm))
+        self.compiled = CompiledGraph.load(file_name)
+        self.engine = RoutingEngine.from_compiled(self.compiled)
+        if algorithm == "ch":
+            self.engine.contract()
+        self.algorithm = algorithm
+        buildings = np.flatnonzero(np.asarray(self.compiled.node_type) == 0).tolist()
+        self.buildings = {self.compiled.nodes[i]: i for i in buildings}
+        mail_codes = np.asarray(self.compiled.mail_code)[buildings].tolist()
+        self.mail_codes = {str(mail_code): self.compiled.nodes[i] for i, mail_code in zip(buildings, mail_codes)}
+
+    def resolve(self, building):
+        """
+        :param building: building name or mail code
+        :return: building node or None
+        """
+        if isinstance(building, int) or (isinstance(building, str) and building.isdigit()):
+            return self.mail_codes.get(str(building))
+        return building if building in self.buildings else None
+
+    def route(self, where_from: str, where_to: str):
+        """
+        :param where_from: source node
+        :param where_to: target node
+        :return: distance in meter and the node list, inf and None when there is no path
+        >>> import os, tempfile
+        >>> from ShortestPath import ShortestPath
+        >>> compiled_file = os.path.join(tempfile.mkdtemp(), "uiuc.graph")
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.compile(compiled_file)
+        >>> router = CompiledRouter(compiled_file)
+        >>> distance, path = router.route(router.resolve('Lincoln Hall'), router.resolve(525))
+        >>> path == uiuc.find_path('Lincoln Hall', 'Ice Arena'), round(distance)
+        (True, 571)
+        >>> import subprocess, sys
+        >>> subprocess.check_output([sys.executable, "-c", "import sys, CompiledRouter; "
+        ...     "print(sorted(m for m in ('pandas', 'networkx', 'matplotlib', 'pygeodesy') if m in sys.modules))"])
+        b'[]\\n'
+        """
+        try:
+            path = self.engine.shortest_path(where_from, where_to, self.algorithm)
+        except NoPath:
+            return math.inf, None
+        index = self.engine.node_index
+        return sum(self.engine.edge_weight(index[a], index[b]) for a, b in zip(path, path[1:])), path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="shortest path on a compiled graph file, with numpy only")
+    parser.add_argument("compiled", help="compiled graph file, see ShortestPath.compile")
+    parser.add_argument("where_from", help="building name or mail code")
+    parser.add_argument("where_to", help="building name or mail code")
+    parser.add_argument("--algorithm", default="dijkstra", choices=("dijkstra", "astar", "ch"))
+    args = parser.parse_args()
+
+    router = CompiledRouter(args.compiled, args.algorithm)
+    where_from, where_to = router.resolve(args.where_from), router.resolve(args.where_to)
+    if where_from is None or where_to is None:
+        parser.exit(1, "unknown building {}\n".format(args.where_from if where_from is None else args.where_to))
+    distance, path = router.route(where_from, where_to)
+    if path is None:
+        parser.exit(1, "no path from {} to {}\n".format(where_from, where_to))
+    print("\n".join(path))
+    print("Approximate Total Path: {:.2f} m".format(distance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+
+ContractionHierarchy.py contraction hierarchy preprocessing and queries for the RoutingEngine
+"""
+
+from heapq import heappush, heappop
+import math
+
+import numpy as np
+
+from RoutingEngine import no_path
+
+# the witness search stops after settling this many nodes, a shortcut is added
+# when no witness is found in time, which keeps the hierarchy correct
+WITNESS_SETTLE_LIMIT = 60
+# the last nodes are the most expensive to contract (the remaining graph gets dense), this fraction
+# of the nodes can be left as an uncontracted core which the queries search with plain bidirectional
+# dijkstra. it trades query time for preprocessing time, by default every node is contracted
+CORE_FRACTION = 0.0
+INFINITY = math.inf
+
+
+class ContractionHierarchy:
+    """
+    contraction hierarchy over the directed CSR arrays of a RoutingEngine. the nodes are contracted
+    one by one (lowest edge difference first), shortcuts keep the distances between the remaining
+    nodes and every edge remembers the contracted middle node so a route can be unpacked again.
+    the closed roads keep their 9e9 weight and the one direction streets keep their single edge
+    """
+
+    def __init__(self, nodes: list, offsets: np.ndarray, targets: np.ndarray, weights: np.ndarray,
+                 core_fraction: float = CORE_FRACTION):
+        self.nodes = nodes
+        self.node_index = {node: i for i, node in enumerate(nodes)}
+        # distances of the two searches of the last query, counted by search_counts
+        self.last_settled = None
+        node_count = len(nodes)
+        out_edges = [dict() for _ in range(node_count)]
+        in_edges = [dict() for _ in range(node_count)]
+        offsets, targets, weights = offsets.tolist(), targets.tolist(), weights.tolist()
+        for u in range(node_count):
+            for k in range(offsets[u], offsets[u + 1]):
+                w = targets[k]
+                if w != u and weights[k] < out_edges[u].get(w, INFINITY):
+                    out_edges[u][w] = weights[k]
+                    in_edges[w][u] = weights[k]
+        self.contract(out_edges, in_edges, int(core_fraction * node_count))
+
+    @classmethod
+    def from_engine(cls, engine):
+        """
+        :param engine: RoutingEngine
+        :return: ContractionHierarchy
+        """
+        hierarchy = cls(engine.nodes, engine.arrays["offsets"], engine.arrays["targets"], engine.arrays["weights"])
+        # the nodes removed from the engine keep their slot, see RoutingEngine.remove_node
+        hierarchy.node_index = dict(engine.node_index)
+        return hierarchy
+
+    @staticmethod
+    def witness_search(out_edges: list, source: int, skip: int, limit: float, targets: set):
+        """
+        local dijkstra from source which does not pass the node being contracted,
+        it stops once every target is settled or the distance limit is reached
+
+        :return: distances of the settled nodes
+        """
+        dist = {}
+        remaining = len(targets)
+        fringe = [(0, source)]
+        while fringe and len(dist) < WITNESS_SETTLE_LIMIT:
+            d, v = heappop(fringe)
+            if v in dist:
+                continue
+            if d > limit:
+                break
+            dist[v] = d
+            if v in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            for u, weight in out_edges[v].items():
+                if u != skip and u not in dist:
+                    heappush(fringe, (d + weight, u))
+        return dist
+
+    def shortcuts(self, out_edges: list, in_edges: list, v: int):
+        """
+        :return: shortcuts (u, w, weight) needed to keep the distances when v is contracted
+        """
+        result = []
+        for u, weight_uv in in_edges[v].items():
+            outgoing = [(w, weight_vw) for w, weight_vw in out_edges[v].items() if w != u]
+            if len(outgoing) == 0:
+                continue
+            dist = self.witness_search(out_edges, u, v, weight_uv + max(weight for _, weight in outgoing),
+                                       {w for w, _ in outgoing})
+            for w, weight_vw in outgoing:
+                via = weight_uv + weight_vw
+                if dist.get(w, INFINITY) > via:
+                    result.append((u, w, via))
+        return result
+
+    def contract(self, out_edges: list, in_edges: list, core_size: int):
+        """
+        contract the nodes and build the upward (forward) and downward (backward) edge lists.
+        the priority of a node is its edge difference plus its contracted neighbours and its level
+        in the hierarchy, which spreads the contraction evenly over the map.
+        the last core_size nodes are not contracted, they share the top rank and keep all their edges
+
+        :return: None
+        """
+        node_count = len(self.nodes)
+        deleted_neighbours = [0] * node_count
+        level = [0] * node_count
+        middle = {}
+
+        def priority(v, shortcuts):
+            return 2 * (len(shortcuts) - len(in_edges[v]) - len(out_edges[v])) + deleted_neighbours[v] + level[v]
+
+        queue = [(priority(v, self.shortcuts(out_edges, in_edges, v)), v) for v in range(node_count)]
+        queue.sort()
+        rank = [0] * node_count
+        forward = [None] * node_count
+        backward = [None] * node_count
+        self.middle = {}
+        order = 0
+        while len(queue) > core_size:
+            _, v = heappop(queue)
+            # lazy update, contract v only if it is still the best candidate
+            shortcuts = self.shortcuts(out_edges, in_edges, v)
+            current = priority(v, shortcuts)
+            if queue and current > queue[0][0]:
+                heappush(queue, (current, v))
+                continue
+            for u, w, weight in shortcuts:
+                if weight < out_edges[u].get(w, INFINITY):
+                    out_edges[u][w] = weight
+                    in_edges[w][u] = weight
+                    middle[(u, w)] = v
+            rank[v] = order
+            order += 1
+            # every remaining neighbour has a higher rank than v
+            forward[v] = list(out_edges[v].items())
+            backward[v] = list(in_edges[v].items())
+            for w in out_edges[v]:
+                if (v, w) in middle:
+                    self.middle[(v, w)] = middle[(v, w)]
+                del in_edges[w][v]
+                deleted_neighbours[w] += 1
+                level[w] = max(level[w], level[v] + 1)
+            for u in in_edges[v]:
+                if (u, v) in middle:
+                    self.middle[(u, v)] = middle[(u, v)]
+                del out_edges[u][v]
+                deleted_neighbours[u] += 1
+                level[u] = max(level[u], level[v] + 1)
+            out_edges[v] = {}
+            in_edges[v] = {}
+
+        for _, v in queue:
+            rank[v] = order
+            forward[v] = list(out_edges[v].items())
+            backward[v] = list(in_edges[v].items())
+            for w in out_edges[v]:
+                if (v, w) in middle:
+                    self.middle[(v, w)] = middle[(v, w)]
+
+        self.core_size = len(queue)
+        self.rank = rank
+        self.forward = forward
+        self.backward = backward
+        self.shortcut_count = len(self.middle)
+
+    def unpack(self, u: int, w: int):
+        """
+        :return: original nodes from u to w (w excluded) following the shortcut middle nodes
+        """
+        path = []
+        stack = [(u, w)]
+        while stack:
+            a, b = stack.pop()
+            m = self.middle.get((a, b))
+            if m is None:
+                path.append(a)
+            else:
+                stack.append((m, b))
+                stack.append((a, m))
+        return path
+
+    def search_counts(self):
+        """
+        :return: nodes labelled by the two searches of the last query and their hierarchy edges
+        """
+        if self.last_settled is None:
+            return 0, 0
+        forward, backward = self.last_settled
+        return len(forward) + len(backward), \
+            sum(len(self.forward[v]) for v in forward) + sum(len(self.backward[v]) for v in backward)
+
+    def query(self, where_from: str, where_to: str):
+        """
+        bidirectional dijkstra which only goes upward in the hierarchy from both ends,
+        the meeting node with the lowest total gives the shortest path. a node reached with
+        a longer distance than it gets through one of its higher neighbours is not expanded (stall on demand)
+
+        :param where_from: source node
+        :param where_to: target node
+        :return: node list of the shortest path
+        """
+        source = self.node_index[where_from]
+        target = self.node_index[where_to]
+        dist = ({source: 0}, {target: 0})
+        pred = ({source: -1}, {target: -1})
+        fringe = ([(0, source)], [(0, target)])
+        # forward search goes over the upward edges and checks the downward edges for stalling
+        edges = ((self.forward, self.backward), (self.backward, self.forward))
+        best, meet = INFINITY, -1
+        while True:
+            forward_top = fringe[0][0][0] if fringe[0] else INFINITY
+            backward_top = fringe[1][0][0] if fringe[1] else INFINITY
+            if forward_top >= best and backward_top >= best:
+                break
+            side = 0 if forward_top <= backward_top else 1
+            d, v = heappop(fringe[side])
+            side_dist = dist[side]
+            if d > side_dist[v]:
+                continue
+            other = dist[1 - side].get(v)
+            if other is not None and d + other < best:
+                best, meet = d + other, v
+            relax, stall = edges[side]
+            stalled = False
+            for u, weight in stall[v]:
+                if side_dist.get(u, INFINITY) + weight < d:
+                    stalled = True
+                    break
+            if stalled:
+                continue
+            for u, weight in relax[v]:
+                du = d + weight
+                if du < side_dist.get(u, INFINITY):
+                    side_dist[u] = du
+                    pred[side][u] = v
+                    heappush(fringe[side], (du, u))
+        self.last_settled = dist
+        if meet == -1:
+            raise no_path(where_from, where_to)
+
+        path = []
+        v = meet
+        while pred[0][v] != -1:
+            path = self.unpack(pred[0][v], v) + path
+            v = pred[0][v]
+        v = meet
+        while pred[1][v] != -1:
+            path += self.unpack(v, pred[1][v])
+            v = pred[1][v]
+        return [self.nodes[i] for i in path + [target]]
@@ -0,0 +1,218 @@
+"""
+
+DatasetDiff.py reference validation of the network datasets and the difference between two versions
+of them, used by ShortestPath to validate a load and to reload changed datasets into a running graph
+"""
+
+import numpy as np
+import pandas as pd
+
+DATASETS = ("buildings", "streets", "edges", "one_direction", "inactive_road")
+NEIGHBOURS = ["N", "S", "E", "W"]
+# columns every dataset needs, the road rule files can be empty or missing
+COLUMNS = {"buildings": ["name", "coordinate", "mail_code"], "streets": ["name"],
+           "edges": ["node_a", "node_b", "intersection"] + NEIGHBOURS,
+           "one_direction": ["node_a", "node_b"], "inactive_road": ["node_a", "node_b"]}
+
+
+def node_names(edges: pd.DataFrame):
+    """
+    :return: series of the intersection node of every edges row
+    """
+    return edges.node_a.astype(str) + "-" + edges.node_b.astype(str)
+
+
+def rule_pairs(rules: pd.DataFrame):
+    """
+    :return: (node_a, node_b) list of a road rule dataset, empty when the file was missing
+    """
+    if rules.shape[0] == 0 or "node_a" not in rules:
+        return []
+    return list(zip(rules.node_a.astype(str).tolist(), rules.node_b.astype(str).tolist()))
+
+
+def street_edges(edges: pd.DataFrame, buildings: set):
+    """
+    the edges the loaders build from the edges rows before the road rules, in both directions
+
+    :param buildings: building names
+    :return: dataframe of the node_a, node_b edges
+    """
+    names = node_names(edges)
+    sources, targets = [], []
+    for column in NEIGHBOURS:
+        neighbours = edges[column].astype(str)
+        available = (neighbours != "").values
+        sources.append(names[available])
+        targets.append(neighbours[available])
+    # node_b wins over node_a like building_street_pairs
+    building = edges.node_b.astype(str).where(edges.node_b.astype(str).isin(buildings),
+                                              edges.node_a.astype(str).where(edges.node_a.astype(str).isin(buildings)))
+    available = building.notna().values
+    sources.append(building[available])
+    targets.append(names[available])
+    sources, targets = pd.concat(sources, ignore_index=True), pd.concat(targets, ignore_index=True)
+    return pd.DataFrame({"node_a": pd.concat([sources, targets], ignore_index=True),
+                         "node_b": pd.concat([targets, sources], ignore_index=True)}).drop_duplicates()
+
+
+def missing(values: pd.Series, names: set):
+    """
+    a set lookup per value, cheaper than isin which hashes the whole set again on every call
+
+    :return: boolean array of the values which are not in names
+    """
+    return np.fromiter((value not in names for value in values.tolist()), dtype=bool, count=values.shape[0])
+
+
+def row_errors(file_name: str, names: pd.Series, values: pd.Series, bad, message: str):
+    """
+    :return: one error per bad row, the header is line 1 of the csv file
+    """
+    return ["{}: line {} ({}) {!r} {}".format(file_name, i + 2, name, value, message)
+            for i, name, value in zip(bad.nonzero()[0].tolist(), names[bad].tolist(), values[bad].tolist())]
+
+
+def dataset_errors(datasets: dict, file_names: dict):
+    """
+    check every reference between the datasets with indexed lookups, all the errors are returned
+    instead of the KeyError of the first one while building the graph
+
+    :param datasets: dataset name -> dataframe, see DATASETS
+    :param file_names: dataset name -> file name for the messages
+    :return: list of error messages
+    >>> datasets = {"buildings": pd.DataFrame({"name": ["Hall"], "coordinate": ["40.1,-88.2"], "mail_code": [1]}),
+    ...             "streets": pd.DataFrame({"name": ["Main", "First"]}),
+    ...             "edges": pd.DataFrame({"node_a": ["Hall", "Main", "Main"], "node_b": ["Main", "First", "Second"],
+    ...                                    "intersection": ["40.1,-88.2"] * 3, "N": ["", "Main-Second", ""],
+    ...                                    "S": ["Main-First", "Hall-Main", "Main-Third"], "E": [""] * 3, "W": [""] * 3}),
+    ...             "one_direction": pd.DataFrame({"node_a": ["Main-First", "Hall-Main"], "node_b": ["Main-Second", "Main-Second"]}),
+    ...             "inactive_road": pd.DataFrame()}
+    >>> for error in dataset_errors(datasets, {key: key + ".csv" for key in datasets}):
+    ...     print(error)
+    edges.csv: line 4 (Main-Second) 'Second' is not a building or a street
+    edges.csv: line 4 (Main-Second) 'Main-Third' is not an intersection
+    one_direction.csv: line 3 (Hall-Main) 'Main-Second' is not connected to it
+    """
+    errors = []
+    for key in DATASETS:
+        dataset = datasets[key]
+        absent = [column for column in COLUMNS[key] if column not in dataset]
+        # a missing road rule file is an empty dataframe without columns
+        if len(absent) > 0 and (dataset.shape[0] > 0 or key in ("buildings", "streets", "edges")):
+            errors.append("{}: missing columns {}".format(file_names[key], ", ".join(absent)))
+    if len(errors) > 0:
+        return errors
+
+    buildings = set(datasets["buildings"]["name"].astype(str).tolist())
+    streets = set(datasets["streets"]["name"].astype(str).tolist())
+    edges = datasets["edges"]
+    names = node_names(edges)
+    intersections = set(names.tolist())
+    file_name = file_names["edges"]
+    for column in ("node_a", "node_b"):
+        values = edges[column].astype(str)
+        errors += row_errors(file_name, names, values, missing(values, buildings | streets),
+                             "is not a building or a street")
+    intersections.add("")
+    for column in NEIGHBOURS:
+        values = edges[column].astype(str)
+        errors += row_errors(file_name, names, values, missing(values, intersections), "is not an intersection")
+    intersections.discard("")
+
+    pairs = {key: rule_pairs(datasets[key]) for key in ("one_direction", "inactive_road")}
+    # only the rows of the rule intersections are needed for the edges of the rules
+    rule_nodes = set(node for key in pairs for pair in pairs[key] for node in pair)
+    connected = set(map(tuple, street_edges(edges[names.isin(rule_nodes).values], buildings).values.tolist())) \
+        if len(rule_nodes) > 0 else set()
+    nodes = buildings | intersections
+    for key in ("one_direction", "inactive_road"):
+        if len(pairs[key]) == 0:
+            continue
+        rules = pd.DataFrame(pairs[key], columns=["node_a", "node_b"])
+        unknown = [missing(rules[column], nodes) for column in ("node_a", "node_b")]
+        for column, bad in zip(("node_a", "node_b"), unknown):
+            errors += row_errors(file_names[key], rules.node_a, rules[column], bad, "is not a node")
+        errors += row_errors(file_names[key], rules.node_a, rules.node_b,
+                             ~unknown[0] & ~unknown[1] & missing(pd.Series(pairs[key]), connected),
+                             "is not connected to it")
+    return errors
+
+
+def row_positions(keys: list):
+    """
+    :return: key -> position of its first row, the road rules are applied in the file order
+    """
+    positions = {}
+    for i, key in enumerate(keys):
+        positions.setdefault(key, i)
+    return positions
+
+
+def row_values(dataset: pd.DataFrame, keys: pd.Series, columns: list):
+    """
+    :return: key -> tuple of the compared columns of the row
+    """
+    return dict(zip(keys.tolist(), zip(*(dataset[column].astype(str).tolist() for column in columns))))
+
+
+def changed_keys(old: pd.DataFrame, new: pd.DataFrame, old_keys: pd.Series, new_keys: pd.Series, columns: list):
+    """
+    compare the rows of two versions of a dataset by key
+
+    :param old_keys: key of every old row, new_keys of every new row
+    :param columns: compared columns
+    :return: added, removed and changed key sets
+    """
+    old, new = row_values(old, old_keys, columns), row_values(new, new_keys, columns)
+    return new.keys() - old.keys(), old.keys() - new.keys(), set(key for key, values in new.items()
+                                                                 if key in old and old[key] != values)
+
+
+class DatasetDiff:
+    """
+    rows added, removed and changed between two versions of the datasets: the buildings by name,
+    the intersections by node, the streets by name and the road rules by (node_a, node_b) pair.
+    the rows are compared by key in dictionaries, so only applying the difference depends on its size.
+    the positions of the new rows by key let the apply read the changed rows only
+    """
+
+    def __init__(self, old: dict, new: dict):
+        """
+        :param old: dataset name -> dataframe of the running graph, see DATASETS
+        :param new: dataset name -> dataframe of the new files
+        """
+        new_keys = {"buildings": new["buildings"]["name"].astype(str), "edges": node_names(new["edges"])}
+        self.buildings = changed_keys(old["buildings"], new["buildings"], old["buildings"]["name"].astype(str),
+                                      new_keys["buildings"], COLUMNS["buildings"])
+        self.intersections = changed_keys(old["edges"], new["edges"], node_names(old["edges"]),
+                                          new_keys["edges"], COLUMNS["edges"])
+        old_streets = set(old["streets"]["name"].astype(str).tolist())
+        self.street_names = set(new["streets"]["name"].astype(str).tolist())
+        self.streets = self.street_names - old_streets, old_streets - self.street_names
+        # key -> position of the row in the new dataset, the last buildings and edges row of a node
+        # gives its attributes like in the loaders
+        self.positions = {key: dict(zip(keys.tolist(), range(keys.shape[0]))) for key, keys in new_keys.items()}
+        # added and removed pairs of the road rules, in the file order
+        self.rules = {}
+        for key in ("one_direction", "inactive_road"):
+            old_pairs, new_pairs = rule_pairs(old[key]), rule_pairs(new[key])
+            old_set = set(old_pairs)
+            self.positions[key] = row_positions(new_pairs)
+            self.rules[key] = ([pair for pair in new_pairs if pair not in old_set],
+                               [pair for pair in old_pairs if pair not in self.positions[key]])
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.buildings + self.intersections + self.streets) + \
+            sum(len(added) + len(removed) for added, removed in self.rules.values())
+
+    def summary(self):
+        """
+        :return: dataset -> number of added, removed and changed rows
+        """
+        summary = {name: dict(zip(("added", "removed", "changed"), (len(keys) for keys in changes)))
+                   for name, changes in (("buildings", self.buildings), ("intersections", self.intersections))}
+        summary["streets"] = {"added": len(self.streets[0]), "removed": len(self.streets[1])}
+        for key, (added, removed) in self.rules.items():
+            summary[key] = {"added": len(added), "removed": len(removed)}
+        return summary
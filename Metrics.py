@@ -0,0 +1,178 @@
+"""
+
+Metrics.py counters, timings and exporters for the ShortestPath instrumentation
+"""
+
+import json
+import random
+import threading
+
+
+class Metrics:
+    """
+    counters, gauges and summaries (count, sum, max) of the ShortestPath graph. the query counters
+    are exact, the per query timings and search counters are only measured for the sampled queries
+    so the instrumentation can stay on: with a sample_rate of 0.01 one query in a hundred pays
+    for the timers. every sampled query record is also given to the sink, any callable.
+    the construction phase timings are exported as the phase_seconds gauges
+    """
+
+    def __init__(self, sample_rate: float = 1.0, sink=None, phase_timings: dict = None,
+                 prefix: str = "shortestpath"):
+        self.sample_rate = sample_rate
+        self.sink = sink
+        # phase -> seconds, read at export time so the later phases are included
+        self.phase_timings = phase_timings if phase_timings is not None else {}
+        self.prefix = prefix
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self.random = random.Random()
+        self.lock = threading.Lock()
+
+    def sampled(self):
+        """
+        :return: True when the current query is measured
+        """
+        return self.sample_rate >= 1.0 or self.random.random() < self.sample_rate
+
+    def increment(self, name: str, value: int = 1):
+        """
+        :return: None
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float, labels: dict = None):
+        """
+        :param labels: label name -> value of the gauge
+        :return: None
+        """
+        with self.lock:
+            self.gauges[(name, tuple(sorted((labels or {}).items())))] = value
+
+    def observe(self, name: str, value: float):
+        """
+        add a measure to the summary of the name
+
+        :return: None
+        """
+        with self.lock:
+            self.add_to_summary(name, value)
+
+    def add_to_summary(self, name: str, value: float):
+        """
+        observe without the lock, the caller holds it
+
+        :return: None
+        """
+        summary = self.summaries.get(name)
+        if summary is None:
+            self.summaries[name] = [1, value, value]
+        else:
+            summary[0] += 1
+            summary[1] += value
+            if value > summary[2]:
+                summary[2] = value
+
+    def record_query(self, record: dict):
+        """
+        add the measures of a sampled query and give the record to the sink
+
+        :param record: query record, its numeric values are observed by name
+        :return: None
+        """
+        with self.lock:
+            for name, value in record.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.add_to_summary("query_" + name, value)
+        if self.sink is not None:
+            self.sink(record)
+
+    def all_gauges(self):
+        """
+        :return: (name, labels) -> value of the gauges and the phase timings
+        """
+        with self.lock:
+            gauges = dict(self.gauges)
+        for phase, seconds in self.phase_timings.items():
+            gauges[("phase_seconds", (("phase", phase),))] = seconds
+        return gauges
+
+    def snapshot(self):
+        """
+        :return: dictionary of the counters, gauges and summaries
+        """
+        gauges = {}
+        for (name, labels), value in self.all_gauges().items():
+            key = name if not labels else "{}{{{}}}".format(name, ",".join("{}={}".format(*x) for x in labels))
+            gauges[key] = value
+        with self.lock:
+            counters = dict(self.counters)
+            summaries = {name: {"count": count, "sum": total, "max": maximum}
+                         for name, (count, total, maximum) in self.summaries.items()}
+        return {"sample_rate": self.sample_rate, "counters": counters, "gauges": gauges, "summaries": summaries}
+
+    def json(self):
+        """
+        :return: the snapshot as a json string
+        """
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def prometheus(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        >>> metrics = Metrics(phase_timings={"read_network_dataset": 0.5})
+        >>> metrics.increment("queries")
+        >>> metrics.record_query({"from": "a", "to": "b", "search_seconds": 0.25})
+        >>> print(metrics.prometheus(), end="")
+        # TYPE shortestpath_queries_total counter
+        shortestpath_queries_total 1
+        # TYPE shortestpath_phase_seconds gauge
+        shortestpath_phase_seconds{phase="read_network_dataset"} 0.5
+        # TYPE shortestpath_query_search_seconds summary
+        shortestpath_query_search_seconds_count 1
+        shortestpath_query_search_seconds_sum 0.25
+        # TYPE shortestpath_query_search_seconds_max gauge
+        shortestpath_query_search_seconds_max 0.25
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            summaries = {name: list(summary) for name, summary in self.summaries.items()}
+        lines = []
+        for name in sorted(counters):
+            metric = "{}_{}_total".format(self.prefix, name)
+            lines += ["# TYPE {} counter".format(metric), "{} {}".format(metric, counters[name])]
+        typed = set()
+        for (name, labels), value in sorted(self.all_gauges().items()):
+            metric = "{}_{}".format(self.prefix, name)
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE {} gauge".format(metric))
+            label_text = ",".join('{}="{}"'.format(key, str(label).replace('"', '\\"')) for key, label in labels)
+            lines.append("{}{} {}".format(metric, "{" + label_text + "}" if label_text else "", value))
+        for name in sorted(summaries):
+            count, total, maximum = summaries[name]
+            metric = "{}_{}".format(self.prefix, name)
+            lines += ["# TYPE {} summary".format(metric), "{}_count {}".format(metric, count),
+                      "{}_sum {}".format(metric, total), "# TYPE {}_max gauge".format(metric),
+                      "{}_max {}".format(metric, maximum)]
+        return "\n".join(lines) + "\n"
+
+
+class JsonLinesSink:
+    """
+    metrics sink writing every sampled query record as one json line
+    """
+
+    def __init__(self, file_name: str):
+        self.file = open(file_name, "a")
+
+    def __call__(self, record: dict):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        """
+        :return: None
+        """
+        self.file.close()
@@ -0,0 +1,326 @@
+"""
+
+PartitionedGraph.py path_graph split into geographic regions, the cross region queries combine
+per region searches with a precomputed overlay of the region boundary nodes
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+import math
+import multiprocessing
+
+import numpy as np
+import networkx as nx
+
+from RoutingEngine import RoutingEngine
+
+# partitioned graph shared with the forked workers
+POOL_PARTITIONED = None
+
+
+class Partition:
+    """
+    one region of the graph: its nodes, a routing engine over the edges inside the region
+    and its boundary nodes, which have an edge to or from another region
+    """
+
+    def __init__(self, number: int, nodes: np.ndarray, engine: RoutingEngine, boundary: list):
+        self.number = number
+        self.nodes = nodes
+        self.engine = engine
+        self.boundary = boundary
+        # boundary node -> {boundary node: distance inside the region}, see table_worker
+        self.table = {}
+
+    def search(self, node: str, reverse: bool = False):
+        """
+        search inside the region from the node, or toward it when reverse is True
+
+        :return: distances and predecessors keyed by the region node index
+        """
+        engine = self.engine.reverse() if reverse else self.engine
+        return engine.search_tree(self.engine.node_index[node])
+
+    def boundary_distances(self, node: str, reverse: bool = False):
+        """
+        :return: distances inside the region from the node to its boundary nodes
+            (from the boundary nodes to the node when reverse is True)
+        """
+        dist, _ = self.search(node, reverse)
+        index = self.engine.node_index
+        return {boundary: dist[index[boundary]] for boundary in self.boundary if index[boundary] in dist}
+
+    def local_path(self, where_from: str, where_to: str):
+        """
+        :return: node list of the shortest path inside the region, None if there is none
+        """
+        try:
+            return self.engine.dijkstra(where_from, where_to)
+        except nx.NetworkXNoPath:
+            return None
+
+
+class PartitionedGraph:
+    """
+    the nodes are split by a cells x cells geographic grid over their coordinates. every region keeps
+    a routing engine of its own edges and a table of the distances between its boundary nodes.
+    the overlay graph links the boundary nodes with the table distances and the edges crossing
+    the regions, so a query searches the source region, the overlay and the target region and
+    the answer is the same distance as a search over the whole graph.
+    the per region searches are independent jobs run in a pool of forked processes, a job only reads
+    the arrays of its region so the regions could be served by different machines
+    """
+
+    def __init__(self, engine: RoutingEngine, cells: int = 4, processes: int = 1):
+        self.cells = cells
+        self.processes = processes
+        self.nodes = engine.nodes
+        self.node_index = engine.node_index
+        lat = np.asarray(engine.arrays["lat"])
+        long = np.asarray(engine.arrays["long"])
+        row = self.grid_cells(lat, cells)
+        col = self.grid_cells(long, cells)
+        numbers = row * cells + col
+        # only the non empty cells are regions
+        used, self.region = np.unique(numbers, return_inverse=True)
+        offsets = engine.arrays["offsets"]
+        targets = engine.arrays["targets"]
+        weights = engine.arrays["weights"]
+        sources = np.repeat(np.arange(len(self.nodes), dtype=np.int64), np.diff(offsets))
+        crossing = (self.region[sources] != self.region[targets]) & np.isfinite(weights)
+        is_boundary = np.zeros(len(self.nodes), dtype=bool)
+        is_boundary[sources[crossing]] = True
+        is_boundary[targets[crossing]] = True
+        # the nodes and the inside edges grouped by region, in their original order
+        node_order = np.argsort(self.region, kind="stable")
+        node_bounds = np.searchsorted(self.region[node_order], np.arange(len(used) + 1))
+        inside = np.flatnonzero(self.region[sources] == self.region[targets])
+        inside = inside[np.argsort(self.region[sources[inside]], kind="stable")]
+        edge_bounds = np.searchsorted(self.region[sources[inside]], np.arange(len(used) + 1))
+        self.partitions = []
+        for number in range(len(used)):
+            members = node_order[node_bounds[number]:node_bounds[number + 1]]
+            edges = inside[edge_bounds[number]:edge_bounds[number + 1]]
+            boundary = [self.nodes[i] for i in members[is_boundary[members]].tolist()]
+            self.partitions.append(Partition(number, members, self.region_engine(engine, members, sources[edges],
+                                                                                  targets[edges], weights[edges]),
+                                             boundary))
+        # overlay edges crossing the regions: boundary node -> [(boundary node, weight)]
+        self.crossing = {}
+        for u, v, weight in zip(sources[crossing].tolist(), targets[crossing].tolist(), weights[crossing].tolist()):
+            self.crossing.setdefault(self.nodes[u], []).append((self.nodes[v], weight))
+        self.build_tables()
+
+    @staticmethod
+    def grid_cells(values: np.ndarray, cells: int):
+        """
+        :return: grid cell of every value along one axis
+        """
+        low, high = values.min(), values.max()
+        if high == low:
+            return np.zeros(len(values), dtype=np.int64)
+        return np.minimum((values - low) / (high - low) * cells, cells - 1).astype(np.int64)
+
+    def region_engine(self, engine: RoutingEngine, members: np.ndarray, sources: np.ndarray, targets: np.ndarray,
+                      weights: np.ndarray):
+        """
+        routing engine of the edges inside one region, the out edges keep their order
+
+        :return: RoutingEngine over the region nodes
+        """
+        local = np.full(len(self.nodes), -1, dtype=np.int64)
+        local[members] = np.arange(len(members))
+        local_sources = local[sources]
+        order = np.argsort(local_sources, kind="stable")
+        offsets = np.zeros(len(members) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(local_sources, minlength=len(members)))
+        coordinates = np.degrees(np.column_stack([engine.arrays["lat"][members], engine.arrays["long"][members]]))
+        return RoutingEngine([self.nodes[i] for i in members.tolist()], offsets, local[targets][order],
+                             weights[order], coordinates)
+
+    def map(self, function, jobs: list):
+        """
+        run the jobs with the shared POOL_PARTITIONED, in the pool of forked processes when there is one
+
+        :return: list of the job results
+        """
+        global POOL_PARTITIONED
+        POOL_PARTITIONED = self
+        try:
+            if self.processes > 1 and len(jobs) > 1:
+                with multiprocessing.get_context("fork").Pool(self.processes) as pool:
+                    return pool.map(function, jobs, chunksize=max(1, len(jobs) // (self.processes * 4)))
+            return [function(job) for job in jobs]
+        finally:
+            POOL_PARTITIONED = None
+
+    def build_tables(self):
+        """
+        compute the boundary node distance table of every region
+
+        :return: None
+        """
+        tables = self.map(table_worker, list(range(len(self.partitions))))
+        for partition, table in zip(self.partitions, tables):
+            partition.table = table
+        self.overlay = {}
+        for partition in self.partitions:
+            for boundary, distances in partition.table.items():
+                self.overlay[boundary] = list(distances.items()) + self.crossing.get(boundary, [])
+
+    def partition_of(self, node: str):
+        """
+        :return: Partition holding the node
+        """
+        return self.partitions[self.region[self.node_index[node]]]
+
+    def overlay_search(self, sources: dict, targets: dict, direct: float = math.inf):
+        """
+        dijkstra over the overlay graph from several boundary nodes at once
+
+        :param sources: boundary node -> distance from the origin
+        :param targets: boundary node -> distance to the destination
+        :param direct: distance of the best path staying in one region
+        :return: distance, the last boundary node (None for the direct path) and the overlay predecessors
+        """
+        best, best_node = direct, None
+        dist = {}
+        seen = dict(sources)
+        pred = {node: None for node in sources}
+        c = count()
+        fringe = [(distance, next(c), node) for node, distance in sources.items()]
+        fringe.sort()
+        while fringe:
+            d, _, v = heappop(fringe)
+            if d >= best:
+                break
+            if v in dist:
+                continue
+            dist[v] = d
+            if v in targets and d + targets[v] < best:
+                best, best_node = d + targets[v], v
+            for u, weight in self.overlay.get(v, ()):
+                vu_dist = d + weight
+                if u not in dist and (u not in seen or vu_dist < seen[u]):
+                    seen[u] = vu_dist
+                    pred[u] = v
+                    heappush(fringe, (vu_dist, next(c), u))
+        return best, best_node, pred
+
+    def query(self, where_from: str, where_to: str, source_side: tuple = None, target_side: tuple = None):
+        """
+        distance and path from where_from to where_to, the region searches can be given
+        when they were run in the pool
+
+        :param source_side: boundary distances from where_from and distance to where_to inside its region
+        :param target_side: boundary distances to where_to
+        :return: distance (inf when there is no path) and the node list (None when there is no path)
+        """
+        if source_side is None:
+            source_side = source_worker((where_from, where_to), self)
+        if target_side is None:
+            target_side = target_worker(where_to, self)
+        sources, direct = source_side
+        distance, last, pred = self.overlay_search(sources, target_side, direct)
+        if distance == math.inf:
+            return distance, None
+        return distance, self.unwind(where_from, where_to, last, pred)
+
+    def unwind(self, where_from: str, where_to: str, last: str, pred: dict):
+        """
+        expand the overlay path into the node list, the table edges are searched again inside their region
+
+        :return: node list
+        """
+        source_region = self.partition_of(where_from)
+        if last is None:
+            return source_region.local_path(where_from, where_to)
+        boundaries = [last]
+        while pred[boundaries[-1]] is not None:
+            boundaries.append(pred[boundaries[-1]])
+        boundaries.reverse()
+        path = source_region.local_path(where_from, boundaries[0])
+        for u, v in zip(boundaries, boundaries[1:]):
+            region = self.partition_of(u)
+            # the overlay edges inside a region are table edges, the others cross the regions
+            if self.partition_of(v) is region:
+                path += region.local_path(u, v)[1:]
+            else:
+                path.append(v)
+        path += self.partition_of(where_to).local_path(boundaries[-1], where_to)[1:]
+        return path
+
+    def query_many(self, pairs: list):
+        """
+        answer many queries, the source and target region searches run in the process pool
+        and the overlay searches combine them
+
+        :param pairs: (where_from, where_to) node pairs
+        :return: list of (distance, node list) like query
+        """
+        source_sides = dict(zip(pairs, self.map(source_pool_worker, pairs)))
+        targets = list({where_to for _, where_to in pairs})
+        target_sides = dict(zip(targets, self.map(target_pool_worker, targets)))
+        return [self.query(where_from, where_to, source_sides[(where_from, where_to)], target_sides[where_to])
+                for where_from, where_to in pairs]
+
+
+def table_worker(number: int):
+    """
+    boundary distance table of one region, computed in a forked worker. a distance is left out
+    when going through another boundary node is as short, with two legs longer than 0 so two
+    distances cannot replace each other, the overlay distances stay the same with far less edges
+
+    :param number: region number
+    :return: boundary node -> {boundary node: distance}
+    """
+    partition = POOL_PARTITIONED.partitions[number]
+    boundary = partition.boundary
+    position = {node: i for i, node in enumerate(boundary)}
+    table = np.full((len(boundary), len(boundary)), math.inf)
+    for i, node in enumerate(boundary):
+        for other, distance in partition.boundary_distances(node).items():
+            table[i, position[other]] = distance
+    through = np.zeros(table.shape, dtype=bool)
+    positive = np.where(table > 0, table, math.inf)
+    for x in range(len(boundary)):
+        through |= positive[:, x, None] + positive[None, x, :] <= table
+    keep = np.isfinite(table) & ~through
+    np.fill_diagonal(keep, False)
+    return {node: {boundary[j]: float(table[i, j]) for j in np.flatnonzero(keep[i]).tolist()}
+            for i, node in enumerate(boundary)}
+
+
+def source_worker(pair: tuple, partitioned: PartitionedGraph):
+    """
+    :return: distances from where_from to the boundary nodes of its region and the distance
+        to where_to when both are in the same region
+    """
+    where_from, where_to = pair
+    region = partitioned.partition_of(where_from)
+    dist, _ = region.search(where_from)
+    index = region.engine.node_index
+    sources = {boundary: dist[index[boundary]] for boundary in region.boundary if index[boundary] in dist}
+    direct = dist.get(index[where_to], math.inf) if where_to in index else math.inf
+    return sources, direct
+
+
+def target_worker(where_to: str, partitioned: PartitionedGraph):
+    """
+    :return: distances from the boundary nodes of the where_to region to where_to
+    """
+    return partitioned.partition_of(where_to).boundary_distances(where_to, reverse=True)
+
+
+def source_pool_worker(pair: tuple):
+    """
+    source_worker run in a forked worker with the shared POOL_PARTITIONED
+    """
+    return source_worker(pair, POOL_PARTITIONED)
+
+
+def target_pool_worker(where_to: str):
+    """
+    target_worker run in a forked worker with the shared POOL_PARTITIONED
+    """
+    return target_worker(where_to, POOL_PARTITIONED)
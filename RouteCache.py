@@ -0,0 +1,398 @@
+"""
+
+RouteCache.py bounded cache of the rendered ShortestPath routes
+"""
+
+from collections import OrderedDict
+import pickle
+import sqlite3
+import time
+
+
+class RouteStore:
+    """
+    sqlite file shared by the worker processes, the routes are pickled and every route
+    keeps its edges so an invalidation only deletes the routes going over the changed edges.
+    the routes are keyed by (scope, where_from, where_to), the scope names the graph and the
+    routing rules the route was found with, see RouteCache.
+    the generation counter is increased on every invalidation so the processes can drop their
+    in memory routes which may be stale.
+    a read does not write, the time of the last use of the routes read is kept in memory and
+    written with the next put or every flush_every reads, so the eviction order is approximate.
+
+    the routes are unpickled from the file, anyone who can write the file can run code in every
+    process using it: keep it in a directory only writable by the user running the workers
+    """
+
+    def __init__(self, file_name: str, max_entries: int = 100000, flush_every: int = 256):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        # key -> time of the last use not written yet
+        self.used = {}
+        self.connection = sqlite3.connect(file_name, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS routes "
+                                "(scope TEXT, where_from TEXT, where_to TEXT, route BLOB, used REAL, "
+                                "PRIMARY KEY (scope, where_from, where_to))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS route_edges "
+                                "(scope TEXT, where_from TEXT, where_to TEXT, node_a TEXT, node_b TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS route_edges_edge ON route_edges (node_a, node_b)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS route_edges_route "
+                                "ON route_edges (scope, where_from, where_to)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.connection.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0)")
+
+    def __getstate__(self):
+        # a forked or pickled worker opens its own connection
+        return {"file_name": self.file_name, "max_entries": self.max_entries, "flush_every": self.flush_every}
+
+    def __setstate__(self, state):
+        self.__init__(state["file_name"], state["max_entries"], state["flush_every"])
+
+    def generation(self):
+        """
+        :return: number of invalidations done by all the processes
+        """
+        return self.connection.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def get(self, key: tuple):
+        """
+        :param key: (scope, where_from, where_to)
+        :return: the route or None
+        """
+        row = self.connection.execute("SELECT route FROM routes WHERE scope = ? AND where_from = ? AND where_to = ?",
+                                      key).fetchone()
+        if row is None:
+            return None
+        self.used[key] = time.time()
+        if len(self.used) >= self.flush_every:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                self.flush()
+        return pickle.loads(row[0])
+
+    def flush(self):
+        """
+        write the time of the last use of the routes read, in the transaction of the caller
+
+        :return: None
+        """
+        self.connection.executemany("UPDATE routes SET used = ? WHERE scope = ? AND where_from = ? AND where_to = ?",
+                                    [(used,) + key for key, used in self.used.items()])
+        self.used.clear()
+
+    def put(self, key: tuple, route, edges: list):
+        """
+        store the route and its edges, the least recently used routes are deleted above max_entries
+
+        :param key: (scope, where_from, where_to)
+        :param route: rendered route
+        :param edges: (node_a, node_b) edges of the route
+        :return: number of evicted routes
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.flush()
+            self.delete([key])
+            self.connection.execute("INSERT INTO routes VALUES (?, ?, ?, ?, ?)",
+                                    key + (pickle.dumps(route, pickle.HIGHEST_PROTOCOL), time.time()))
+            self.connection.executemany("INSERT INTO route_edges VALUES (?, ?, ?, ?, ?)",
+                                        [key + edge for edge in edges])
+            count = self.connection.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+            evicted = []
+            if count > self.max_entries:
+                evicted = self.connection.execute("SELECT scope, where_from, where_to FROM routes "
+                                                  "ORDER BY used LIMIT ?", (count - self.max_entries,)).fetchall()
+                self.delete(evicted)
+        return len(evicted)
+
+    def delete(self, keys: list):
+        """
+        :param keys: (scope, where_from, where_to) of the routes to delete
+        :return: None
+        """
+        self.connection.executemany("DELETE FROM routes WHERE scope = ? AND where_from = ? AND where_to = ?", keys)
+        self.connection.executemany("DELETE FROM route_edges WHERE scope = ? AND where_from = ? AND where_to = ?",
+                                    keys)
+
+    def invalidate(self, edges: list):
+        """
+        delete the routes going over the edges
+
+        :param edges: (node_a, node_b) changed edges
+        :return: number of deleted routes
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            keys = set()
+            for edge in edges:
+                keys.update(self.connection.execute("SELECT scope, where_from, where_to FROM route_edges "
+                                                    "WHERE node_a = ? AND node_b = ?", edge).fetchall())
+            self.delete(list(keys))
+            self.connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        return len(keys)
+
+    def clear(self):
+        """
+        delete all the routes of all the processes, RouteCache never calls it
+
+        :return: number of deleted routes
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.used.clear()
+            count = self.connection.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+            self.connection.execute("DELETE FROM routes")
+            self.connection.execute("DELETE FROM route_edges")
+            self.connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        return count
+
+
+class RouteCache:
+    """
+    LRU cache of the rendered routes keyed by (where_from, where_to). the edges used by every route
+    are indexed, so a closure only invalidates the routes going over the closed edges.
+    a change which can make a route shorter (reopened road, new edge) invalidates every route.
+    with a RouteStore the routes are shared between the processes using the same scope, the in memory
+    routes are dropped when another process invalidated the store. the generation of the store is read
+    at most every sync_seconds, so an in memory hit does not touch the store.
+    clear only drops the routes of this process: the next routes are stored under a new scope,
+    the routes of the old scope are not read anymore and leave the store with the LRU order
+    """
+
+    def __init__(self, max_entries: int = 1024, store: RouteStore = None, scope: str = "",
+                 sync_seconds: float = 0.1):
+        self.max_entries = max_entries
+        self.store = store
+        # graph and routing rules of the routes, the processes with the same scope share their routes
+        self.scope = scope
+        # number of clear, a part of the scope in the store
+        self.version = 0
+        self.sync_seconds = sync_seconds
+        self.synced = time.monotonic()
+        self.routes = OrderedDict()
+        self.edge_index = {}
+        self.generation = store.generation() if store is not None else 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.routes)
+
+    def stats(self):
+        """
+        :return: dictionary of the cache counters
+        """
+        return {"entries": len(self.routes), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def store_key(self, key: tuple):
+        """
+        :return: key of the route in the store, (scope, where_from, where_to)
+        """
+        return ("{}#{}".format(self.scope, self.version),) + key
+
+    def sync(self):
+        """
+        drop the in memory routes when another process invalidated the shared store,
+        the store is read at most every sync_seconds
+
+        :return: None
+        """
+        if self.store is not None and time.monotonic() - self.synced >= self.sync_seconds:
+            self.synced = time.monotonic()
+            generation = self.store.generation()
+            if generation != self.generation:
+                self.generation = generation
+                self.routes.clear()
+                self.edge_index.clear()
+
+    def get(self, where_from: str, where_to: str):
+        """
+        :param where_from: source node
+        :param where_to: target node
+        :return: the cached route or None, the route is shared so it should not be changed
+        """
+        key = (where_from, where_to)
+        self.sync()
+        if key in self.routes:
+            self.routes.move_to_end(key)
+            self.hits += 1
+            return self.routes[key][0]
+        if self.store is not None:
+            route = self.store.get(self.store_key(key))
+            if route is not None:
+                self.hits += 1
+                self.remember(key, route, None)
+                return route
+        self.misses += 1
+        return None
+
+    def put(self, where_from: str, where_to: str, route, path: list):
+        """
+        :param where_from: source node
+        :param where_to: target node
+        :param route: rendered route
+        :param path: node list of the route
+        :return: None
+        """
+        key = (where_from, where_to)
+        edges = list(zip(path, path[1:]))
+        self.remember(key, route, edges)
+        if self.store is not None:
+            self.evictions += self.store.put(self.store_key(key), route, edges)
+
+    def remember(self, key: tuple, route, edges: list):
+        """
+        add the route to the in memory LRU, a route read from the store has no edges,
+        it is only indexed by the store
+
+        :return: None
+        """
+        self.forget(key)
+        self.routes[key] = (route, edges)
+        for edge in edges or []:
+            self.edge_index.setdefault(edge, set()).add(key)
+        while len(self.routes) > self.max_entries:
+            self.forget(next(iter(self.routes)))
+            self.evictions += 1
+
+    def forget(self, key: tuple):
+        """
+        remove the route from the in memory LRU
+
+        :return: None
+        """
+        entry = self.routes.pop(key, None)
+        if entry is None:
+            return
+        for edge in entry[1] or []:
+            keys = self.edge_index[edge]
+            keys.discard(key)
+            if len(keys) == 0:
+                del self.edge_index[edge]
+
+    def invalidate(self, edges: list):
+        """
+        drop the routes going over the edges which became longer or were removed
+
+        :param edges: (node_a, node_b) changed edges
+        :return: None
+        """
+        keys = set()
+        for edge in edges:
+            keys.update(self.edge_index.get(edge, ()))
+        # the routes read from the store are not indexed in memory
+        keys.update(key for key, (_, route_edges) in self.routes.items() if route_edges is None)
+        for key in keys:
+            self.forget(key)
+        if self.store is None:
+            self.invalidations += len(keys)
+        else:
+            self.invalidations += self.store.invalidate(edges)
+            self.generation = self.store.generation()
+
+    def clear(self):
+        """
+        drop every route of this process, the shared store is left to the other processes
+
+        :return: None
+        """
+        self.invalidations += len(self.routes)
+        self.version += 1
+        self.routes.clear()
+        self.edge_index.clear()
+
+
+class TreeCache:
+    """
+    LRU cache of the shortest path trees keyed by (root, reverse), bounded by the bytes of the tree
+    arrays instead of a number of entries. a tree stays valid while the edges which got longer
+    are not tree edges, a new or shorter edge invalidates every tree
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.trees = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.trees)
+
+    def stats(self):
+        """
+        :return: dictionary of the cache counters
+        """
+        return {"entries": len(self.trees), "bytes": self.nbytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def get(self, root: str, reverse: bool):
+        """
+        :param root: source node of a one to all tree, target node of a reversed (many to one) tree
+        :param reverse: True for a many to one tree
+        :return: the cached tree or None
+        """
+        key = (root, reverse)
+        if key in self.trees:
+            self.trees.move_to_end(key)
+            self.hits += 1
+            return self.trees[key]
+        self.misses += 1
+        return None
+
+    def put(self, tree):
+        """
+        add the tree, the least recently used trees are evicted above max_bytes.
+        a tree larger than max_bytes is not cached
+
+        :param tree: ShortestPathTree
+        :return: None
+        """
+        key = (tree.root, tree.reverse)
+        self.forget(key)
+        if tree.nbytes() > self.max_bytes:
+            return
+        self.trees[key] = tree
+        self.nbytes += tree.nbytes()
+        while self.nbytes > self.max_bytes:
+            self.forget(next(iter(self.trees)))
+            self.evictions += 1
+
+    def forget(self, key: tuple):
+        """
+        remove the tree from the cache
+
+        :return: None
+        """
+        tree = self.trees.pop(key, None)
+        if tree is not None:
+            self.nbytes -= tree.nbytes()
+
+    def invalidate(self, edges: list):
+        """
+        drop the trees using an edge which became longer or was removed
+
+        :param edges: (node_a, node_b) changed edges
+        :return: None
+        """
+        keys = [key for key, tree in self.trees.items() if any(tree.has_edge(a, b) for a, b in edges)]
+        for key in keys:
+            self.forget(key)
+        self.invalidations += len(keys)
+
+    def clear(self):
+        """
+        drop every tree
+
+        :return: None
+        """
+        self.invalidations += len(self.trees)
+        self.trees.clear()
+        self.nbytes = 0
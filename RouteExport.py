@@ -0,0 +1,171 @@
+"""
+
+RouteExport.py headless export of rendered routes to GeoJSON, without matplotlib or a display
+
+every route is written to the file as soon as it is added, only the ids of the segments already
+written are kept so the memory does not grow with the number of routes. with dedupe, a segment
+shared by many routes is written once as a segment feature and the route features list the ids
+of their segments. the geojsonseq format (one feature per line, RFC 8142) is what tippecanoe reads
+to build vector tiles
+"""
+
+import json
+
+import numpy as np
+
+FORMATS = ("geojson", "geojsonseq")
+
+
+class GeoJsonExporter:
+    """
+    streams routes, the render_path tuples, the RouteStep records of iter_route_steps or the node
+    lists, into a GeoJSON FeatureCollection or a GeoJSON text sequence
+    """
+
+    def __init__(self, file_name: str, file_format: str = "geojson", dedupe: bool = True, precision: int = 7):
+        """
+        :param file_name: output file
+        :param file_format: geojson or geojsonseq
+        :param dedupe: write every segment once, the routes refer to the segment ids
+        :param precision: decimals of the coordinates, 7 is about a centimeter
+        """
+        if file_format not in FORMATS:
+            raise ValueError("unknown export format {}".format(file_format))
+        self.file_format = file_format
+        self.dedupe = dedupe
+        self.precision = precision
+        # (start, end) coordinates of a written segment, both directions -> segment id
+        self.segments = {}
+        self.segment_count = 0
+        self.routes = 0
+        self.features = 0
+        self.file = open(file_name, "w")
+        if file_format == "geojson":
+            self.file.write('{"type": "FeatureCollection", "features": [\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write_feature(self, geometry, properties: dict):
+        """
+        :return: None
+        """
+        feature = json.dumps({"type": "Feature", "geometry": geometry, "properties": properties})
+        if self.file_format == "geojson":
+            self.file.write(feature if self.features == 0 else ",\n" + feature)
+        else:
+            self.file.write("\x1e" + feature + "\n")
+        self.features += 1
+
+    def point(self, lat, long):
+        """
+        :return: [long, lat] position of GeoJSON, rounded to the precision
+        """
+        return [round(float(long), self.precision), round(float(lat), self.precision)]
+
+    def segment_id(self, key: tuple, reverse_key: tuple, coordinates: list, properties: dict):
+        """
+        :param key: key of the segment, reverse_key is the key of the other direction
+        :return: id of the segment, the segment is written the first time
+        >>> import os, tempfile
+        >>> with GeoJsonExporter(os.path.join(tempfile.mkdtemp(), "segments.geojson")) as exporter:
+        ...     [exporter.segment_id(key, key[::-1], [], {}) for key in ((1, 1), (1, 2), (2, 3), (2, 1))]
+        [0, 1, 2, 1]
+        """
+        segment = self.segments.get(key)
+        if segment is None:
+            # a zero length segment is its own reverse
+            segment = self.segment_count
+            self.segment_count += 1
+            self.segments[key] = segment
+            self.segments[reverse_key] = segment
+            self.write_feature({"type": "LineString", "coordinates": coordinates},
+                               dict(properties, kind="segment", id=segment))
+        return segment
+
+    def write_route(self, coordinates: list, segments: list, distance: float, properties: dict):
+        """
+        :return: None
+        """
+        properties = dict(properties or {}, kind="route", distance=distance)
+        if self.dedupe:
+            properties["segments"] = segments
+            self.write_feature(None, properties)
+        else:
+            self.write_feature({"type": "LineString", "coordinates": coordinates}, properties)
+        self.routes += 1
+
+    def add_route(self, route, properties: dict = None):
+        """
+        write a rendered route, a step is a segment (the same start and end in both directions)
+
+        :param route: a rendered path of render_path, (steps, distance, number of steps), or the steps only
+        :param properties: extra properties of the route feature, e.g. from and to
+        :return: None
+        >>> import os, tempfile
+        >>> from ShortestPath import ShortestPath
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> file_name = os.path.join(tempfile.mkdtemp(), "routes.geojson")
+        >>> with GeoJsonExporter(file_name) as exporter:
+        ...     exporter.add_route(uiuc.shortest_path('Lincoln Hall', 'Ice Arena')[0])
+        ...     exporter.add_route(uiuc.iter_route_steps(uiuc.find_path('Ice Arena', 'Lincoln Hall')))
+        >>> features = json.load(open(file_name))["features"]
+        >>> routes = [feature["properties"] for feature in features if feature["properties"]["kind"] == "route"]
+        >>> [(round(route["distance"]), route["segments"]) for route in routes]
+        [(571, [0, 1, 2, 3, 4, 5]), (544, [5, 6, 7, 0])]
+        >>> features[0]["geometry"]["type"], len(features)
+        ('LineString', 10)
+        """
+        if isinstance(route, tuple):
+            steps, distance = route[0], route[1]
+        else:
+            steps, distance = route, None
+        segments = []
+        coordinates = []
+        total = 0.0
+        for step in steps:
+            start = self.point(step["start_lat"], step["start_long"])
+            end = self.point(step["end_lat"], step["end_long"])
+            if len(coordinates) == 0:
+                coordinates.append(start)
+            coordinates.append(end)
+            total += step["dist"]
+            if self.dedupe:
+                step_properties = {"start": step["start"], "end": step["end"], "goto": step["goto"], "dist": step["dist"]}
+                segments.append(self.segment_id(tuple(start + end), tuple(end + start), [start, end], step_properties))
+        self.write_route(coordinates, segments, total if distance is None else distance, properties)
+
+    def add_path(self, nodes: list, coordinates, distance: float, properties: dict = None):
+        """
+        write a route from its node list, every edge is a segment so the routes share all their
+        common edges and the segments are bounded by the edges of the graph
+
+        :param nodes: node ids (any hashable) of the path
+        :param coordinates: (lat, long) of every node, e.g. ShortestPath.nodes_coordinates
+        :param distance: length of the path
+        :param properties: extra properties of the route feature
+        :return: None
+        """
+        coordinates = np.round(np.asarray(coordinates, dtype=np.float64)[:, ::-1], self.precision).tolist()
+        segments = []
+        if self.dedupe:
+            for i in range(len(nodes) - 1):
+                segments.append(self.segment_id((nodes[i], nodes[i + 1]), (nodes[i + 1], nodes[i]),
+                                                coordinates[i:i + 2], {}))
+        self.write_route(coordinates, segments, distance, properties)
+
+    def close(self):
+        """
+        finish the file
+
+        :return: None
+        """
+        if self.file.closed:
+            return
+        if self.file_format == "geojson":
+            self.file.write("\n]}\n")
+        self.file.close()
+
@@ -0,0 +1,550 @@
+"""
+
+RoutingEngine.py array backed (CSR) routing engine for the ShortestPath path_graph
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+import math
+import multiprocessing
+import sys
+import threading
+
+import numpy as np
+
+# mean earth radius, the same one the fast spherical distance uses
+EARTH_RADIUS = 6371008.771
+# the edge weights are ellipsoidal distances which can be a bit shorter than the
+# spherical great-circle distance, scale the heuristic down so it stays admissible
+HEURISTIC_SCALE = 0.99
+
+# engine shared with the forked distance matrix workers
+POOL_ENGINE = None
+# NoPath which is also a nx.NetworkXNoPath, made by no_path once networkx is loaded
+NETWORKX_NO_PATH = None
+
+
+class NoPath(LookupError):
+    """
+    raised for an unreachable node, see no_path
+    """
+
+
+def no_path(where_from: str, where_to: str):
+    """
+    the ShortestPath callers catch nx.NetworkXNoPath, when networkx is loaded the exception is
+    also a nx.NetworkXNoPath. a process which never imported networkx (a compiled graph queried
+    with numpy only) gets a plain NoPath without importing it
+
+    :return: exception for where_to not reachable from where_from
+    """
+    global NETWORKX_NO_PATH
+    message = "node {} not reachable from {}".format(where_to, where_from)
+    networkx = sys.modules.get("networkx")
+    if networkx is None:
+        return NoPath(message)
+    if NETWORKX_NO_PATH is None:
+        NETWORKX_NO_PATH = type("NoPath", (NoPath, networkx.NetworkXNoPath), {"__module__": __name__})
+    return NETWORKX_NO_PATH(message)
+
+
+class RoutingEngine:
+    """
+    path_graph frozen into integer indexed CSR arrays, the out edges of node i are
+    targets[offsets[i]:offsets[i + 1]] with their weights at the same positions
+    """
+
+    def __init__(self, nodes: list, offsets: np.ndarray, targets: np.ndarray, weights: np.ndarray,
+                 coordinates: np.ndarray):
+        self.nodes = nodes
+        self.node_index = {node: i for i, node in enumerate(nodes)}
+        # keep the numpy arrays (they can be memory-mapped) and index them through memoryviews,
+        # which returns python numbers without copying the arrays
+        radians = np.radians(coordinates)
+        self.arrays = {"offsets": np.ascontiguousarray(offsets, dtype=np.int64),
+                       "targets": np.ascontiguousarray(targets, dtype=np.int64),
+                       "weights": np.ascontiguousarray(weights, dtype=np.float64),
+                       "lat": np.ascontiguousarray(radians[:, 0]),
+                       "long": np.ascontiguousarray(radians[:, 1])}
+        self.offsets = memoryview(self.arrays["offsets"])
+        self.targets = memoryview(self.arrays["targets"])
+        self.weights = memoryview(self.arrays["weights"])
+        self.lat = memoryview(self.arrays["lat"])
+        self.long = memoryview(self.arrays["long"])
+        # contraction hierarchy, built on demand by contract
+        self.hierarchy = None
+        # a weight changed after the contraction, the ch queries use dijkstra until
+        # the hierarchy is contracted again in the background, see contract_in_background
+        self.hierarchy_stale = False
+        # number of weight changes, a background contraction older than the last change is dropped
+        self.weights_version = 0
+        self.contraction = None
+        self.contraction_lock = threading.Lock()
+        # turn classes of the turns algorithm, built by turn_table
+        self.turns = None
+        # engine of the reversed edges, built on demand by reverse
+        self.reversed = None
+        # nodes settled by the last search, counted by search_counts
+        self.last_settled = None
+
+    @classmethod
+    def from_digraph(cls, path_graph: "nx.DiGraph", coordinates: np.ndarray = None):
+        """
+        freeze the path_graph into CSR arrays, the out edges keep the path_graph order
+        so the searches break ties the same way networkx does
+
+        :param path_graph: graph built by ShortestPath
+        :param coordinates: (lat, long) array in the path_graph.nodes() order, parsed from the nodes if not given
+        :return: RoutingEngine
+        """
+        nodes = list(path_graph.nodes())
+        node_index = {node: i for i, node in enumerate(nodes)}
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        targets, weights = [], []
+        for i, node in enumerate(nodes):
+            for target, edge in path_graph.edge[node].items():
+                targets.append(node_index[target])
+                weights.append(edge["weight"])
+            offsets[i + 1] = len(targets)
+        if coordinates is None:
+            coordinates = np.array([[float(x) for x in path_graph.node[node]["coor"].split(",")] for node in nodes],
+                                   dtype=np.float64).reshape(-1, 2)
+        return cls(nodes, offsets, np.array(targets, dtype=np.int64), np.array(weights, dtype=np.float64),
+                   coordinates)
+
+    @classmethod
+    def from_compiled(cls, compiled):
+        """
+        use the arrays of a memory-mapped CompiledGraph directly
+
+        :param compiled: CompiledGraph
+        :return: RoutingEngine
+        """
+        return cls(compiled.nodes, compiled.offsets, compiled.targets, compiled.weight, compiled.coordinates)
+
+    def nbytes(self):
+        """
+        :return: bytes used by the engine arrays
+        """
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def set_weight(self, where_from: str, where_to: str, weight: float = None):
+        """
+        change the weight of an edge in place, the memory-mapped weights are copied on the first change
+
+        :param where_from: source node
+        :param where_to: target node
+        :param weight: new weight, None when the edge is removed from the path_graph
+        :return: False when the edge has no slot in the arrays and the engine has to be frozen again
+        """
+        u = self.node_index.get(where_from)
+        v = self.node_index.get(where_to)
+        if u is None or v is None:
+            return weight is None
+        for k in range(self.offsets[u], self.offsets[u + 1]):
+            if self.targets[k] == v:
+                if not self.arrays["weights"].flags.writeable:
+                    self.arrays["weights"] = self.arrays["weights"].copy()
+                    self.weights = memoryview(self.arrays["weights"])
+                # a removed edge keeps its slot with an infinite weight, the searches skip it
+                self.weights[k] = math.inf if weight is None else weight
+                with self.contraction_lock:
+                    self.weights_version += 1
+                    if self.hierarchy is not None:
+                        self.hierarchy_stale = True
+                if self.reversed is not None:
+                    self.reversed.set_weight(where_to, where_from, weight)
+                return True
+        return weight is None
+
+    def remove_node(self, node: str):
+        """
+        forget a node removed from the path_graph once set_weight removed its edges,
+        its slot stays without edges until the engine is frozen again
+
+        :param node: removed node
+        :return: None
+        """
+        self.node_index.pop(node, None)
+        if self.reversed is not None:
+            self.reversed.remove_node(node)
+
+    def reverse(self):
+        """
+        engine of the same nodes with every edge reversed, a search from a node of the reversed
+        engine finds the shortest paths to that node. it is built on the first call and
+        set_weight keeps it up to date
+
+        :return: RoutingEngine
+        """
+        if self.reversed is None:
+            offsets = self.arrays["offsets"]
+            targets = self.arrays["targets"]
+            sources = np.repeat(np.arange(len(self.nodes), dtype=np.int64), np.diff(offsets))
+            # the stable sort keeps the in edges of a node in the order of their source
+            order = np.argsort(targets, kind="stable")
+            reversed_offsets = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+            reversed_offsets[1:] = np.cumsum(np.bincount(targets, minlength=len(self.nodes)))
+            coordinates = np.degrees(np.column_stack([self.arrays["lat"], self.arrays["long"]]))
+            self.reversed = RoutingEngine(self.nodes, reversed_offsets, sources[order],
+                                          self.arrays["weights"][order], coordinates)
+            self.reversed.node_index = dict(self.node_index)
+        return self.reversed
+
+    def great_circle(self, a: int, b: int):
+        """
+        :return: great-circle distance in meter between node a and node b
+        """
+        lat_a, lat_b = self.lat[a], self.lat[b]
+        h = math.sin((lat_b - lat_a) / 2) ** 2 + \
+            math.cos(lat_a) * math.cos(lat_b) * math.sin((self.long[b] - self.long[a]) / 2) ** 2
+        return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+    def unwind(self, pred: dict, target: int):
+        """
+        :return: node list from the search source to the target following the predecessors
+        """
+        path = []
+        while target != -1:
+            path.append(self.nodes[target])
+            target = pred[target]
+        path.reverse()
+        return path
+
+    def search_tree(self, source: int, targets: set = None):
+        """
+        heap based dijkstra over the CSR arrays, it settles and relaxes the nodes
+        in the same order as nx.shortest_path. the search stops once every target is settled,
+        or covers every reachable node when no targets are given
+
+        :param source: source node index
+        :param targets: target node indexes
+        :return: distance and predecessor dictionaries keyed by node index
+        """
+        offsets, targets_array, weights = self.offsets, self.targets, self.weights
+        remaining = len(targets) if targets is not None else -1
+        dist = {}
+        seen = {source: 0}
+        pred = {source: -1}
+        c = count()
+        fringe = [(0, next(c), source)]
+        while fringe:
+            d, _, v = heappop(fringe)
+            if v in dist:
+                continue
+            dist[v] = d
+            if targets is not None and v in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            for k in range(offsets[v], offsets[v + 1]):
+                u = targets_array[k]
+                if u in dist or weights[k] == math.inf:
+                    continue
+                vu_dist = d + weights[k]
+                if u not in seen or vu_dist < seen[u]:
+                    seen[u] = vu_dist
+                    pred[u] = v
+                    heappush(fringe, (vu_dist, next(c), u))
+        self.last_settled = dist
+        return dist, pred
+
+    def dijkstra(self, where_from: str, where_to: str):
+        """
+        dijkstra from where_from until where_to is settled, the same path as nx.shortest_path is returned
+
+        :param where_from: source node
+        :param where_to: target node
+        :return: node list of the shortest path
+        """
+        target = self.node_index[where_to]
+        dist, pred = self.search_tree(self.node_index[where_from], {target})
+        if target not in dist:
+            raise no_path(where_from, where_to)
+        return self.unwind(pred, target)
+
+    def many_to_many(self, origins: list, destinations: list, processes: int = 1):
+        """
+        one search per origin which stops when every destination is settled,
+        the origins can be spread over a pool of forked processes sharing this engine
+
+        :param origins: origin nodes
+        :param destinations: destination nodes
+        :param processes: number of worker processes
+        :return: distance matrix (inf when unreachable) and the path tree of every origin, see path_tree
+        """
+        global POOL_ENGINE
+        sources = [self.node_index[node] for node in origins]
+        targets = [self.node_index[node] for node in destinations]
+        jobs = [(source, targets) for source in sources]
+        if processes > 1 and len(jobs) > 1:
+            POOL_ENGINE = self
+            try:
+                with multiprocessing.get_context("fork").Pool(processes) as pool:
+                    rows = pool.map(many_to_many_worker, jobs, chunksize=max(1, len(jobs) // (processes * 4)))
+            finally:
+                POOL_ENGINE = None
+        else:
+            rows = [self.search_row(source, targets) for source, targets in jobs]
+        return np.array([row for row, _ in rows], dtype=np.float64).reshape(len(sources), len(targets)), \
+            [pred for _, pred in rows]
+
+    def tree_arrays(self, source: int):
+        """
+        search tree covering every node reachable from the source
+
+        :param source: source node index
+        :return: distance (inf when unreachable) and predecessor (-1 for the source and the unreachable nodes)
+            arrays indexed by node index
+        """
+        dist, pred = self.search_tree(source)
+        distances = np.full(len(self.nodes), math.inf, dtype=np.float64)
+        predecessors = np.full(len(self.nodes), -1, dtype=np.int64)
+        distances[np.fromiter(dist, dtype=np.int64, count=len(dist))] = np.fromiter(dist.values(), dtype=np.float64,
+                                                                                  count=len(dist))
+        predecessors[np.fromiter(pred, dtype=np.int64, count=len(pred))] = np.fromiter(pred.values(), dtype=np.int64,
+                                                                                     count=len(pred))
+        return distances, predecessors
+
+    def search_counts(self):
+        """
+        :return: nodes settled and edges scanned by the last search, the edges are only counted when asked for
+        """
+        if self.last_settled is None:
+            return 0, 0
+        settled = np.fromiter(self.last_settled, dtype=np.int64, count=len(self.last_settled))
+        degrees = np.diff(self.arrays["offsets"])
+        return len(settled), int(degrees[settled].sum())
+
+    def search_row(self, source: int, targets: list):
+        """
+        :return: distances from source to every target and the path tree of the reached targets
+        """
+        dist, pred = self.search_tree(source, set(targets))
+        return [dist.get(target, math.inf) for target in targets], \
+            self.path_tree(pred, [target for target in targets if target in dist])
+
+    @staticmethod
+    def path_tree(pred: dict, targets: list):
+        """
+        the part of a search tree on the paths to the targets, the rest of the predecessors
+        of the search is dropped so a row stays small when it is sent back by a worker
+
+        :param pred: predecessors of the search, -1 for the source
+        :param targets: settled target node indexes
+        :return: node index and predecessor arrays, see unwind_tree
+        """
+        kept = {}
+        for v in targets:
+            while v != -1 and v not in kept:
+                kept[v] = pred[v]
+                v = kept[v]
+        return np.fromiter(kept, dtype=np.int64, count=len(kept)), \
+            np.fromiter(kept.values(), dtype=np.int64, count=len(kept))
+
+    def unwind_tree(self, tree: tuple, target: int):
+        """
+        :param tree: node index and predecessor arrays of path_tree
+        :return: node list from the search source to the target
+        """
+        nodes, preds = tree
+        return self.unwind(dict(zip(nodes.tolist(), preds.tolist())), target)
+
+    def astar(self, where_from: str, where_to: str):
+        """
+        A* over the CSR arrays, the great-circle distance to the target is used as the heuristic
+
+        :param where_from: source node
+        :param where_to: target node
+        :return: node list of the shortest path
+        """
+        source = self.node_index[where_from]
+        target = self.node_index[where_to]
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        closed = set()
+        seen = {source: 0}
+        pred = {source: -1}
+        c = count()
+        fringe = [(0, next(c), source, 0)]
+        self.last_settled = closed
+        while fringe:
+            _, _, v, d = heappop(fringe)
+            if v in closed:
+                continue
+            if v == target:
+                return self.unwind(pred, target)
+            closed.add(v)
+            for k in range(offsets[v], offsets[v + 1]):
+                u = targets[k]
+                if u in closed or weights[k] == math.inf:
+                    continue
+                vu_dist = d + weights[k]
+                if u not in seen or vu_dist < seen[u]:
+                    seen[u] = vu_dist
+                    pred[u] = v
+                    heappush(fringe, (vu_dist + HEURISTIC_SCALE * self.great_circle(u, target), next(c), u,
+                                      vu_dist))
+        raise no_path(where_from, where_to)
+
+    def restricted_astar(self, source: int, target: int, blocked_nodes: set, blocked_edges: set, limit: float):
+        """
+        A* which does not pass the blocked nodes and edges and gives up above the cost limit,
+        the spur search of k_shortest_paths. equal estimates are broken by the longest distance
+        so the many equally short paths of a street grid are not all expanded
+
+        :return: cost and node indexes of the path, None when there is no path within the limit
+        """
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        closed = set()
+        seen = {source: 0}
+        pred = {source: -1}
+        fringe = [(0, 0, source)]
+        while fringe:
+            _, d, v = heappop(fringe)
+            d = -d
+            if v in closed:
+                continue
+            if v == target:
+                path = []
+                while v != -1:
+                    path.append(v)
+                    v = pred[v]
+                path.reverse()
+                return d, path
+            closed.add(v)
+            for k in range(offsets[v], offsets[v + 1]):
+                u = targets[k]
+                if u in closed or u in blocked_nodes or weights[k] == math.inf or (v, u) in blocked_edges:
+                    continue
+                vu_dist = d + weights[k]
+                if u not in seen or vu_dist < seen[u]:
+                    estimate = vu_dist + HEURISTIC_SCALE * self.great_circle(u, target)
+                    if estimate > limit:
+                        continue
+                    seen[u] = vu_dist
+                    pred[u] = v
+                    heappush(fringe, (estimate, -vu_dist, u))
+        return None
+
+    def k_shortest_paths(self, where_from: str, where_to: str, k: int, max_detour_ratio: float = None):
+        """
+        Yen's k shortest simple paths over the CSR arrays, the paths are generated lazily in cost order.
+        the spur searches are goal directed and, with max_detour_ratio, never leave the area a detour
+        within the ratio can reach, so their cost depends on the trip length and not the graph size
+
+        :param where_from: source node
+        :param where_to: target node
+        :param k: maximum number of paths
+        :param max_detour_ratio: stop at the first path longer than this ratio of the shortest one
+        :return: generator of the node lists
+        """
+        source = self.node_index[where_from]
+        target = self.node_index[where_to]
+        first = self.restricted_astar(source, target, set(), set(), math.inf)
+        if first is None:
+            raise no_path(where_from, where_to)
+        limit = first[0] * max_detour_ratio if max_detour_ratio is not None else math.inf
+        found = [first[1]]
+        candidates = []
+        queued = {tuple(first[1])}
+        c = count()
+        yield [self.nodes[i] for i in first[1]]
+        while len(found) < k:
+            previous = found[-1]
+            root_cost = 0
+            for i in range(len(previous) - 1):
+                root = previous[:i + 1]
+                blocked_edges = {(path[i], path[i + 1]) for path in found if path[:i + 1] == root}
+                spur = self.restricted_astar(previous[i], target, set(root[:-1]), blocked_edges, limit - root_cost)
+                if spur is not None:
+                    path = root[:-1] + spur[1]
+                    if tuple(path) not in queued:
+                        queued.add(tuple(path))
+                        heappush(candidates, (root_cost + spur[0], next(c), path))
+                root_cost += self.edge_weight(previous[i], previous[i + 1])
+            if len(candidates) == 0:
+                return
+            _, _, path = heappop(candidates)
+            found.append(path)
+            yield [self.nodes[i] for i in path]
+
+    def edge_weight(self, u: int, v: int):
+        """
+        :return: weight of the edge from node index u to v, the lightest one when there are several
+        """
+        return min(self.weights[k] for k in range(self.offsets[u], self.offsets[u + 1]) if self.targets[k] == v)
+
+    def contract(self):
+        """
+        build the contraction hierarchy used by the ch algorithm
+
+        :return: ContractionHierarchy
+        """
+        from ContractionHierarchy import ContractionHierarchy
+        if self.hierarchy is None or self.hierarchy_stale:
+            self.hierarchy = ContractionHierarchy.from_engine(self)
+            self.hierarchy_stale = False
+        return self.hierarchy
+
+    def contract_in_background(self):
+        """
+        contract the hierarchy again in a thread, the queries do not wait for it.
+        the hierarchy replaces the stale one only when no weight changed during the contraction,
+        otherwise the next ch query starts another one
+
+        :return: the contraction thread
+        """
+        from ContractionHierarchy import ContractionHierarchy
+        if self.contraction is not None and self.contraction.is_alive():
+            return self.contraction
+        version = self.weights_version
+
+        def contract():
+            hierarchy = ContractionHierarchy.from_engine(self)
+            with self.contraction_lock:
+                if self.weights_version == version:
+                    self.hierarchy, self.hierarchy_stale = hierarchy, False
+
+        self.contraction = threading.Thread(target=contract, name="contract", daemon=True)
+        self.contraction.start()
+        return self.contraction
+
+    def turn_table(self, bearings: np.ndarray, costs: dict = None, restrictions: list = (), no_left_turn: list = ()):
+        """
+        build the turn table used by the turns algorithm, see TurnTable
+
+        :param bearings: bearing in degrees of every edge, in the CSR order
+        :return: TurnTable
+        """
+        from TurnTable import TurnTable
+        self.turns = TurnTable(self, bearings, costs, restrictions, no_left_turn)
+        return self.turns
+
+    def shortest_path(self, where_from: str, where_to: str, algorithm: str = "dijkstra"):
+        """
+        :param where_from: source node
+        :param where_to: target node
+        :param algorithm: dijkstra, astar, ch (dijkstra is used until contract builds the hierarchy,
+            and while a hierarchy older than a weight change is contracted again in the background)
+            or turns (dijkstra is used until turn_table builds the table)
+        :return: node list of the shortest path
+        """
+        if algorithm == "astar":
+            return self.astar(where_from, where_to)
+        if algorithm == "ch" and self.hierarchy is not None:
+            if not self.hierarchy_stale:
+                return self.hierarchy.query(where_from, where_to)
+            self.contract_in_background()
+        if algorithm == "turns" and self.turns is not None:
+            return self.turns.query(where_from, where_to)
+        return self.dijkstra(where_from, where_to)
+
+
+def many_to_many_worker(job: tuple):
+    """
+    distance matrix row computed in a forked worker with the shared POOL_ENGINE
+
+    :param job: source node index and target node indexes
+    :return: distances and predecessors of the row
+    """
+    return POOL_ENGINE.search_row(*job)
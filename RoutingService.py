@@ -0,0 +1,296 @@
+"""
+
+RoutingService.py long running routing service for a ShortestPath graph,
+one json request per line in and one json response per line out over TCP
+
+request:  {"id": 1, "from": "Lincoln Hall", "to": 525, "deadline_ms": 500, "depart_at": "Sat 12:00"}
+response: {"id": 1, "status": "ok", "distance": 571.4, "path": [...]}
+
+the status is ok, not_found (unknown building name or mail code), no_path,
+timeout (the deadline passed), busy (the request queue is full) or error.
+depart_at is optional, the scheduled closures of the graph apply at that time
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import itertools
+import json
+import logging
+import multiprocessing
+import threading
+import time
+
+from Schedule import minute_of_week
+from ShortestPath import ShortestPath
+
+# graph shared with the forked workers, read-only after the fork
+SERVICE_GRAPH = None
+
+
+def route_batch(jobs: list):
+    """
+    answer a batch of route requests with ShortestPath.shortest_paths of the SERVICE_GRAPH, so the
+    algorithm, the route cache and the schedule of the graph apply. the requests with the same origin
+    and departure time are answered together, an expired request is not searched
+
+    :param jobs: (ticket, where_from, where_to, depart_at, deadline) tuples, depart_at is a minute of
+        the week or None and the deadline is a time.time() value
+    :return: response dictionaries keyed by the ticket
+    """
+    graph = SERVICE_GRAPH
+    responses = {}
+    groups = {}
+    for ticket, where_from, where_to, depart_at, deadline in jobs:
+        groups.setdefault((where_from, depart_at), []).append((ticket, where_to, deadline))
+    for (where_from, depart_at), requests in groups.items():
+        requests = [request for request in requests if request[2] > time.time()]
+        if len(requests) == 0:
+            continue
+        routes = graph.shortest_paths(where_from, [where_to for _, where_to, _ in requests], depart_at)
+        for ticket, where_to, _ in requests:
+            if routes[where_to] is None:
+                responses[ticket] = {"status": "no_path"}
+            else:
+                steps, distance, _ = routes[where_to][0]
+                responses[ticket] = {"status": "ok", "distance": distance, "path": steps}
+    return responses
+
+
+class RoutingService:
+    """
+    asyncio front end of a worker pool sharing one read-only graph. the requests are queued,
+    the batcher takes up to batch_size requests (waiting at most batch_window seconds for them)
+    and sends the batch to a worker. a full queue answers busy, a connection stops being read
+    while it has max_inflight requests waiting, and a request not answered before its deadline
+    answers timeout.
+    the workers are forked with a copy of the graph, when the graph changes (ShortestPath.revision)
+    the batcher forks new workers before sending the next batch, the batches already sent are
+    answered by the old workers
+    """
+
+    def __init__(self, graph: ShortestPath, workers: int = 2, batch_size: int = 32, batch_window: float = 0.002,
+                 max_pending: int = 1024, max_inflight: int = 64, deadline: float = 1.0):
+        global SERVICE_GRAPH
+        SERVICE_GRAPH = graph
+        self.graph = graph
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_pending = max_pending
+        self.max_inflight = max_inflight
+        self.deadline = deadline
+        self.revision = None
+        self.executor = None
+        self.fork_workers()
+        self.queue = None
+        self.server = None
+        self.batcher_task = None
+        self.tickets = itertools.count()
+        self.counters = {"ok": 0, "not_found": 0, "no_path": 0, "timeout": 0, "busy": 0, "error": 0, "batches": 0}
+
+    def fork_workers(self):
+        """
+        start the workers with the current graph, the previous workers finish their batches and exit
+
+        :return: None
+        """
+        if self.executor is not None:
+            # waiting in a thread keeps the batcher going, shutdown(wait=False) of python 3.7 fails once collected
+            threading.Thread(target=self.executor.shutdown, daemon=True).start()
+        self.revision = self.graph.revision
+        if self.workers > 0:
+            # the workers are forked now so they share the graph pages with this process
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+            list(self.executor.map(time.sleep, [0] * self.workers))
+        else:
+            self.executor = ThreadPoolExecutor(1)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765):
+        """
+        start listening and batching
+
+        :return: asyncio server, its sockets give the port when port 0 is used
+        """
+        self.queue = asyncio.Queue(self.max_pending)
+        self.batcher_task = asyncio.ensure_future(self.batcher())
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        """
+        stop listening and shut the workers down
+
+        :return: None
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher_task.cancel()
+        self.executor.shutdown()
+
+    def resolve(self, building):
+        """
+        :param building: building name or mail code
+        :return: building node or None
+        """
+        if isinstance(building, int) or (isinstance(building, str) and building.isdigit()):
+            return self.graph.search_node_by_mail_code(building)
+        if isinstance(building, str):
+            return self.graph.search_node_by_name(building)
+        return None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        serve one connection, the responses are written in completion order
+
+        :return: None
+        """
+        inflight = asyncio.Semaphore(self.max_inflight)
+        pending = set()
+        try:
+            while True:
+                await inflight.acquire()
+                line = await reader.readline()
+                if not line:
+                    inflight.release()
+                    break
+                task = asyncio.ensure_future(self.answer(line, writer))
+                pending.add(task)
+
+                def answered(done):
+                    pending.discard(done)
+                    inflight.release()
+                task.add_done_callback(answered)
+            if pending:
+                await asyncio.wait(pending)
+        except ConnectionError as ex:
+            logging.error(ex)
+        finally:
+            writer.close()
+
+    async def answer(self, line: bytes, writer: asyncio.StreamWriter):
+        """
+        queue the request of the line and write its response
+
+        :return: None
+        """
+        response = await self.route(line)
+        self.counters[response["status"]] += 1
+        writer.write(json.dumps(response).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def route(self, line: bytes):
+        """
+        :return: response dictionary of the request line
+        """
+        try:
+            request = json.loads(line.decode("utf-8"))
+            request_id = request.get("id")
+            where_from = self.resolve(request["from"])
+            where_to = self.resolve(request["to"])
+            deadline = request.get("deadline_ms", self.deadline * 1000) / 1000
+            depart_at = minute_of_week(request["depart_at"]) if request.get("depart_at") is not None else None
+        except (ValueError, KeyError, TypeError, AttributeError) as ex:
+            return {"id": None, "status": "error", "message": str(ex)}
+        if where_from is None or where_to is None:
+            return {"id": request_id, "status": "not_found"}
+        future = asyncio.get_running_loop().create_future()
+        # the clients choose their ids, the batches use a ticket which is unique over all the connections
+        try:
+            self.queue.put_nowait(((next(self.tickets), where_from, where_to, depart_at, time.time() + deadline),
+                                   future))
+        except asyncio.QueueFull:
+            return {"id": request_id, "status": "busy"}
+        try:
+            response = await asyncio.wait_for(future, deadline)
+        except asyncio.TimeoutError:
+            response = {"status": "timeout"}
+        return dict(response, id=request_id)
+
+    async def batcher(self):
+        """
+        send the queued requests to the workers in batches, at most two batches per worker
+        are in flight so the requests wait in the queue, where the backpressure applies
+
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        running = asyncio.Semaphore(max(1, self.workers) * 2)
+        while True:
+            batch = [await self.queue.get()]
+            end = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = end - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await running.acquire()
+            if self.graph.revision != self.revision:
+                self.fork_workers()
+            self.counters["batches"] += 1
+            futures = {job[0]: future for job, future in batch}
+            done = loop.run_in_executor(self.executor, route_batch, [job for job, _ in batch])
+            done.add_done_callback(functools.partial(self.deliver, futures, running))
+
+    @staticmethod
+    def deliver(futures: dict, running: asyncio.Semaphore, result: asyncio.Future):
+        """
+        give every waiting request its response, the expired ones were already answered
+
+        :return: None
+        """
+        running.release()
+        missing = {"status": "timeout"}
+        if result.exception() is not None:
+            logging.error(result.exception())
+            responses, missing = {}, {"status": "error", "message": str(result.exception())}
+        else:
+            responses = result.result()
+        for ticket, future in futures.items():
+            if not future.done():
+                future.set_result(responses.get(ticket, missing))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ShortestPath routing service, json lines over TCP")
+    parser.add_argument("--buildings", default="buildings.csv")
+    parser.add_argument("--streets", default="streets.csv")
+    parser.add_argument("--edges", default="edges.csv")
+    parser.add_argument("--compiled", default=None, help="compiled graph file, used instead of the csv files")
+    parser.add_argument("--bulk", action="store_true", help="use the bulk graph loader")
+    parser.add_argument("--stream", action="store_true", help="use the streaming loader for the large csv files")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2, help="worker processes, 0 answers in a thread")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batch-window-ms", type=float, default=2)
+    parser.add_argument("--max-pending", type=int, default=1024, help="queued requests before answering busy")
+    parser.add_argument("--deadline-ms", type=float, default=1000, help="default request deadline")
+    args = parser.parse_args()
+
+    if args.compiled is not None:
+        graph = ShortestPath.load_compiled(args.compiled)
+    else:
+        graph = ShortestPath(buildings_file=args.buildings, streets_file=args.streets, edges_file=args.edges,
+                             bulk=args.bulk, stream=args.stream)
+    graph.freeze_graph()
+    service = RoutingService(graph, args.workers, args.batch_size, args.batch_window_ms / 1000, args.max_pending,
+                             deadline=args.deadline_ms / 1000)
+
+    async def serve():
+        server = await service.start(args.host, args.port)
+        print("serving on {}:{}".format(args.host, args.port))
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
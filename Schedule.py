@@ -0,0 +1,239 @@
+"""
+
+Schedule.py scheduled closures and slowdowns of the path_graph edges over a week and the
+time-dependent search of ShortestPath.shortest_path(..., depart_at=...)
+
+schedule csv file, one time window per row:
+
+node_a,node_b,start,end,factor
+East Armory Ave-S 6th Street,S 6th Street-East Chalmers Street,22:00,06:00,closed
+S Wright Street-East Chalmers Street,S 6th Street-East Chalmers Street,Sat 12:00,Sat 18:00,3
+
+the window applies every day when the times have no day, it ends the next day when end is not after start.
+both times of a window have a day or none has one.
+an empty or closed factor closes the edge (the 9e9 weight of the inactive roads), any other factor
+multiplies the edge weight. the overlapping windows of an edge keep the largest factor
+"""
+
+from datetime import datetime, time as day_time
+from heapq import heappush, heappop
+from itertools import count
+from math import gcd
+import logging
+import math
+
+import numpy as np
+
+from RoutingEngine import no_path
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+# weight of a closed edge, the same as close_edges
+CLOSED_WEIGHT = 9e9
+# walking speed in meter per second, gives the time a node is reached after the departure
+WALKING_SPEED = 1.4
+
+
+def parse_time(text: str):
+    """
+    :param text: "HH:MM" or "Day HH:MM"
+    :return: day index (None for every day) and minute of the day
+    >>> parse_time("22:30"), parse_time("Sat 06:00")
+    ((None, 1350), (5, 360))
+    """
+    parts = text.split()
+    day = DAYS.index(parts[0][:3].title()) if len(parts) == 2 else None
+    hours, minutes = parts[-1].split(":")
+    return day, int(hours) * 60 + int(minutes)
+
+
+def minute_of_week(when):
+    """
+    :param when: datetime, time of the day or "HH:MM" (on Monday), "Day HH:MM" or minutes since Monday 00:00
+    :return: minute of the week
+    """
+    if isinstance(when, datetime):
+        return when.weekday() * DAY_MINUTES + when.hour * 60 + when.minute + when.second / 60
+    if isinstance(when, day_time):
+        return when.hour * 60 + when.minute + when.second / 60
+    if isinstance(when, str):
+        day, minute = parse_time(when)
+        return (day or 0) * DAY_MINUTES + minute
+    return float(when) % WEEK_MINUTES
+
+
+def week_windows(start: str, end: str):
+    """
+    :return: (start, end) minutes of the week covered by the window, split at the end of the week
+    >>> week_windows("Sat 22:00", "Mon 06:00")
+    [(8520, 10080), (0, 360)]
+    >>> week_windows("22:00", "Sat 06:00")
+    Traceback (most recent call last):
+    ...
+    ValueError: schedule window 22:00 - Sat 06:00 has a day on one side only
+    """
+    start_day, start_minute = parse_time(start)
+    end_day, end_minute = parse_time(end)
+    if (start_day is None) != (end_day is None):
+        raise ValueError("schedule window {} - {} has a day on one side only".format(start, end))
+    days = range(7) if start_day is None else [start_day]
+    windows = []
+    for day in days:
+        first = day * DAY_MINUTES + start_minute
+        if end_day is not None:
+            last = end_day * DAY_MINUTES + end_minute
+            if last <= first:
+                last += WEEK_MINUTES
+        else:
+            last = day * DAY_MINUTES + end_minute
+            if last <= first:
+                last += DAY_MINUTES
+        if last > WEEK_MINUTES:
+            windows += [(first, WEEK_MINUTES), (0, last - WEEK_MINUTES)]
+        else:
+            windows.append((first, last))
+    return windows
+
+
+class EdgeSchedule:
+    """
+    weight profiles of the scheduled edges of a RoutingEngine. every profile is a piecewise constant
+    factor over the week stored in flat arrays: the pieces of scheduled edge s start at
+    profile_times[profile_offsets[s]:profile_offsets[s + 1]] with their factors at the same positions.
+    the week is cut in buckets as wide as the greatest common divisor of all the piece starts,
+    so no profile changes inside a bucket: bucket_state gives the state of every bucket and
+    state_factors the factors of the scheduled edges which are not at 1 in a state. a query looks
+    a factor up in constant time, and a new schedule only builds these small arrays again, not the engine
+    """
+
+    def __init__(self, engine, rows: list, speed: float = WALKING_SPEED):
+        """
+        :param engine: RoutingEngine
+        :param rows: (node_a, node_b, start, end, factor) windows, see the schedule file
+        :param speed: speed in meter per second
+        """
+        self.engine = engine
+        self.speed = speed
+        windows = {}
+        for node_a, node_b, start, end, factor in rows:
+            k = self.edge_slot(node_a, node_b)
+            if k is None:
+                logging.error("scheduled road {} -> {} is not in the graph, it is ignored".format(node_a, node_b))
+                continue
+            factor = math.inf if str(factor).strip().lower() in ("", "closed") else float(factor)
+            windows.setdefault(k, []).extend((first, last, factor) for first, last in week_windows(start, end))
+        self.edges = np.array(sorted(windows), dtype=np.int64)
+        self.scheduled = np.full(len(engine.arrays["targets"]), -1, dtype=np.int32)
+        self.scheduled[self.edges] = np.arange(len(self.edges), dtype=np.int32)
+
+        # piecewise profiles: a piece starts at every window start and end of the edge
+        offsets, times, factors = [0], [], []
+        for k in self.edges.tolist():
+            starts = sorted({0} | {minute for first, last, _ in windows[k] for minute in (first, last)}
+                            - {WEEK_MINUTES})
+            for minute in starts:
+                times.append(minute)
+                factors.append(max([factor for first, last, factor in windows[k] if first <= minute < last] or [1.0]))
+            offsets.append(len(times))
+        self.profile_offsets = np.array(offsets, dtype=np.int64)
+        self.profile_times = np.array(times, dtype=np.int32)
+        self.profile_factors = np.array(factors, dtype=np.float64)
+
+        self.bucket_minutes = gcd(WEEK_MINUTES, int(np.gcd.reduce(self.profile_times))) if len(times) > 0 \
+            else WEEK_MINUTES
+        # the pieces cut the week in intervals, an interval state holds the edges with a factor other than 1
+        bounds = np.unique(np.append(self.profile_times, [0, WEEK_MINUTES]))
+        # every piece starts and ends on a bound
+        bound_index = {minute: j for j, minute in enumerate(bounds.tolist())}
+        intervals = [{} for _ in range(len(bounds) - 1)]
+        for s in range(len(self.edges)):
+            ends = times[offsets[s] + 1:offsets[s + 1]] + [WEEK_MINUTES]
+            for first, last, factor in zip(times[offsets[s]:offsets[s + 1]], ends, factors[offsets[s]:offsets[s + 1]]):
+                if factor != 1.0:
+                    for j in range(bound_index[first], bound_index[last]):
+                        intervals[j][s] = factor
+        states = {}
+        interval_state = [states.setdefault(tuple(sorted(active.items())), len(states)) for active in intervals]
+        self.state_factors = [dict(state) for state in states]
+        bucket_starts = np.arange(0, WEEK_MINUTES, self.bucket_minutes)
+        self.bucket_state = [interval_state[j] for j in
+                             (np.searchsorted(bounds, bucket_starts, side="right") - 1).tolist()]
+
+    def edge_slot(self, node_a: str, node_b: str):
+        """
+        :return: CSR position of the edge from node_a to node_b, None when there is none
+        """
+        engine = self.engine
+        u, v = engine.node_index.get(node_a), engine.node_index.get(node_b)
+        if u is None or v is None:
+            return None
+        for k in range(engine.offsets[u], engine.offsets[u + 1]):
+            if engine.targets[k] == v:
+                return k
+        return None
+
+    def nbytes(self):
+        """
+        :return: bytes used by the profiles and the buckets
+        """
+        return self.scheduled.nbytes + self.profile_offsets.nbytes + self.profile_times.nbytes + \
+            self.profile_factors.nbytes + len(self.bucket_state) * 4 + sum(len(state) for state in self.state_factors) * 12
+
+    def factor(self, node_a: str, node_b: str, when):
+        """
+        :param when: time of the week, see minute_of_week
+        :return: weight factor of the edge at the time, inf when it is closed
+        """
+        s = self.scheduled[self.edge_slot(node_a, node_b)]
+        return self.state_factors[self.bucket_state[int(minute_of_week(when) // self.bucket_minutes)]].get(s, 1.0)
+
+    def query(self, where_from: str, where_to: str, depart_at):
+        """
+        dijkstra where an edge is weighted with its factor at the time its start node is reached,
+        the time goes on at the speed over the weighted distance
+
+        :param depart_at: departure time, see minute_of_week
+        :return: node list of the shortest path
+        """
+        engine = self.engine
+        offsets, targets, weights = engine.offsets, engine.targets, engine.weights
+        scheduled = memoryview(self.scheduled)
+        bucket_state, state_factors, width = self.bucket_state, self.state_factors, self.bucket_minutes
+        depart = minute_of_week(depart_at)
+        minutes_per_meter = 1 / (self.speed * 60)
+        source = engine.node_index[where_from]
+        target = engine.node_index[where_to]
+        dist = {}
+        seen = {source: 0}
+        pred = {source: -1}
+        c = count()
+        fringe = [(0, next(c), source)]
+        while fringe:
+            d, _, v = heappop(fringe)
+            if v in dist:
+                continue
+            dist[v] = d
+            if v == target:
+                engine.last_settled = dist
+                return engine.unwind(pred, target)
+            factors = None
+            for k in range(offsets[v], offsets[v + 1]):
+                u = targets[k]
+                if u in dist or weights[k] == math.inf:
+                    continue
+                weight = weights[k]
+                s = scheduled[k]
+                if s >= 0:
+                    if factors is None:
+                        bucket = int((depart + d * minutes_per_meter) % WEEK_MINUTES // width)
+                        factors = state_factors[bucket_state[bucket]]
+                    if s in factors:
+                        weight = CLOSED_WEIGHT if factors[s] == math.inf else weight * factors[s]
+                vu_dist = d + weight
+                if u not in seen or vu_dist < seen[u]:
+                    seen[u] = vu_dist
+                    pred[u] = v
+                    heappush(fringe, (vu_dist, next(c), u))
+        engine.last_settled = dist
+        raise no_path(where_from, where_to)
@@ -3,41 +3,130 @@
 ShortestPath.py main file for ShortestPath class
 """
 
-import pandas as pd
+from __future__ import annotations
+
+import numpy as np
 import networkx as nx
-import matplotlib.pyplot as plt
-from pygeodesy import ellipsoidalVincenty as ev
+import itertools
 import logging
+import os
+import sys
+import time
+from CompiledGraph import CompiledGraph, hash_source_files
+from RoutingEngine import RoutingEngine, EARTH_RADIUS
+from RouteCache import RouteCache, RouteStore, TreeCache
+from BuildingIndex import BuildingIndex
+from SpatialIndex import SpatialIndex
+from PartitionedGraph import PartitionedGraph
+from Metrics import Metrics
+from Schedule import EdgeSchedule, week_windows
+from RouteExport import GeoJsonExporter
+
+# WGS84 ellipsoid, the same datum pygeodesy uses for ellipsoidalVincenty.LatLon
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+# dtypes of the streaming loader, the few street names are categorical and the neighbour
+# intersection names, which are almost all different, are interned strings
+BUILDINGS_DTYPES = {"name": object, "coordinate": object, "mail_code": "int64"}
+EDGES_DTYPES = {"node_a": "category", "node_b": "category", "node_name": object, "intersection": object,
+                "N": object, "S": object, "E": object, "W": object}
+# attribute -> part of a compiled graph which builds it on first use, see load_compiled
+COMPILED_PARTS = {"path_graph": "graph", "street_segments": "graph", "closed_roads": "graph",
+                  "original_weights": "graph", "one_way_edges": "graph", "buildings": "datasets",
+                  "streets": "datasets", "edges": "datasets", "one_direction": "datasets",
+                  "inactive_road": "datasets", "building_index": "building_index"}
+# frames of a streamed graph which are built from the path_graph on first use, see stream_network_dataset
+STREAMED_FRAMES = ("buildings", "edges")
+
+class RouteStep:
+    """
+    one step of a rendered path, the coordinates are floats and start_node / end_node
+    are the path nodes the step starts and ends at. the step can be read like the
+    rendered path dictionary, step["goto"] is step.goto
+    """
+    __slots__ = ("start", "end", "dist", "bearing", "goto", "start_lat", "start_long", "end_lat", "end_long",
+                 "pass_by", "start_node", "end_node")
+
+    def __init__(self, start: str, end: str, dist: float, bearing: float, goto: str, start_coordinate: tuple,
+                 end_coordinate: tuple, start_node: str, end_node: str):
+        self.start = start
+        self.end = end
+        self.dist = dist
+        self.bearing = bearing
+        self.goto = goto
+        self.start_lat, self.start_long = start_coordinate
+        self.end_lat, self.end_long = end_coordinate
+        self.pass_by = []
+        self.start_node = start_node
+        self.end_node = end_node
+
+    def __getitem__(self, key: str):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return "RouteStep({!r}, {!r}, {:.2f}, {!r})".format(self.start, self.end, self.dist, self.goto)
+
+    def as_dict(self, path_graph: nx.DiGraph):
+        """
+        :param path_graph: graph the step is rendered from, its coordinate strings are used
+        :return: the rendered path dictionary of the step
+        """
+        start_lat, start_long = path_graph.node[self.start_node]["coor"].split(",")
+        end_lat, end_long = path_graph.node[self.end_node]["coor"].split(",")
+        return {'start': self.start, 'end': self.end, 'dist': self.dist, 'bearing': self.bearing, 'goto': self.goto,
+                "start_lat": start_lat, "start_long": start_long, "end_lat": end_lat, "end_long": end_long,
+                "pass_by": list(self.pass_by)}
+
 
 class PathRenderer:
 
     def __init__(self,rendered_path:tuple):
         self.rendered_path = rendered_path
 
-    def show_path_str(self):
+    def show_path_str(self, steps=None):
         """
         Sort output paths for the shortest path
 
-        :param rendered_path:
+        :param steps: step dictionaries or RouteStep records, a stream of ShortestPath.iter_route_steps
+            can be given directly. the rendered path steps are used by default
         :return:
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> path = uiuc.find_path('Swanlund Administration Building','University YMCA')
+        >>> rendered = PathRenderer(uiuc.render_path([path])[0])
+        >>> rendered.show_path_str() == PathRenderer(None).show_path_str(uiuc.iter_route_steps(path))
+        True
         """
-
+        if steps is None:
+            steps = self.rendered_path[0]
         output = ""
-        for i, path in enumerate(self.rendered_path[0]):
-            if i == 0:
-                # print("From {} go {} to {}".format(path["start"], path["goto"], path["end"]))
-                output += "Starting on {} go {} to {}\n".format(path["start"], path["goto"], path["end"])
-            elif i == (self.rendered_path[2] - 1):
-                # print("The destination is {} from the {}".format(path["goto"], rendered_path[0][i - 1]["start"]))
-                output += "The {} is {} from the {}\n".format(self.rendered_path[0][i - 1]["end"], path["goto"],
-                                                              self.rendered_path[0][i - 1]["start"])
-            else:
-                # print("From {} go {} about {:.2f} m to {}".format(path["start"], path["goto"], path["dist"], path["end"]))
-                output += "At {}, turn {} about {:.2f} m to {}".format(path["start"], path["goto"], path["dist"], path["end"])
-                if len(path["pass_by"]) > 0:
-                    output += " (passing by: {})".format(",".join(path["pass_by"]))
-                output += "\n"
-        output += "Approximate Total Path: {:.2f} m\n".format(self.rendered_path[1])
+        total_distance = 0
+        previous = None
+        path = None
+        i = 0
+        # a step is written once the next one is known, the last step is written differently
+        for following in itertools.chain(steps, [None]):
+            if path is not None:
+                total_distance += path["dist"]
+                if i == 0:
+                    # print("From {} go {} to {}".format(path["start"], path["goto"], path["end"]))
+                    output += "Starting on {} go {} to {}\n".format(path["start"], path["goto"], path["end"])
+                elif following is None:
+                    # print("The destination is {} from the {}".format(path["goto"], rendered_path[0][i - 1]["start"]))
+                    output += "The {} is {} from the {}\n".format(previous["end"], path["goto"], previous["start"])
+                else:
+                    # print("From {} go {} about {:.2f} m to {}".format(path["start"], path["goto"], path["dist"], path["end"]))
+                    output += "At {}, turn {} about {:.2f} m to {}".format(path["start"], path["goto"], path["dist"], path["end"])
+                    if len(path["pass_by"]) > 0:
+                        output += " (passing by: {})".format(",".join(path["pass_by"]))
+                    output += "\n"
+                i += 1
+                previous = path
+            path = following
+        if self.rendered_path is not None:
+            total_distance = self.rendered_path[1]
+        output += "Approximate Total Path: {:.2f} m\n".format(total_distance)
         return output
 
     def show_path_map(self):
@@ -45,6 +134,8 @@ class PathRenderer:
         This function will show the path in the map using mpleaflet
         :return:
         """
+        # the plotting libraries take seconds to import, they are only loaded to show a map
+        import matplotlib.pyplot as plt
         import mplleaflet
         plt.figure(figsize=(10, 10))
         longitude = []
@@ -64,6 +155,117 @@ class PathRenderer:
         plt.plot(longitude, latitude, 'rs')  # Draw red squares
         mplleaflet.show()
 
+class DistanceMatrix:
+    """
+    distances from every origin to every destination, the paths are
+    only unwound from the search trees when they are asked for
+    """
+
+    def __init__(self, graph, engine: RoutingEngine, origins: list, destinations: list, distances: np.ndarray,
+                 trees: list):
+        self.graph = graph
+        self.engine = engine
+        self.origins = origins
+        self.destinations = destinations
+        self.distances = distances
+        self.trees = trees
+
+    def path(self, i: int, j: int):
+        """
+        :param i: origin position
+        :param j: destination position
+        :return: node list from origins[i] to destinations[j], None if there is no path
+        """
+        if np.isinf(self.distances[i, j]):
+            return None
+        return self.engine.unwind_tree(self.trees[i], self.engine.node_index[self.destinations[j]])
+
+    def render(self, i: int, j: int):
+        """
+        :param i: origin position
+        :param j: destination position
+        :return: rendered path from origins[i] to destinations[j] like shortest_path, None if there is no path
+        """
+        path = self.path(i, j)
+        return None if path is None else self.graph.render_path([path])
+
+class ShortestPathTree:
+    """
+    shortest paths from the root to every node (one to all), or from every node to the root
+    when reverse is True (many to one, searched on the reversed edges so the one direction
+    streets are followed the right way). the paths are only unwound when they are asked for
+    """
+
+    def __init__(self, graph, engine: RoutingEngine, root: str, reverse: bool, distances: np.ndarray,
+                 predecessors: np.ndarray):
+        self.graph = graph
+        self.engine = engine
+        self.root = root
+        self.reverse = reverse
+        self.distances = distances
+        self.predecessors = predecessors
+
+    def nbytes(self):
+        """
+        :return: bytes used by the tree arrays
+        """
+        return self.distances.nbytes + self.predecessors.nbytes
+
+    def distance(self, node: str):
+        """
+        :return: walking distance between the root and the node, inf if there is no path
+        """
+        return float(self.distances[self.engine.node_index[node]])
+
+    def path(self, node: str):
+        """
+        :param node: target node of a one to all tree, source node of a many to one tree
+        :return: node list between the root and the node in walking order, None if there is no path
+        """
+        i = self.engine.node_index[node]
+        if np.isinf(self.distances[i]):
+            return None
+        path = []
+        predecessors = self.predecessors
+        while i != -1:
+            path.append(self.engine.nodes[i])
+            i = predecessors[i]
+        # the predecessors of a reversed search are the next nodes toward the root
+        if not self.reverse:
+            path.reverse()
+        return path
+
+    def render(self, node: str):
+        """
+        :return: rendered path between the root and the node like shortest_path, None if there is no path
+        """
+        path = self.path(node)
+        return None if path is None else self.graph.render_path([path])
+
+    def nearest(self, nodes: list):
+        """
+        :param nodes: candidate nodes
+        :return: the candidate closest to the root and its distance, (None, inf) if none is reachable
+        """
+        best, best_distance = None, np.inf
+        for node in nodes:
+            distance = self.distance(node)
+            if distance < best_distance:
+                best, best_distance = node, distance
+        return best, best_distance
+
+    def has_edge(self, node_a: str, node_b: str):
+        """
+        :return: True if the tree paths go over the edge from node_a to node_b
+        """
+        a = self.engine.node_index.get(node_a)
+        b = self.engine.node_index.get(node_b)
+        if a is None or b is None:
+            return False
+        if self.reverse:
+            return self.predecessors[a] == b
+        return self.predecessors[b] == a
+
 class ShortestPath:
     # define local properties and its file type
 
@@ -79,7 +281,7 @@ class ShortestPath:
 
     # inactive road, if the road in the maintanance mode, this inactive list
     # will determine which road need to be closed, direction matter, node_a is starting node_b is target
-    inactive_road = pd.DataFrame
+    inactive_road: pd.DataFrame
 
     # path_graph is a network graph for our shortest path calculation purpose
     # it contains location or intersection coordinate as a node
@@ -87,15 +289,593 @@ class ShortestPath:
     # defined from the network csv datasets
     path_graph: nx.DiGraph
 
-    def __init__(self, buildings_file: str, streets_file: str, edges_file: str):
-        # read network dataset (csv files)
-        self.read_network_dataset(buildings_file, streets_file, edges_file)
+    def __init__(self, buildings_file: str, streets_file: str, edges_file: str,
+                 one_direction_file: str = "one_direction.csv", inactive_road_file: str = "inactive_road.csv",
+                 bulk: bool = False, exact: bool = False, stream: bool = False, chunk_size: int = 100000,
+                 validate: bool = False):
+        # validate checks all the references of the whole datasets before building, see validate_datasets
+        if validate and stream:
+            raise ValueError("the datasets can not be validated by the streaming loader")
+        # the streaming loader builds the graph like the bulk loader, so stream=True implies bulk=True
+        # and the distances are spherical unless exact is given
+        bulk = bulk or stream
+        self.init_state([buildings_file, streets_file, edges_file, one_direction_file, inactive_road_file],
+                        bulk, exact)
+        # runtime road rules, see close_road and set_one_way
+        self.closed_roads = {}
+        self.original_weights = {}
+        self.one_way_edges = {}
         # init the my_graph object using Directed graph
         self.path_graph = nx.DiGraph()
-        self.buildings_to_graph()
-        self.edges_to_graph()
-        self.connect_building_and_street()
-        self.connect_street_intersections()
+        if stream:
+            self.run_phase("stream_network_dataset", self.stream_network_dataset, *self.source_files,
+                           chunk_size=chunk_size)
+        elif bulk:
+            # read network dataset (csv files)
+            self.run_phase("read_network_dataset", self.read_network_dataset, *self.source_files, validate=validate)
+            self.run_phase("build_graph_bulk", self.build_graph_bulk)
+        else:
+            self.run_phase("read_network_dataset", self.read_network_dataset, *self.source_files, validate=validate)
+            self.run_phase("buildings_to_graph", self.buildings_to_graph)
+            self.run_phase("edges_to_graph", self.edges_to_graph)
+            self.run_phase("index_node_coordinates", self.index_node_coordinates)
+            self.run_phase("connect_building_and_street", self.connect_building_and_street)
+            self.run_phase("connect_street_intersections", self.connect_street_intersections)
+        self.building_index = self.run_phase("building_index", BuildingIndex.from_digraph, self.path_graph)
+
+    def init_state(self, source_files: list, bulk: bool, exact: bool):
+        """
+        set the attributes shared by a graph built from the datasets and a compiled graph,
+        the graph itself is built by the caller
+
+        :param source_files: buildings, streets, edges, one direction and inactive road files
+        :return: None
+        """
+        self.source_files = source_files
+        # exact is only used by the bulk loader, the row by row loader always uses vincenty
+        self.bulk = bulk
+        self.exact = exact or not bulk
+        # rows, seconds, rows_per_second and peak_rss_mb (None without the unix resource module) of the streaming loader
+        self.load_stats = None
+        # construction phase -> seconds, see run_phase
+        self.phase_timings = {}
+        # query counters and timings, see enable_metrics
+        self.metrics = None
+        # compiled graph and CSR routing engine, see load_compiled and freeze_graph
+        self.compiled = None
+        self.engine = None
+        self.algorithm = "dijkstra"
+        # number of changes of the routes (graph, engine, schedule, turn costs), see RoutingService
+        self.revision = 0
+        # turn costs and restrictions of the turns algorithm, see set_turn_costs
+        self.turn_options = {}
+        # scheduled closures of the depart_at queries, see set_schedule
+        self.schedule_rows = []
+        self.schedule = None
+        self.route_cache = None
+        self.tree_cache = None
+        # grid of the node coordinates, built by the first nearest_node
+        self.spatial_index = None
+        # building or street name -> intersections naming it, see intersections_by_name
+        self.named_intersections = None
+
+    def run_phase(self, phase: str, function, *args, **kwargs):
+        """
+        run one construction phase and add its time to phase_timings, the time of a phase
+        includes the phases it runs itself (remove_contra_direction_edges is part of build_graph_bulk)
+
+        :param phase: phase name
+        :param function: callable running the phase
+        :return: the function result
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv", bulk=True)
+        >>> list(uiuc.phase_timings)
+        ['read_network_dataset', 'index_node_coordinates', 'remove_contra_direction_edges', 'close_inactive_roads', 'connect_buildings_in_same_street', 'build_graph_bulk', 'building_index']
+        """
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.phase_timings[phase] = self.phase_timings.get(phase, 0.0) + time.perf_counter() - start
+
+    def compile(self, file_name: str):
+        """
+        write the finished path_graph to a versioned binary file which can be
+        memory-mapped by load_compiled, the content hash of the source csv files
+        is stored with it
+
+        :param file_name: compiled graph file name
+        :return: None
+        """
+        datasets = {"streets": self.streets["name"].tolist() if "name" in self.streets else []}
+        for key in ("one_direction", "inactive_road"):
+            dataset = getattr(self, key)
+            datasets[key] = list(zip(dataset.node_a, dataset.node_b)) if dataset.shape[0] > 0 else []
+        compiled = CompiledGraph.from_digraph(self.path_graph, datasets, self.source_files,
+                                              {"bulk": self.bulk, "exact": self.exact if self.bulk else False},
+                                              self.frozen_coordinates())
+        compiled.write(file_name)
+
+    @classmethod
+    def load_compiled(cls, file_name: str, check_sources: bool = True):
+        """
+        given the compiled graph file, memory-map it and build the ShortestPath
+        without reading the csv files or doing any geodesic computation.
+        when the content of the source csv files has changed since the file was compiled,
+        the graph is rebuilt from the csv files and the file is compiled again.
+        the queries use the engine on the memory-mapped arrays and render the routes from them,
+        the networkx path_graph, the road rules and the dataframes are only built on their first use
+
+        :param file_name: compiled graph file name
+        :param check_sources: compare the source csv files content hash with the compiled one
+        :return: ShortestPath
+        >>> import tempfile
+        >>> compiled_file = os.path.join(tempfile.mkdtemp(), "uiuc.graph")
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.compile(compiled_file)
+        >>> compiled=ShortestPath.load_compiled(compiled_file)
+        >>> compiled.freeze_graph()
+        >>> route = ('Swanlund Administration Building', 'University YMCA')
+        >>> compiled.shortest_path(*route) == uiuc.shortest_path(*route)
+        True
+        >>> compiled.list_mail_code() == uiuc.list_mail_code()
+        True
+        >>> compiled.freeze_graph()
+        >>> list(compiled.k_shortest_paths(*route, k=3)) == list(uiuc.k_shortest_paths(*route, k=3))
+        True
+        >>> sorted(key for key in COMPILED_PARTS if key in vars(compiled))
+        ['building_index']
+        >>> compiled.path_graph.node == uiuc.path_graph.node and compiled.path_graph.edge == uiuc.path_graph.edge
+        True
+        >>> compiled.edges.equals(uiuc.edges[compiled.edges.columns]), compiled.one_way_edges.keys() == uiuc.one_way_edges.keys()
+        (True, True)
+        """
+        header, _ = CompiledGraph.read_header(file_name)
+        source_files = header["source_files"]
+        if check_sources and hash_source_files(source_files) != header["source_hash"]:
+            if all(os.path.exists(source_file) for source_file in source_files[:3]):
+                logging.info("source files of {} changed, compiling it again".format(file_name))
+                cls(*source_files, **header["options"]).compile(file_name)
+            else:
+                logging.error("source files of {} are not available, using the compiled graph".format(file_name))
+
+        self = cls.__new__(cls)
+        self.init_state(source_files, header["options"]["bulk"], header["options"]["exact"])
+        compiled = self.run_phase("load_compiled", CompiledGraph.load, file_name)
+        self.compiled = compiled
+        self.node_ids = dict(compiled.node_index)
+        self.coordinates = compiled.coordinates
+        # the COMPILED_PARTS are built from these arrays by __getattr__
+        self.lazy_compiled = compiled
+        return self
+
+    def __getattr__(self, name: str):
+        """
+        only called for a missing attribute: builds the part of a compiled graph the attribute belongs to
+        """
+        compiled = self.__dict__.get("lazy_compiled")
+        if compiled is not None and name in COMPILED_PARTS:
+            getattr(self, "load_compiled_" + COMPILED_PARTS[name])(compiled)
+        elif self.__dict__.get("lazy_frames") and name in STREAMED_FRAMES:
+            self.lazy_frames = False
+            self.buildings, self.edges = self.node_datasets(self.path_graph.node, self.path_graph.nodes())
+            self.edges = self.edges.astype({"node_a": "category", "node_b": "category"})
+        else:
+            raise AttributeError(name)
+        return self.__dict__[name]
+
+    def load_compiled_graph(self, compiled: CompiledGraph):
+        """
+        build the networkx path_graph of a compiled graph and its runtime road rules, they are needed
+        to change the graph
+
+        :return: None
+        """
+        self.path_graph = self.run_phase("to_digraph", compiled.to_digraph)
+        self.closed_roads = {}
+        self.original_weights = {}
+        self.one_way_edges = {}
+        self.street_segments = self.run_phase("index_street_segments", self.index_street_segments)
+        self.run_phase("restore_road_rules", self.restore_road_rules)
+
+    def load_compiled_datasets(self, compiled: CompiledGraph):
+        """
+        rebuild the small datasets of a compiled graph from its arrays
+
+        :return: None
+        """
+        import pandas as pd
+        self.buildings, self.edges = self.node_datasets(compiled.view().node, compiled.nodes)
+        self.streets = pd.DataFrame({"name": [compiled.string(ref) for ref in compiled.streets_ref.tolist()]})
+        for key in ("one_direction", "inactive_road"):
+            pairs = [(compiled.string(a), compiled.string(b)) for a, b in compiled.arrays[key + "_ref"].tolist()]
+            setattr(self, key, pd.DataFrame(pairs, columns=["node_a", "node_b"]) if pairs else pd.DataFrame())
+
+    @staticmethod
+    def node_datasets(graph_node, nodes: list):
+        """
+        rebuild the buildings and edges datasets from the node attributes, one row per node
+
+        :param graph_node: path_graph.node or the node view of a compiled graph
+        :param nodes: nodes in the row order
+        :return: buildings and edges dataframes
+        """
+        import pandas as pd
+        attributes = [graph_node[node] for node in nodes]
+        buildings = pd.DataFrame([(node, attr["coor"], attr["mail_code"]) for node, attr in zip(nodes, attributes)
+                                  if attr["type"] == "building"], columns=["name", "coordinate", "mail_code"])
+        edges = pd.DataFrame([(attr["a"], attr["b"], node, attr["coor"], attr["N"], attr["S"], attr["E"], attr["W"])
+                              for node, attr in zip(nodes, attributes) if attr["type"] == "intersection"],
+                             columns=["node_a", "node_b", "node_name", "intersection", "N", "S", "E", "W"])
+        return buildings, edges
+
+    def load_compiled_building_index(self, compiled: CompiledGraph):
+        """
+        index the buildings of a compiled graph without the networkx path_graph
+
+        :return: None
+        """
+        self.building_index = self.run_phase("building_index", BuildingIndex.from_digraph, compiled.view())
+
+    def graph_view(self):
+        """
+        :return: the path_graph, or the read-only view of the arrays of a compiled graph
+            while its path_graph is not built
+        """
+        if "path_graph" not in self.__dict__ and self.__dict__.get("lazy_compiled") is not None:
+            return self.lazy_compiled.view()
+        return self.path_graph
+
+    def datasets(self):
+        """
+        :return: dataset name -> dataframe of the running graph, see DatasetDiff.DATASETS
+        """
+        from DatasetDiff import DATASETS
+        return {key: getattr(self, key) for key in DATASETS}
+
+    def read_datasets(self, file_names: list):
+        """
+        read the five dataset files, a missing road rule file defines no rule
+
+        :param file_names: buildings, streets, edges, one direction and inactive road file names
+        :return: dataset name -> dataframe
+        """
+        import pandas as pd
+        from DatasetDiff import DATASETS
+        datasets = {}
+        for key, file_name in zip(DATASETS, file_names):
+            if key in ("one_direction", "inactive_road") and not os.path.exists(file_name):
+                datasets[key] = pd.DataFrame()
+            else:
+                datasets[key] = self.load_file(file_name)
+        datasets["edges"] = datasets["edges"].fillna("")
+        return datasets
+
+    def validate_datasets(self, datasets: dict, file_names: list):
+        """
+        check the coordinates and every node reference of the datasets in one pass and report
+        all the errors together, before anything is built
+
+        :param datasets: dataset name -> dataframe
+        :param file_names: buildings, streets, edges, one direction and inactive road file names
+        :return: parsed building and intersection coordinates
+        >>> import shutil, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> files = [shutil.copy(name, directory) for name in ("buildings.csv", "streets.csv", "edges.csv")]
+        >>> with open(os.path.join(directory, "edges.csv"), "a") as edges:
+        ...     _ = edges.write('\\nLincoln Hall,Goodwin Avenue,Lincoln Hall-Goodwin Avenue,"40.1,-88.2",,,East Green Street-S Goodwin Ave,\\n')
+        >>> with open(os.path.join(directory, "one_direction.csv"), "w") as rules:
+        ...     _ = rules.write("node_a,node_b\\nEast Green Street-S 6th Street,East Daniel Street-S 6th Street\\n")
+        >>> ShortestPath(*files, os.path.join(directory, "one_direction.csv"), validate=True) # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        ValueError: 3 errors in the datasets:
+        .../edges.csv: line 44 (Lincoln Hall-Goodwin Avenue) 'Goodwin Avenue' is not a building or a street
+        .../edges.csv: line 44 (Lincoln Hall-Goodwin Avenue) 'East Green Street-S Goodwin Ave' is not an intersection
+        .../one_direction.csv: line 2 (East Green Street-S 6th Street) 'East Daniel Street-S 6th Street' is not connected to it
+        """
+        from DatasetDiff import DATASETS, dataset_errors
+        file_names = dict(zip(DATASETS, file_names))
+        errors = []
+        coordinates = []
+        for key, column, name in (("buildings", "coordinate", "name"), ("edges", "intersection", "node_name")):
+            try:
+                coordinates.append(self.validate_coordinates(datasets[key], column, name, file_names[key]))
+            except ValueError as error:
+                errors.append(str(error))
+        errors += dataset_errors(datasets, file_names)
+        if len(errors) > 0:
+            raise ValueError("{} errors in the datasets:\n{}".format(len(errors), "\n".join(errors)))
+        return coordinates
+
+    def reload_datasets(self, buildings_file: str, streets_file: str, edges_file: str,
+                        one_direction_file: str = "one_direction.csv", inactive_road_file: str = "inactive_road.csv"):
+        """
+        read new versions of the datasets, validate them and apply only their difference to the running
+        path_graph: the changed nodes get their edges again, the road rules around them are applied again
+        and the routing engine and the caches follow the changed edges. the graph is unchanged when
+        the new datasets have errors
+
+        :return: DatasetDiff of the applied changes
+        >>> import shutil, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> files = [shutil.copy(name, directory) for name in ("buildings.csv", "streets.csv", "edges.csv",
+        ...                                                    "one_direction.csv", "inactive_road.csv")]
+        >>> uiuc=ShortestPath(*files)
+        >>> uiuc.freeze_graph()
+        >>> ymca = uiuc.nearest_node(40.106565, -88.229256)
+        >>> import pandas as pd
+        >>> buildings, edges = pd.read_csv(files[0]), pd.read_csv(files[2])
+        >>> buildings.loc[buildings.name == "Lincoln Hall", "coordinate"] = "40.106500,-88.228500"
+        >>> buildings = buildings[buildings.name != "University YMCA"]
+        >>> edges = edges[(edges.node_a != "University YMCA") & (edges.node_b != "University YMCA")]
+        >>> buildings.to_csv(files[0], index=False), edges.to_csv(files[2], index=False)
+        (None, None)
+        >>> with open(files[4], "a") as rules:
+        ...     _ = rules.write("\\nS 6th Street-East Chalmers Street,East Armory Ave-S 6th Street\\n")
+        >>> diff = uiuc.reload_datasets(*files)
+        >>> diff.summary()["buildings"], diff.summary()["intersections"], diff.summary()["inactive_road"]
+        ({'added': 0, 'removed': 1, 'changed': 1}, {'added': 0, 'removed': 1, 'changed': 0}, {'added': 1, 'removed': 0})
+        >>> rebuilt=ShortestPath(*files)
+        >>> sorted(uiuc.path_graph.edges()) == sorted(rebuilt.path_graph.edges())
+        True
+        >>> all(abs(uiuc.path_graph.edge[a][b]["weight"] - w["weight"]) < 1e-6 for a, b, w in rebuilt.path_graph.edges(data=True))
+        True
+        >>> uiuc.path_graph.node == rebuilt.path_graph.node
+        True
+        >>> uiuc.search_node_by_mail_code(409), ymca
+        (None, 'University YMCA')
+        >>> uiuc.nearest_node(40.106565, -88.229256) == rebuilt.nearest_node(40.106565, -88.229256)
+        True
+        >>> uiuc.find_path('Lincoln Hall', 'Ice Arena') == rebuilt.find_path('Lincoln Hall', 'Ice Arena')
+        True
+        >>> round(uiuc.shortest_path('Lincoln Hall', 'Ice Arena')[0][1], 6) == round(rebuilt.shortest_path('Lincoln Hall', 'Ice Arena')[0][1], 6)
+        True
+        >>> len(uiuc.reload_datasets(*files))
+        0
+        """
+        from DatasetDiff import DatasetDiff
+        file_names = [buildings_file, streets_file, edges_file, one_direction_file, inactive_road_file]
+        datasets = self.run_phase("read_datasets", self.read_datasets, file_names)
+        coordinates = self.run_phase("validate_datasets", self.validate_datasets, datasets, file_names)
+        diff = self.run_phase("diff_datasets", DatasetDiff, self.datasets(), datasets)
+        if len(diff) > 0:
+            self.run_phase("apply_dataset_diff", self.apply_dataset_diff, diff, datasets, *coordinates)
+        self.source_files = file_names
+        return diff
+
+    def apply_dataset_diff(self, diff: DatasetDiff, datasets: dict, building_coordinates: np.ndarray,
+                           intersection_coordinates: np.ndarray):
+        """
+        apply the difference of validated datasets to path_graph, the work follows the size of the change:
+        the new rows of the changed nodes are read by their position in the diff, the rows naming a changed
+        node are found through the path_graph edges and intersections_by_name, and only the changed nodes,
+        their neighbours and the road rules touching them are visited. the routing engine weights, the road
+        segments and the building and spatial indexes are patched in place, only an added node freezes
+        the routing engine again since it has no slot in the CSR arrays
+
+        :param diff: DatasetDiff between the running datasets and the new ones
+        :param datasets: new dataset name -> dataframe
+        :param building_coordinates: parsed coordinates of the new buildings rows
+        :param intersection_coordinates: parsed coordinates of the new edges rows
+        :return: None
+        """
+        from DatasetDiff import DATASETS, NEIGHBOURS, node_names
+        graph = self.path_graph
+        graph_node = graph.node
+        added = diff.buildings[0] | diff.intersections[0]
+        removed = diff.buildings[1] | diff.intersections[1]
+        dirty = added | removed | diff.buildings[2] | diff.intersections[2]
+        named = self.intersections_by_name()
+        # the intersections of an added or removed street or building move to other road segments
+        for name in diff.streets[0] | diff.streets[1] | diff.buildings[0] | diff.buildings[1]:
+            dirty.update(named.get(name, ()))
+
+        # the new attributes and coordinates of the added and changed nodes, in the file order
+        building_rows = sorted(diff.positions["buildings"][node] for node in dirty
+                               if node in diff.positions["buildings"])
+        intersection_rows = sorted(diff.positions["edges"][node] for node in dirty if node in diff.positions["edges"])
+        buildings, edges = datasets["buildings"].iloc[building_rows], datasets["edges"].iloc[intersection_rows]
+        new_nodes = [(name, {"type": "building", "coor": coordinate, "mail_code": mail_code}, parsed)
+                     for name, coordinate, mail_code, parsed in zip(
+                         buildings["name"].astype(str).tolist(), buildings.coordinate.tolist(),
+                         buildings.mail_code.tolist(), building_coordinates[building_rows].tolist())]
+        new_nodes += [(name, {"type": "intersection", "a": a, "b": b, "coor": coordinate, "N": n, "S": s, "E": e,
+                              "W": w}, parsed)
+                      for name, a, b, coordinate, n, s, e, w, parsed in zip(
+                          node_names(edges).tolist(), *(edges[column].tolist() for column in
+                                                        ["node_a", "node_b", "intersection"] + NEIGHBOURS),
+                          intersection_coordinates[intersection_rows].tolist())]
+        street_nodes = [name for name, attr, _ in new_nodes if attr["type"] == "intersection"]
+
+        # the nodes whose edges can change: the changed ones and their neighbours before and after.
+        # a row naming a changed node is changed itself or was already connected to the node
+        region = set(node for node in dirty if node in graph_node)
+        for node in list(region):
+            region.update(graph.succ[node])
+            region.update(graph.pred[node])
+        for name, attr, _ in new_nodes:
+            region.add(name)
+            if attr["type"] == "intersection":
+                region.update(attr[key] for key in ["a", "b"] + NEIGHBOURS)
+        region = set(node for node in region if node in graph_node or node in added)
+
+        # the road rules touching the region are taken back and applied again on the new edges
+        undo_one_way = [pair for pair in self.one_way_edges
+                        if pair not in diff.positions["one_direction"] or pair[0] in region or pair[1] in region]
+        undo_closed = [pair for pair in self.closed_roads
+                       if pair not in diff.positions["inactive_road"] or pair[0] in region or pair[1] in region]
+        redo = set(undo_one_way + undo_closed + diff.rules["one_direction"][0] + diff.rules["inactive_road"][0])
+        # weights before the change of the edges around the visited nodes, see the end
+        visited = set(region)
+        for pair in redo:
+            for node in pair:
+                if node in graph_node:
+                    visited.add(node)
+                    visited.update(graph.succ[node])
+        before = {}
+        for node in visited:
+            if node in graph_node:
+                before.update(((node, v), attr["weight"]) for v, attr in graph.succ[node].items())
+                before.update(((u, node), attr["weight"]) for u, attr in graph.pred[node].items())
+
+        # the rules are taken back and applied again in one batch, the road segments are linked
+        # once at the end like the loaders do after the rules
+        changes = set()
+        closed = [edge for pair in undo_closed for edge in self.closed_roads.pop(pair)]
+        still_closed = set(edge for edges in self.closed_roads.values() for edge in edges)
+        changes.update(self.reopen_edges(closed, still_closed))
+        for pair in reversed(undo_one_way):
+            changes.update(self.restore_contra_direction(self.one_way_edges.pop(pair), still_closed))
+        relink = set(region)
+        relink.update(node for edge in changes for node in edge)
+
+        # the changed nodes lose all their edges, road segments and names, the removed nodes are deleted.
+        # the coordinate rows of the removed nodes stay unused until frozen_coordinates
+        present = [node for node in dirty if node in graph_node]
+        self.leave_street_segments(present)
+        for node in present:
+            attr = graph_node[node]
+            if attr["type"] == "intersection":
+                for end in (attr["a"], attr["b"]):
+                    named.get(end, set()).discard(node)
+        old_edges = [edge for node in present for edge in graph.out_edges(node) + graph.in_edges(node)]
+        graph.remove_edges_from(old_edges)
+        changes.update(old_edges)
+        graph.remove_nodes_from([node for node in removed if node in graph_node])
+        for node in removed:
+            self.node_ids.pop(node, None)
+        if not self.coordinates.flags.writeable:
+            # the coordinates of a compiled graph are a read-only mapping
+            self.coordinates = np.array(self.coordinates)
+        appended = []
+        for name, attr, parsed in new_nodes:
+            if name in self.node_ids:
+                self.coordinates[self.node_ids[name]] = parsed
+                graph_node[name] = attr
+            else:
+                self.node_ids[name] = len(self.coordinates) + len(appended)
+                appended.append(parsed)
+                graph.add_node(name, attr_dict=attr)
+            if attr["type"] == "intersection":
+                for end in (attr["a"], attr["b"]):
+                    named.setdefault(end, set()).add(name)
+        if len(appended) > 0:
+            self.coordinates = np.vstack([self.coordinates, appended])
+
+        # the edges of the changed intersections and of the intersections naming a changed node,
+        # building edges first like build_graph_bulk
+        street_nodes += sorted(node for node in region if node not in dirty and node in graph_node
+                               and graph_node[node]["type"] == "intersection")
+        ends, building_nodes, src, dst = [], [], [], []
+        for node in street_nodes:
+            attr = graph_node[node]
+            own = node in dirty
+            if own or attr["a"] in dirty or attr["b"] in dirty:
+                ends.append((attr["a"], attr["b"]))
+                building_nodes.append(node)
+            for key in NEIGHBOURS:
+                if attr[key] != "" and (own or attr[key] in dirty):
+                    src.append(node)
+                    dst.append(attr[key])
+        building_src, building_dst = self.building_street_pairs([a for a, _ in ends], [b for _, b in ends],
+                                                                building_nodes)
+        src, dst = building_src + src, building_dst + dst
+        self.add_street_edges(src, dst)
+        changes.update(zip(src, dst))
+        changes.update(zip(dst, src))
+
+        # the changed building intersections join their road segments again
+        self.join_street_segments([node for node in street_nodes if node in dirty], diff.street_names)
+
+        # the one direction rules before the closures, in the file order
+        for pair in sorted((pair for pair in redo if pair in diff.positions["one_direction"]),
+                           key=diff.positions["one_direction"].get):
+            if pair not in self.one_way_edges:
+                removed_edges = [(u, v) for u, v, _ in self.remove_contra_direction(*pair)]
+                changes.update(removed_edges)
+                relink.update(node for edge in removed_edges for node in edge)
+        for pair in sorted((pair for pair in redo if pair in diff.positions["inactive_road"]),
+                           key=diff.positions["inactive_road"].get):
+            if pair not in self.closed_roads:
+                changes.update(self.close_edges(*pair))
+        longer, shorter = self.relink_segments(set(node for node in relink if node in graph_node))
+        changes.update(longer + shorter)
+
+        for key in DATASETS:
+            setattr(self, key, datasets[key])
+        self.building_coordinates, self.intersection_coordinates = building_coordinates, intersection_coordinates
+        # a building with a new mail code is indexed again, a moved one keeps its entries
+        for name in diff.buildings[1]:
+            self.building_index.remove(name)
+        for name in diff.buildings[0] | diff.buildings[2]:
+            mail_code = graph_node[name]["mail_code"]
+            if self.building_index.names.get(name) != int(mail_code):
+                self.building_index.remove(name)
+                self.building_index.add(name, mail_code)
+        if self.spatial_index is not None:
+            for node in removed:
+                self.spatial_index.remove(node)
+            self.spatial_index.add_many([name for name, _, _ in new_nodes],
+                                        [parsed for _, _, parsed in new_nodes],
+                                        [attr["type"] for _, attr, _ in new_nodes])
+        self.compiled = None
+
+        longer, shorter = [], []
+        for u, v in changes:
+            weight = graph.edge[u][v]["weight"] if v in graph.edge.get(u, {}) else None
+            previous = before.get((u, v))
+            if weight is None or (previous is not None and weight > previous):
+                longer.append((u, v))
+            elif previous is None or weight < previous:
+                shorter.append((u, v))
+        engine = self.engine
+        if len(added) > 0:
+            # the routing engine has no slot for the new nodes
+            self.engine = None
+        self.graph_changed(longer, shorter)
+        if self.engine is not None:
+            for node in removed:
+                self.engine.remove_node(node)
+        elif engine is not None:
+            self.freeze_graph(self.algorithm, background=True)
+
+    def restore_road_rules(self):
+        """
+        rebuild the removed one direction edges and the weights before the closures of a compiled graph,
+        so the road rules can be changed at runtime. every edge weight is the distance between its nodes
+        and a removed edge is the contra direction of an edge that is still in the path_graph
+
+        :return: None
+        """
+        edge = self.path_graph.edge
+        for x in range(self.one_direction.shape[0]):
+            node_a = self.one_direction.iloc[x].node_a
+            node_b = self.one_direction.iloc[x].node_b
+            removed = [(node_b, node_a)]
+            for y in edge[node_a]:
+                if y != node_b and node_b in edge[y]:
+                    removed += [(node_b, y), (y, node_a)]
+            self.one_way_edges[(node_a, node_b)] = [(u, v, self.contra_direction_attributes(u, v)) for u, v in removed]
+        for x in range(self.inactive_road.shape[0]):
+            node_a = self.inactive_road.iloc[x].node_a
+            node_b = self.inactive_road.iloc[x].node_b
+            closed = [(node_a, node_b)]
+            for y in edge[node_b]:
+                if y in edge[node_a] and node_b in edge[y]:
+                    closed += [(node_a, y), (y, node_b)]
+            for u, v in closed:
+                self.original_weights.setdefault((u, v), self.contra_direction_attributes(u, v)["weight"])
+            self.closed_roads[(node_a, node_b)] = closed
+
+    def contra_direction_attributes(self, node_a: str, node_b: str):
+        """
+        :return: attributes of the edge node_a -> node_b, the reverse of the edge node_b -> node_a
+        """
+        dist, bearing = self.distance_and_bearing(self.nodes_coordinates([node_a]), self.nodes_coordinates([node_b]))
+        if node_a in self.path_graph.edge[node_b]:
+            bearing = self.reverse_bearings(np.array([self.path_graph.edge[node_b][node_a]["bearing"]]))
+        return {"weight": float(dist[0]), "bearing": float(bearing[0]),
+                "goto": self.convert_bearing_to_direction(float(bearing[0]))}
 
     @staticmethod
     def load_file(file_name: str):
@@ -106,10 +886,12 @@ class ShortestPath:
         :param file_name: csv file_name
         :return:
         """
+        import pandas as pd
         return pd.read_csv(file_name)
 
     def read_network_dataset(self, buildings_file: str, streets_file: str, edges_file: str,
-                             one_direction: str = "one_direction.csv",inactive_road: str="inactive_road.csv"):
+                             one_direction: str = "one_direction.csv",inactive_road: str="inactive_road.csv",
+                             validate: bool = False):
         """
         given the three network csv files, read all the files and assign them into
         respective properties
@@ -117,6 +899,7 @@ class ShortestPath:
         :param buildings_file: buildings file name
         :param streets_file: streets file name
         :param edges_file: edges file name
+        :param validate: report all the malformed coordinates and missing references at once
         :return:
         """
         try:
@@ -128,6 +911,23 @@ class ShortestPath:
         except:
             logging.error("error loading core file, please make sure {},{}, and {} exist".format(buildings_file,streets_file,edges_file))
             exit()
+        self.read_road_rules(one_direction, inactive_road)
+        if validate:
+            file_names = [buildings_file, streets_file, edges_file, one_direction, inactive_road]
+            self.building_coordinates, self.intersection_coordinates = self.run_phase(
+                "validate_datasets", self.validate_datasets, self.datasets(), file_names)
+            return
+        # the coordinates are parsed once here, a malformed one stops the loading
+        self.building_coordinates = self.validate_coordinates(self.buildings, "coordinate", "name", buildings_file)
+        self.intersection_coordinates = self.validate_coordinates(self.edges, "intersection", "node_name", edges_file)
+
+    def read_road_rules(self, one_direction: str, inactive_road: str):
+        """
+        read the one direction and inactive road files, a missing file defines no rule
+
+        :return: None
+        """
+        import pandas as pd
         try:
             self.one_direction = self.load_file(one_direction)
         except:
@@ -139,6 +939,218 @@ class ShortestPath:
             logging.error("No inactive road file: {} found, there will be no inactive road defined".format(inactive_road))
             self.inactive_road = pd.DataFrame()
 
+    def stream_network_dataset(self, buildings_file: str, streets_file: str, edges_file: str,
+                               one_direction: str = "one_direction.csv", inactive_road: str = "inactive_road.csv",
+                               chunk_size: int = 100000):
+        """
+        streaming version of read_network_dataset and build_graph_bulk for the city scale datasets.
+        the buildings and edges files are read chunk_size rows at a time with explicit dtypes,
+        the street name columns are categorical and every node name is interned so a name repeated
+        over the rows (and in the graph attributes) is stored once. the nodes of every chunk are added
+        to the path_graph and the chunk is dropped, only the node names and coordinates are kept.
+        the edges are then added chunk_size nodes at a time from the node attributes, so the whole
+        dataset is never held in dataframes. the graph is the same as the bulk loader one, stream=True
+        implies bulk=True. the buildings and edges dataframes are rebuilt from the path_graph on their
+        first use, with one row per node
+
+        :param chunk_size: rows per chunk
+        :return: None, the load statistics are kept in load_stats
+        >>> bulk=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv", bulk=True)
+        >>> stream=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv", stream=True, chunk_size=7)
+        >>> list(stream.path_graph.edges(data=True)) == list(bulk.path_graph.edges(data=True))
+        True
+        >>> stream.path_graph.node == bulk.path_graph.node, stream.load_stats["rows"], "edges" in vars(stream)
+        (True, 64, False)
+        >>> stream.edges.equals(bulk.edges.astype({"node_a": "category", "node_b": "category"}))
+        True
+        >>> stream.buildings.equals(bulk.buildings)
+        True
+        """
+        import pandas as pd
+        start = time.perf_counter()
+        try:
+            self.streets = self.load_file(streets_file)
+            buildings_chunks = pd.read_csv(buildings_file, chunksize=chunk_size, dtype=BUILDINGS_DTYPES)
+            edges_chunks = pd.read_csv(edges_file, chunksize=chunk_size, dtype=EDGES_DTYPES, na_filter=False)
+        except:
+            logging.error("error loading core file, please make sure {},{}, and {} exist".format(buildings_file,streets_file,edges_file))
+            exit()
+        self.read_road_rules(one_direction, inactive_road)
+
+        building_names, building_coordinates = [], []
+        for chunk in buildings_chunks:
+            building_coordinates.append(self.validate_coordinates(chunk, "coordinate", "name", buildings_file,
+                                                                  len(building_names)))
+            names = [sys.intern(name) for name in chunk["name"].tolist()]
+            self.path_graph.add_nodes_from(
+                (name, {"type": "building", "coor": coor, "mail_code": mail_code})
+                for name, coor, mail_code in zip(names, chunk.coordinate.tolist(), chunk.mail_code.tolist()))
+            building_names += names
+
+        intersection_coordinates, street_nodes = [], []
+        for chunk in edges_chunks:
+            intersection_coordinates.append(self.validate_coordinates(chunk, "intersection", "node_name", edges_file,
+                                                                      len(street_nodes)))
+            for column in ("node_a", "node_b"):
+                chunk[column] = self.intern_categories(chunk[column])
+            for column in ("N", "S", "E", "W"):
+                chunk[column] = [sys.intern(name) for name in chunk[column].tolist()]
+            names = [sys.intern(a + "-" + b) for a, b in zip(chunk.node_a.tolist(), chunk.node_b.tolist())]
+            self.path_graph.add_nodes_from(
+                (name, {"type": "intersection", "a": a, "b": b, "coor": coor, "N": n, "S": s, "E": e, "W": w})
+                for name, a, b, coor, n, s, e, w in zip(names, chunk.node_a.tolist(), chunk.node_b.tolist(),
+                                                        chunk.intersection.tolist(), chunk.N.tolist(),
+                                                        chunk.S.tolist(), chunk.E.tolist(), chunk.W.tolist()))
+            street_nodes += names
+
+        # the dataframes are built from the path_graph by __getattr__ when they are used
+        self.lazy_frames = True
+        self.building_coordinates = np.concatenate(building_coordinates or [np.zeros((0, 2))])
+        self.intersection_coordinates = np.concatenate(intersection_coordinates or [np.zeros((0, 2))])
+        self.run_phase("index_node_coordinates", self.index_node_coordinates, building_names + street_nodes)
+
+        # the building edges come first like in build_graph_bulk, a node named by several rows
+        # has the attributes of its last row like the bulk loader
+        graph_node = self.path_graph.node
+        for i in range(0, len(street_nodes), chunk_size):
+            nodes = street_nodes[i:i + chunk_size]
+            self.add_street_edges(*self.building_street_pairs([graph_node[node]["a"] for node in nodes],
+                                                              [graph_node[node]["b"] for node in nodes], nodes))
+        for i in range(0, len(street_nodes), chunk_size):
+            nodes = street_nodes[i:i + chunk_size]
+            neighbours = np.array([[graph_node[node][key] for key in ("N", "S", "E", "W")] for node in nodes],
+                                  dtype=object).reshape(-1, 4)
+            self.add_street_edges(*self.street_intersection_pairs(nodes, neighbours))
+        self.run_phase("remove_contra_direction_edges", self.remove_contra_direction_edges)
+        self.run_phase("close_inactive_roads", self.close_inactive_roads)
+        self.run_phase("connect_buildings_in_same_street", self.connect_buildings_in_same_street)
+
+        seconds = time.perf_counter() - start
+        rows = len(building_names) + len(street_nodes)
+        try:
+            import resource
+            # ru_maxrss is in kilobytes on linux
+            peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except ImportError:
+            # the resource module is unix only, the peak is not known on windows
+            peak_rss_mb = None
+        self.load_stats = {"rows": rows, "seconds": seconds, "rows_per_second": rows / seconds if seconds > 0 else 0.0,
+                           "peak_rss_mb": peak_rss_mb}
+        logging.info("streamed {rows} rows in {seconds:.2f} s ({rows_per_second:.0f} rows/s), "
+                     "peak rss {peak}".format(peak="unknown" if peak_rss_mb is None else "{:.1f} MB".format(peak_rss_mb),
+                                              **self.load_stats))
+
+    @staticmethod
+    def intern_categories(column: pd.Series):
+        """
+        :param column: categorical column
+        :return: the column with interned category strings, shared with the other chunks and the graph
+        """
+        return column.cat.rename_categories([sys.intern(x) for x in column.cat.categories])
+
+    @staticmethod
+    def parse_coordinate(coordinate):
+        """
+        given the "lat,long" coordinate string, parse it into floats
+
+        :param coordinate: "lat,long" string
+        :return: (lat, long) tuple, None if the coordinate is malformed or out of range
+        >>> ShortestPath.parse_coordinate("40.107933, -88.231398")
+        (40.107933, -88.231398)
+        >>> ShortestPath.parse_coordinate("40.107933;-88.231398"), ShortestPath.parse_coordinate("95,10")
+        (None, None)
+        """
+        try:
+            lat, long = (float(x) for x in str(coordinate).split(","))
+        except ValueError:
+            return None
+        if not (-90 <= lat <= 90 and -180 <= long <= 180):
+            return None
+        return lat, long
+
+    @classmethod
+    def validate_coordinates(cls, dataset: pd.DataFrame, column: str, key: str, file_name: str, offset: int = 0):
+        """
+        given the dataset coordinate column, parse all of them at once and reject the malformed ones
+
+        :param dataset: buildings or edges dataframe
+        :param column: "lat,long" coordinate column
+        :param key: column naming the row in the error message
+        :param file_name: csv file name for the error message
+        :param offset: number of rows before the dataset in the file, when it is a chunk
+        :return: numpy array with shape (n, 2)
+        >>> import pandas as pd
+        >>> ShortestPath.validate_coordinates(pd.DataFrame({"name": ["a", "b", "c"], "coordinate": ["40.1,-88.2", "40.1", "x,y"]}),
+        ...                                   "coordinate", "name", "buildings.csv")
+        Traceback (most recent call last):
+        ...
+        ValueError: malformed coordinates in buildings.csv: line 3 (b) '40.1', line 4 (c) 'x,y'
+        """
+        import pandas as pd
+        values = dataset[column] if column in dataset else pd.Series([], dtype=object)
+        coordinates = None
+        try:
+            parts = values.astype(str).str.split(",", expand=True)
+            if parts.shape[1] == 2:
+                coordinates = parts.astype(float).values.reshape(-1, 2)
+        except ValueError:
+            pass
+        if len(values) == 0:
+            return np.zeros((0, 2), dtype=np.float64)
+        if coordinates is None or not (np.isfinite(coordinates).all() and (np.abs(coordinates[:, 0]) <= 90).all()
+                                       and (np.abs(coordinates[:, 1]) <= 180).all()):
+            # the header is line 1 of the csv file
+            malformed = ["line {} ({}) {!r}".format(offset + i + 2, name, value)
+                         for i, (name, value) in enumerate(zip(dataset[key].tolist(), values.tolist()))
+                         if cls.parse_coordinate(value) is None]
+            raise ValueError("malformed coordinates in {}: {}".format(file_name, ", ".join(malformed)))
+        return np.ascontiguousarray(coordinates, dtype=np.float64)
+
+    def index_node_coordinates(self, names: list = None):
+        """
+        give every path_graph node an id (its position in path_graph.nodes()) and put the
+        coordinates parsed at load time into one float64 (lat, long) array indexed by the id.
+        a node added twice keeps the coordinate of the last row, like its attributes
+
+        :param names: node name of every buildings and edges row, built from the datasets if not given
+        :return: None
+        """
+        if names is None:
+            names = self.buildings["name"].tolist() + (self.edges.node_a + "-" + self.edges.node_b).tolist() \
+                if self.edges.shape[0] > 0 else self.buildings["name"].tolist()
+        rows = {name: i for i, name in enumerate(names)}
+        self.node_ids = {node: i for i, node in enumerate(self.path_graph.nodes())}
+        row_index = np.fromiter((rows[node] for node in self.node_ids), dtype=np.int64, count=len(self.node_ids))
+        self.coordinates = np.concatenate([self.building_coordinates, self.intersection_coordinates])[row_index]
+
+    def frozen_coordinates(self):
+        """
+        the coordinates in the path_graph.nodes() order of RoutingEngine.from_digraph. the unused rows
+        of the nodes removed by apply_dataset_diff are dropped here and the node ids follow the new order
+
+        :return: (n, 2) array of the node coordinates
+        """
+        nodes = self.path_graph.nodes()
+        if len(nodes) != len(self.coordinates):
+            order = np.fromiter((self.node_ids[node] for node in nodes), dtype=np.int64, count=len(nodes))
+            self.coordinates = self.coordinates[order].reshape(-1, 2)
+            self.node_ids = {node: i for i, node in enumerate(nodes)}
+        return self.coordinates
+
+    def node_coordinate(self, node: str):
+        """
+        :return: (lat, long) floats of the node
+        """
+        lat, long = self.coordinates[self.node_ids[node]].tolist()
+        return lat, long
+
+    def nodes_coordinates(self, nodes: list):
+        """
+        :return: (n, 2) array of the node coordinates
+        """
+        return self.coordinates[np.fromiter((self.node_ids[node] for node in nodes), dtype=np.int64,
+                                            count=len(nodes))].reshape(-1, 2)
+
     def buildings_to_graph(self):
         """
         this method will insert the building dataset to the path_graph network stored as a node
@@ -204,6 +1216,7 @@ class ShortestPath:
 
         :return: None
         """
+        from pygeodesy import ellipsoidalVincenty as ev
         for x in range(self.edges.shape[0]):
             edge = self.edges.iloc[x]
             street = self.path_graph.node[edge.node_a + "-" + edge.node_b]
@@ -216,12 +1229,10 @@ class ShortestPath:
             if building != "":
                 start = self.path_graph.node[building]
                 if "coor" in start:
-                    coor = start["coor"].split(",")
-                    start_coor = ev.LatLon(coor[0], coor[1])
+                    start_coor = ev.LatLon(*self.node_coordinate(building))
 
                 if "coor" in street:
-                    coor = street["coor"].split(",")
-                    end_coor = ev.LatLon(coor[0], coor[1])
+                    end_coor = ev.LatLon(*self.node_coordinate(edge.node_a + "-" + edge.node_b))
                     dist, bearing, _ = start_coor.distanceTo3(end_coor)
                     goto = self.convert_bearing_to_direction(bearing)
                     # directed graph
@@ -242,22 +1253,21 @@ class ShortestPath:
 
         :return: None
         """
+        from pygeodesy import ellipsoidalVincenty as ev
 
         # add edge for street intersections
         for x in range(self.edges.shape[0]):
             edge = self.edges.iloc[x]
             direction = ['N', 'S', 'E', 'W']
             start_node = edge.node_a + '-' + edge.node_b
-            coor = self.path_graph.node[start_node]["coor"].split(",")
-            start_coor = ev.LatLon(coor[0], coor[1])
+            start_coor = ev.LatLon(*self.node_coordinate(start_node))
             for y in direction:
                 neighbour_node = edge[y]
                 # print(pd.isnull(neighbour_node))
                 #if pd.isnull(neighbour_node) != True:
                 if neighbour_node != "":
                     # print(neighbour_node)
-                    coor = self.path_graph.node[neighbour_node]["coor"].split(",")
-                    neighbour_coor = ev.LatLon(coor[0], coor[1])
+                    neighbour_coor = ev.LatLon(*self.node_coordinate(neighbour_node))
                     dist, bearing, _ = start_coor.distanceTo3(neighbour_coor)
                     goto = self.convert_bearing_to_direction(bearing)
                     self.path_graph.add_edge(start_node, neighbour_node,
@@ -268,99 +1278,643 @@ class ShortestPath:
                     self.path_graph.add_edge(neighbour_node, start_node,
                                              {"weight": dist, "bearing": bearing, "goto": goto})
 
-        # delete contra direction edges that are appear in the one direction file
+        self.run_phase("remove_contra_direction_edges", self.remove_contra_direction_edges)
+        self.run_phase("close_inactive_roads", self.close_inactive_roads)
+        self.run_phase("connect_buildings_in_same_street", self.connect_buildings_in_same_street)
+
+    def remove_contra_direction_edges(self):
+        """
+        delete contra direction edges that are appear in the one direction file
+
+        :return: None
+        """
         for x in range(self.one_direction.shape[0]):
             node_a = self.one_direction.iloc[x].node_a
             node_b = self.one_direction.iloc[x].node_b
-            # remove the edge for the contra direction
-            self.path_graph.remove_edge(node_b, node_a)
-            # remove all edges in between
-
-            """
-            import copy
-            all_edges = copy.copy(self.path_graph.edge[node_b])
-            for y in all_edges:
+            self.remove_contra_direction(node_a, node_b)
+
+    def remove_contra_direction(self, node_a: str, node_b: str):
+        """
+        make the street from node_a to node_b one direction, the removed edges
+        are kept in one_way_edges so the rule can be cleared again
+
+        :param node_a: starting node
+        :param node_b: target node
+        :return: list of the removed edges
+        """
+        # remove the edge for the contra direction
+        removed = [(node_b, node_a, self.path_graph.edge[node_b][node_a])]
+        self.path_graph.remove_edge(node_b, node_a)
+        # remove all edges in between
+
+        """
+        import copy
+        all_edges = copy.copy(self.path_graph.edge[node_b])
+        for y in all_edges:
+            if node_a in self.path_graph.edge[y]:
+                self.path_graph.remove_edge(node_b, y)
+                self.path_graph.remove_edge(y, node_a)
+                # print(node_b)
+                # print(self.path_graph.edge[node_b])
+        """
+        for y in self.path_graph.edge[node_a]:
+            # remove node that went to wrong direction in
+            # between node_a and node_b
+            if y in self.path_graph.edge[node_b]:
+                removed.append((node_b, y, self.path_graph.edge[node_b][y]))
+                self.path_graph.remove_edge(node_b, y)
+                # another one direction rule can have removed it already
                 if node_a in self.path_graph.edge[y]:
-                    self.path_graph.remove_edge(node_b, y)
-                    self.path_graph.remove_edge(y, node_a)
-                    # print(node_b)
-                    # print(self.path_graph.edge[node_b])
-            """
-            for y in self.path_graph.edge[node_a]:
-                # remove node that went to wrong direction in
-                # between node_a and node_b
-                if y in self.path_graph.edge[node_b]:
-                    self.path_graph.remove_edge(node_b, y)
+                    removed.append((y, node_a, self.path_graph.edge[y][node_a]))
                     self.path_graph.remove_edge(y,node_a)
-                    # print(node_b)
-                    # print(self.path_graph.edge[node_b])
+                # print(node_b)
+                # print(self.path_graph.edge[node_b])
+        self.one_way_edges[(node_a, node_b)] = removed
+        return removed
+
+    def close_inactive_roads(self):
+        """
+        set the edges that are appear in the inactive_road file
+        with big number 9e9
+        ( can also be deleted permanently if we really don't want anything to go within that direction)
 
-        # set the edges that are appear in the inactive_road file
-        # with big number 9e9
-        # ( can also be deleted permanently if we really don't want anything to go within that direction)
+        :return: None
+        """
         for x in range(self.inactive_road.shape[0]):
             node_a = self.inactive_road.iloc[x].node_a
             node_b = self.inactive_road.iloc[x].node_b
-            #self.path_graph.remove_edge(node_a, node_b)
-            self.path_graph.edge[node_a][node_b]["weight"] = 9e9
-
-            for y in self.path_graph.edge[node_b]:
-                # remove node that are in between these node_a and node_b
-                if y in self.path_graph.edge[node_a]:
-                    #self.path_graph.remove_edge(node_a, y)
-                    #self.path_graph.remove_edge(y, node_b)
-                    self.path_graph.edge[node_a][y]["weight"] = 9e9
-                    self.path_graph.edge[y][node_b]["weight"] = 9e9
-
-        # add edge between buildings connection in the same street
-        for x in range(self.streets.shape[0]):
-            street = self.streets.iloc[x]
-            street_name = street["name"]
-            node_collection = []
-            # select intersection node that have particular street name and buildings and the type
-            for my_node_key in self.path_graph.node:
-                my_node = self.path_graph.node[my_node_key]
-                #        print(my_node)
-                if my_node["type"] == "intersection":
-                    if my_node["a"] == street_name or my_node["b"] == street_name:
-                        building = False
-                        if my_node["a"] in self.path_graph.node:
-                            if self.path_graph.node[my_node["a"]]["type"] == "building":
-                                building = True
-                        if my_node["b"] in self.path_graph.node:
-                            if self.path_graph.node[my_node["b"]]["type"] == "building":
-                                building = True
-                        if building:
-                            node_collection.append(my_node_key)
-
-            #print(node_collection)
-            # compute distance between all buildings node in node_collection
+            self.close_edges(node_a, node_b)
+
+    def close_edges(self, node_a: str, node_b: str):
+        """
+        close the road from node_a to node_b with the big number 9e9, the weight before
+        the first closure of every edge is kept in original_weights so the road can be reopened
+
+        :param node_a: starting node
+        :param node_b: target node
+        :return: list of the closed edges
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.close_edges('East John Street-S 6th Street', 'Ice Arena')
+        Traceback (most recent call last):
+        ...
+        KeyError: 'no road from East John Street-S 6th Street to Ice Arena'
+        """
+        #self.path_graph.remove_edge(node_a, node_b)
+        if node_b not in self.path_graph.edge.get(node_a, {}):
+            raise KeyError("no road from {} to {}".format(node_a, node_b))
+        closed = [(node_a, node_b)]
+        for y in self.path_graph.edge[node_b]:
+            # remove node that are in between these node_a and node_b,
+            # a one direction rule can have removed the edge to node_b already
+            if y in self.path_graph.edge[node_a] and node_b in self.path_graph.edge[y]:
+                #self.path_graph.remove_edge(node_a, y)
+                #self.path_graph.remove_edge(y, node_b)
+                closed.append((node_a, y))
+                closed.append((y, node_b))
+        for u, v in closed:
+            self.original_weights.setdefault((u, v), self.path_graph.edge[u][v]["weight"])
+            self.path_graph.edge[u][v]["weight"] = 9e9
+        self.closed_roads[(node_a, node_b)] = closed
+        return closed
+
+    def connect_buildings_in_same_street(self):
+        """
+        add edge between buildings connection in the same street,
+        two buildings are connected when they are in the same road segment (intersection)
+        and the direction is available in the connected road
+
+        the street -> intersection and road segment (N, S, E, W) -> building node indexes
+        are built once, so only the pairs that really share a segment are compared.
+        the segments are kept in street_segments to link them again after a one direction change
+
+        :return: None
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> buildings = set(uiuc.buildings["name"])
+        >>> same_street = sorted((a, b) for a, b in uiuc.path_graph.edges()
+        ...                      if uiuc.path_graph.node[a].get("a") in buildings and uiuc.path_graph.node[b].get("a") in buildings)
+        >>> len(same_street)
+        25
+        >>> same_street[:3] # doctest: +NORMALIZE_WHITESPACE
+        [('507 East Daniel Street-East Daniel Street', 'Library and Information Sciences-East Daniel Street'),
+         ('912 South Fifth Street-S 5th Street', 'International Studies Building-S 5th Street'),
+         ('912 South Fifth Street-S 5th Street', 'Sherman Hall-S 5th Street')]
+        >>> ('University YMCA-S Wright Street', 'Lincoln Hall-S Wright Street') in same_street
+        True
+        >>> ('Lincoln Hall-S Wright Street', 'University YMCA-S Wright Street') in same_street
+        False
+        """
+        self.street_segments = self.index_street_segments()
+        self.link_segments(self.street_segments.values())
+
+    def index_street_segments(self):
+        """
+        :return: (street, N, S, E, W) road segment -> building intersection nodes in the segment
+        """
+        graph_node = self.path_graph.node
+        # select intersection node that have particular street name and buildings and the type
+        street_index = {}
+        for my_node_key, my_node in graph_node.items():
+            if my_node["type"] != "intersection":
+                continue
+            building = False
+            for end in (my_node["a"], my_node["b"]):
+                if end in graph_node and graph_node[end]["type"] == "building":
+                    building = True
+            if building:
+                street_index.setdefault(my_node["a"], []).append(my_node_key)
+                if my_node["b"] != my_node["a"]:
+                    street_index.setdefault(my_node["b"], []).append(my_node_key)
+
+        street_segments = {}
+        for street_name in dict.fromkeys(self.streets["name"].tolist()):
+            # they should be in the same road segment (intersection)
+            for my_node_key in street_index.get(street_name, []):
+                my_node = graph_node[my_node_key]
+                segment = (street_name, my_node["N"], my_node["S"], my_node["E"], my_node["W"])
+                street_segments.setdefault(segment, []).append(my_node_key)
+        return street_segments
+
+    def join_street_segments(self, nodes: list, street_names: set):
+        """
+        add the building intersections among the nodes to their road segments in street_segments,
+        like index_street_segments
+
+        :param nodes: intersection nodes
+        :param street_names: names of the streets dataset
+        :return: None
+        """
+        graph_node = self.path_graph.node
+        for node in nodes:
+            attr = graph_node[node]
+            if any(end in graph_node and graph_node[end]["type"] == "building" for end in (attr["a"], attr["b"])):
+                for street_name in dict.fromkeys((attr["a"], attr["b"])):
+                    if street_name in street_names:
+                        segment = self.street_segments.setdefault(
+                            (street_name, attr["N"], attr["S"], attr["E"], attr["W"]), [])
+                        if node not in segment:
+                            segment.append(node)
+
+    def leave_street_segments(self, nodes: list):
+        """
+        remove the building intersections among the nodes from their road segments, the segments
+        are found from the node attributes like in join_street_segments
+
+        :param nodes: nodes whose attributes are about to change
+        :return: None
+        """
+        graph_node = self.path_graph.node
+        for node in nodes:
+            for key in self.segment_keys(node, graph_node[node]):
+                self.street_segments[key].remove(node)
+
+    def segment_keys(self, node: str, attr: dict):
+        """
+        :return: keys of the road segments of street_segments holding the node
+        """
+        if attr["type"] != "intersection":
+            return []
+        keys = ((street_name, attr["N"], attr["S"], attr["E"], attr["W"])
+                for street_name in dict.fromkeys((attr["a"], attr["b"])))
+        return [key for key in keys if node in self.street_segments.get(key, ())]
+
+    def intersections_by_name(self):
+        """
+        :return: building or street name -> intersection nodes naming it as node_a or node_b,
+            built on the first call and kept up to date by apply_dataset_diff
+        """
+        if self.named_intersections is None:
+            named = {}
+            for node, attr in self.path_graph.node.items():
+                if attr["type"] == "intersection":
+                    for end in (attr["a"], attr["b"]):
+                        named.setdefault(end, set()).add(node)
+            self.named_intersections = named
+        return self.named_intersections
+
+    def link_segments(self, segments):
+        """
+        add the edges between every pair of building nodes in the same road segment
+        when the direction is available in the connected road
+
+        :param segments: node lists of the road segments
+        :return: list of the added edges
+        """
+        pairs = []
+        for node_collection in segments:
             for node_a in node_collection:
-                coor = self.path_graph.node[node_a]["coor"].split(",")
-                start_coor = ev.LatLon(coor[0], coor[1])
                 for node_b in node_collection:
-                    # print("{} : {}".format(node_a,node_b))
                     if node_a != node_b:
-                        # they should be in the same road segment (intersection)3
-                        edge_a = self.path_graph.node[node_a]
-                        edge_b = self.path_graph.node[node_b]
-                        if edge_a["N"] == edge_b["N"] and edge_a["S"] == edge_b["S"] and edge_a["E"] == edge_b["E"] and \
-                                        edge_a["W"] == edge_b["W"]:
-                            coor = self.path_graph.node[node_b]["coor"].split(",")
-                            end_coor = ev.LatLon(coor[0], coor[1])
-                            dist, bearing, _ = start_coor.distanceTo3(end_coor)
-                            goto = self.convert_bearing_to_direction(bearing)
-                            # check the direction is the streat is actualy one direction or
-
-                            directions = []
-                            for edge_dir in self.path_graph.edge[node_a].values():
-                                directions.append(edge_dir["goto"])
-                            #print(directions)
-                            
-                            # add directions if it available in the connected road only
-                            if goto in directions:
-                                self.path_graph.add_edge(node_a, node_b, {"weight": dist, "bearing": bearing, "goto": goto})
+                        pairs.append((node_a, node_b))
+        if len(pairs) == 0:
+            return []
 
+        start = self.nodes_coordinates([node_a for node_a, _ in pairs])
+        end = self.nodes_coordinates([node_b for _, node_b in pairs])
+        dist, bearing = self.distance_and_bearing(start, end)
+        goto = self.convert_bearings_to_directions(bearing)
+        added = []
+        for (node_a, node_b), pair_dist, pair_bearing, pair_goto in zip(pairs, dist.tolist(), bearing.tolist(),
+                                                                        goto.tolist()):
+            # add directions if it available in the connected road only
+            directions = [edge_dir["goto"] for edge_dir in self.path_graph.edge[node_a].values()]
+            if pair_goto in directions:
+                self.path_graph.add_edge(node_a, node_b, {"weight": pair_dist, "bearing": pair_bearing, "goto": pair_goto})
+                added.append((node_a, node_b))
+        return added
+
+    def relink_segments(self, nodes: set):
+        """
+        link the road segments of the given nodes again after their connected roads changed
+
+        :param nodes: changed nodes
+        :return: lists of the edges which are removed or longer and of the edges which are new or shorter
+        """
+        graph_node = self.path_graph.node
+        # the segments are found from the node attributes and relinked in a fixed order
+        keys = set(key for node in nodes for key in self.segment_keys(node, graph_node[node]))
+        segments = [self.street_segments[key] for key in sorted(keys)]
+        before = {}
+        for node_collection in segments:
+            for node_a in node_collection:
+                for node_b in node_collection:
+                    if node_b in self.path_graph.edge[node_a]:
+                        before[(node_a, node_b)] = self.path_graph.edge[node_a][node_b]["weight"]
+                        self.path_graph.remove_edge(node_a, node_b)
+        after = {(node_a, node_b): self.path_graph.edge[node_a][node_b]["weight"]
+                 for node_a, node_b in self.link_segments(segments)}
+        longer = [edge for edge, weight in before.items() if after.get(edge, np.inf) > weight]
+        shorter = [edge for edge, weight in after.items() if before.get(edge, np.inf) > weight]
+        return longer, shorter
+
+    def close_road(self, node_a: str, node_b: str):
+        """
+        close the road from node_a to node_b on the running graph, the same rules as the
+        inactive road file are used. only the changed edges are updated in the routing engine
+
+        :param node_a: starting node
+        :param node_b: target node
+        :return: None
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.freeze_graph()
+        >>> before = uiuc.shortest_path('Swanlund Administration Building','University YMCA')
+        >>> uiuc.close_road('East John Street-S 6th Street', 'East Daniel Street-S 6th Street')
+        >>> uiuc.path_graph.edge['East John Street-S 6th Street']['East Daniel Street-S 6th Street']["weight"]
+        9000000000.0
+        >>> uiuc.shortest_path('Swanlund Administration Building','University YMCA')[0][1] > 9e9
+        True
+        >>> uiuc.reopen_road('East John Street-S 6th Street', 'East Daniel Street-S 6th Street')
+        >>> uiuc.shortest_path('Swanlund Administration Building','University YMCA') == before
+        True
+        >>> uiuc.reopen_road('S 5th Street-East Chalmers Street', 'East Daniel Street-S 5th Street')
+        >>> uiuc.inactive_road.shape[0]
+        0
+        """
+        import pandas as pd
+        if (node_a, node_b) in self.closed_roads:
+            return
+        closed = self.close_edges(node_a, node_b)
+        self.inactive_road = pd.concat([self.inactive_road, pd.DataFrame({"node_a": [node_a], "node_b": [node_b]})],
+                                       ignore_index=True)
+        self.graph_changed(closed, [])
+
+    def reopen_road(self, node_a: str, node_b: str):
+        """
+        reopen the road from node_a to node_b which was closed by the inactive road file or close_road,
+        an edge that is still covered by another closure stays closed
+
+        :param node_a: starting node
+        :param node_b: target node
+        :return: None
+        """
+        closed = self.closed_roads.pop((node_a, node_b))
+        still_closed = set(edge for edges in self.closed_roads.values() for edge in edges)
+        reopened = self.reopen_edges(closed, still_closed)
+        self.inactive_road = self.inactive_road[(self.inactive_road.node_a != node_a) |
+                                                (self.inactive_road.node_b != node_b)].reset_index(drop=True)
+        self.graph_changed([], reopened)
+
+    def reopen_edges(self, closed: list, still_closed: set):
+        """
+        give the closed edges their weight before the closure back
+
+        :param closed: edges of the reopened closures
+        :param still_closed: edges of the closures which stay
+        :return: list of the reopened edges
+        """
+        reopened = []
+        for u, v in dict.fromkeys(closed):
+            if (u, v) not in still_closed and v in self.path_graph.edge.get(u, {}):
+                self.path_graph.edge[u][v]["weight"] = self.original_weights.pop((u, v))
+                reopened.append((u, v))
+        return reopened
+
+    def restore_contra_direction(self, removed: list, still_closed: set):
+        """
+        add the edges removed by a one direction rule again
+
+        :param removed: (node_a, node_b, attributes) of one_way_edges
+        :param still_closed: edges of the closures which stay
+        :return: list of the restored edges
+        """
+        for u, v, attr in removed:
+            self.path_graph.add_edge(u, v, attr)
+            if (u, v) in still_closed:
+                self.path_graph.edge[u][v]["weight"] = 9e9
+            elif (u, v) in self.original_weights:
+                # the road was reopened while the edge was removed
+                self.path_graph.edge[u][v]["weight"] = self.original_weights.pop((u, v))
+        return [(u, v) for u, v, _ in removed]
+
+    def set_one_way(self, node_a: str, node_b: str):
+        """
+        make the street from node_a to node_b one direction on the running graph, the same rules
+        as the one direction file are used and the buildings in the same road segment are linked again
+
+        :param node_a: starting node
+        :param node_b: target node
+        :return: None
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.set_one_way('East Daniel Street-S 5th Street', 'East Daniel Street-S 4th Street')
+        >>> 'East Daniel Street-S 5th Street' in uiuc.path_graph.edge['East Daniel Street-S 4th Street']
+        False
+        >>> uiuc.clear_one_way('East Daniel Street-S 5th Street', 'East Daniel Street-S 4th Street')
+        >>> 'East Daniel Street-S 5th Street' in uiuc.path_graph.edge['East Daniel Street-S 4th Street']
+        True
+        """
+        import pandas as pd
+        if (node_a, node_b) in self.one_way_edges:
+            return
+        removed = [(u, v) for u, v, _ in self.remove_contra_direction(node_a, node_b)]
+        self.one_direction = pd.concat([self.one_direction, pd.DataFrame({"node_a": [node_a], "node_b": [node_b]})],
+                                       ignore_index=True)
+        longer, shorter = self.relink_segments(set(node for edge in removed for node in edge))
+        self.graph_changed(removed + longer, shorter)
+
+    def clear_one_way(self, node_a: str, node_b: str):
+        """
+        make the one direction street from node_a to node_b two directions again
+
+        :param node_a: starting node
+        :param node_b: target node
+        :return: None
+        """
+        removed = self.one_way_edges.pop((node_a, node_b))
+        still_closed = set(edge for edges in self.closed_roads.values() for edge in edges)
+        restored = self.restore_contra_direction(removed, still_closed)
+        self.one_direction = self.one_direction[(self.one_direction.node_a != node_a) |
+                                                (self.one_direction.node_b != node_b)].reset_index(drop=True)
+        longer, shorter = self.relink_segments(set(node for edge in restored for node in edge))
+        self.graph_changed(longer, restored + shorter)
+
+    def graph_changed(self, longer: list, shorter: list):
+        """
+        update the structures built from path_graph after the given edges changed,
+        the routing engine weights are patched in place and only a new edge freezes the engine again.
+        the contraction hierarchy does not survive a change, the ch queries use dijkstra while the next
+        ch query contracts it again in the background, a new engine is contracted in the background at once.
+        a cached route stays the shortest one when other edges get longer, but any route
+        can get shorter through a new or shorter edge
+
+        :param longer: (node_a, node_b) edges which are removed or longer
+        :param shorter: (node_a, node_b) edges which are new or shorter
+        :return: None
+        """
+        if len(longer) + len(shorter) == 0:
+            return
+        self.revision += 1
+        for cache in (self.route_cache, self.tree_cache):
+            if cache is not None:
+                if len(shorter) > 0:
+                    cache.clear()
+                else:
+                    cache.invalidate(longer)
+        # the compiled arrays do not describe the graph anymore
+        self.compiled = None
+        if self.engine is None:
+            return
+        for u, v in longer + shorter:
+            weight = self.path_graph.edge[u][v]["weight"] if v in self.path_graph.edge.get(u, {}) else None
+            if not self.engine.set_weight(u, v, weight):
+                self.freeze_graph(self.algorithm, background=True)
+                return
+
+    @staticmethod
+    def parse_coordinates(coordinates: pd.Series):
+        """
+        given the "lat,long" coordinate strings, parse all of them at once
+        into a float array with one (lat, long) row per coordinate
+
+        :param coordinates: series of "lat,long" strings
+        :return: numpy array with shape (n, 2)
+        >>> import pandas as pd
+        >>> ShortestPath.parse_coordinates(pd.Series(["40.107933, -88.231398", "40.1,-88.2"]))
+        array([[ 40.107933, -88.231398],
+               [ 40.1     , -88.2     ]])
+        """
+        return coordinates.str.split(",", expand=True).astype(float).values.reshape(-1, 2)
+
+    @staticmethod
+    def convert_bearings_to_directions(bearings: np.ndarray):
+        """
+        vectorized convert_bearing_to_direction, convert every bearing degree in the array
+        to one of the 4 directions
+        :param bearings: array of degrees
+        :return: array of goto directions
+        >>> ShortestPath.convert_bearings_to_directions(np.array([88.23, 18.23, 136, 226, 316]))
+        array(['East', 'North', 'South', 'West', 'North'], dtype='<U5')
+        """
+        return np.select([(bearings >= 45) & (bearings < 135),
+                          (bearings >= 135) & (bearings < 225),
+                          (bearings >= 225) & (bearings < 315)],
+                         ["East", "South", "West"], "North")
+
+    @staticmethod
+    def reverse_bearings(bearings: np.ndarray):
+        """
+        bearing of the contra direction edge, the same rule used by the row by row loader
+
+        :param bearings: array of degrees
+        :return: array of degrees
+        """
+        bearings = bearings + 180
+        return np.where(bearings > 360, bearings - 360, bearings)
+
+    @staticmethod
+    def haversine_inverse(start: np.ndarray, end: np.ndarray):
+        """
+        fast spherical distance and initial bearing between every start and end coordinate
+
+        :param start: (n, 2) array of lat, long
+        :param end: (n, 2) array of lat, long
+        :return: distance in meter and initial bearing in degrees
+        """
+        lat1, lon1 = np.radians(start[:, 0]), np.radians(start[:, 1])
+        lat2, lon2 = np.radians(end[:, 0]), np.radians(end[:, 1])
+        d_lon = lon2 - lon1
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(d_lon / 2) ** 2
+        dist = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        bearing = np.degrees(np.arctan2(np.sin(d_lon) * np.cos(lat2),
+                                        np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(d_lon)))
+        bearing = np.where(dist > 0, bearing % 360, 0.0)
+        return dist, bearing
+
+    @staticmethod
+    def vincenty_inverse(start: np.ndarray, end: np.ndarray, epsilon: float = 1e-12, iterations: int = 200):
+        """
+        vectorized vincenty inverse formula on the WGS84 ellipsoid, this gives the same
+        distance and initial bearing as ev.LatLon.distanceTo3 for all coordinates in one pass
+
+        :param start: (n, 2) array of lat, long
+        :param end: (n, 2) array of lat, long
+        :return: distance in meter and initial bearing in degrees
+        >>> start, end = np.array([[40.107933, -88.231398]]), np.array([[40.110268, -88.232079]])
+        >>> dist, bearing = ShortestPath.vincenty_inverse(start, end)
+        >>> from pygeodesy import ellipsoidalVincenty as ev
+        >>> expected = ev.LatLon(40.107933, -88.231398).distanceTo3(ev.LatLon(40.110268, -88.232079))
+        >>> bool(abs(dist[0] - expected[0]) < 1e-6), bool(abs(bearing[0] - expected[1]) < 1e-6)
+        (True, True)
+        """
+        u1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(start[:, 0])))
+        u2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(end[:, 0])))
+        sin_u1, cos_u1, sin_u2, cos_u2 = np.sin(u1), np.cos(u1), np.sin(u2), np.cos(u2)
+        l = np.radians(end[:, 1] - start[:, 1])
+        lam = l.copy()
+        for _ in range(iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # coincident points have sin_sigma 0, they keep distance 0 and bearing 0
+            safe_sin_sigma = np.where(sin_sigma == 0, 1.0, sin_sigma)
+            sin_alpha = cos_u1 * cos_u2 * sin_lam / safe_sin_sigma
+            cos2_alpha = 1 - sin_alpha ** 2
+            safe_cos2_alpha = np.where(cos2_alpha == 0, 1.0, cos2_alpha)
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / safe_cos2_alpha)
+            c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = l + (1 - c) * WGS84_F * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            if np.all(np.abs(lam - lam_prev) < epsilon):
+                break
+        u_sq = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = b * sin_sigma * (cos_2sigma_m + b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        dist = WGS84_B * a * (sigma - delta_sigma)
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        bearing = np.degrees(np.arctan2(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)) % 360
+        coincident = sin_sigma == 0
+        return np.where(coincident, 0.0, dist), np.where(coincident, 0.0, bearing)
+
+    def distance_and_bearing(self, start: np.ndarray, end: np.ndarray):
+        """
+        distance and initial bearing between every start and end coordinate,
+        vincenty when the graph is built in exact mode, spherical otherwise
+
+        :param start: (n, 2) array of lat, long
+        :param end: (n, 2) array of lat, long
+        :return: distance in meter and initial bearing in degrees
+        """
+        if self.exact:
+            return self.vincenty_inverse(start, end)
+        return self.haversine_inverse(start, end)
+
+    def build_graph_bulk(self):
+        """
+        bulk version of buildings_to_graph, edges_to_graph, connect_building_and_street
+        and connect_street_intersections. the coordinates are parsed once into arrays,
+        all distances and bearings are computed in one vectorized pass and the nodes and
+        edges are added to the path_graph in batches, in the same order as the row by row loader
+
+        :return: None
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> bulk=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv", bulk=True, exact=True)
+        >>> sorted(bulk.path_graph.edges()) == sorted(uiuc.path_graph.edges())
+        True
+        >>> bulk.path_graph.node == uiuc.path_graph.node
+        True
+        >>> all(abs(bulk.path_graph.edge[a][b]["weight"] - w["weight"]) < 1e-6 and
+        ...     bulk.path_graph.edge[a][b]["goto"] == w["goto"] for a, b, w in uiuc.path_graph.edges(data=True))
+        True
+        """
+        building_names = self.buildings["name"].tolist()
+        street_nodes = (self.edges.node_a + "-" + self.edges.node_b).tolist()
+
+        self.path_graph.add_nodes_from(
+            (name, {"type": "building", "coor": coor, "mail_code": mail_code})
+            for name, coor, mail_code in zip(building_names, self.buildings.coordinate.tolist(),
+                                             self.buildings.mail_code.tolist()))
+        self.path_graph.add_nodes_from(
+            (name, {"type": "intersection", "a": a, "b": b, "coor": coor, "N": n, "S": s, "E": e, "W": w})
+            for name, a, b, coor, n, s, e, w in zip(street_nodes, self.edges.node_a.tolist(),
+                                                    self.edges.node_b.tolist(), self.edges.intersection.tolist(),
+                                                    self.edges.N.tolist(), self.edges.S.tolist(),
+                                                    self.edges.E.tolist(), self.edges.W.tolist()))
+
+        self.run_phase("index_node_coordinates", self.index_node_coordinates)
+
+        src, dst = self.building_street_pairs(self.edges.node_a.tolist(), self.edges.node_b.tolist(), street_nodes)
+        neighbour_src, neighbour_dst = self.street_intersection_pairs(street_nodes, self.edges[["N", "S", "E", "W"]])
+        self.add_street_edges(src + neighbour_src, dst + neighbour_dst)
+
+        self.run_phase("remove_contra_direction_edges", self.remove_contra_direction_edges)
+        self.run_phase("close_inactive_roads", self.close_inactive_roads)
+        self.run_phase("connect_buildings_in_same_street", self.connect_buildings_in_same_street)
+
+
+    def building_street_pairs(self, node_a: list, node_b: list, street_nodes: list):
+        """
+        building to street edges of the edges rows, node_b wins over node_a like connect_building_and_street
+
+        :return: building and street node lists
+        """
+        node_index = self.node_ids
+        src, dst = [], []
+        for a, b, street_node in zip(node_a, node_b, street_nodes):
+            building = b if b in node_index else (a if a in node_index else "")
+            if building != "":
+                src.append(building)
+                dst.append(street_node)
+        return src, dst
+
+    @staticmethod
+    def street_intersection_pairs(street_nodes: list, neighbours: pd.DataFrame):
+        """
+        street intersection edges of the edges rows, row by row and in N, S, E, W order
+
+        :param street_nodes: intersection node of every row
+        :param neighbours: N, S, E, W columns of the rows, dataframe or (n, 4) array
+        :return: intersection and neighbour node lists
+        """
+        neighbours = np.asarray(getattr(neighbours, "values", neighbours), dtype=object).ravel()
+        starts = np.repeat(np.array(street_nodes, dtype=object), 4)
+        available = neighbours != ""
+        return starts[available].tolist(), neighbours[available].tolist()
+
+    def add_street_edges(self, src: list, dst: list):
+        """
+        add the edges between src and dst in both directions, the distances and bearings
+        are computed in one vectorized pass
+
+        :return: None
+        """
+        node_index = self.node_ids
+        src_index = np.fromiter((node_index[node] for node in src), dtype=np.int64, count=len(src))
+        dst_index = np.fromiter((node_index[node] for node in dst), dtype=np.int64, count=len(dst))
+        dist, bearing = self.distance_and_bearing(self.coordinates[src_index], self.coordinates[dst_index])
+        reverse = self.reverse_bearings(bearing)
+        goto = self.convert_bearings_to_directions(bearing)
+        reverse_goto = self.convert_bearings_to_directions(reverse)
+
+        def directed_edges():
+            for a, b, d, fw, fw_goto, bw, bw_goto in zip(src, dst, dist.tolist(), bearing.tolist(), goto.tolist(),
+                                                         reverse.tolist(), reverse_goto.tolist()):
+                yield a, b, {"weight": d, "bearing": fw, "goto": fw_goto}
+                yield b, a, {"weight": d, "bearing": bw, "goto": bw_goto}
+
+        self.path_graph.add_edges_from(directed_edges())
 
     def render_path(self, path_node: list):
         """
@@ -378,86 +1932,88 @@ class ShortestPath:
         ...
         KeyError: 'abc'
         """
+        graph = self.graph_view()
         all_path = []
-        for my_node in path_node:
-            temp_path = []
+        for shortest in path_node:
+            temp_path = [step.as_dict(graph) for step in self.iter_route_steps(shortest)]
             total_distance = 0
-            #shortest = path_node
-            shortest = my_node
-            j = 0
-            for i, path in enumerate(shortest):
-                # print(my_g.node[path])
-                if i == 0:
-                    start = path
-                    start_node = self.path_graph.node[start]
-                    latlong = start_node["coor"].split(",")
-                    start_lat = latlong[0]
-                    start_long = latlong[1]
-                if i + 1 < len(shortest):
-                    same_direction = False
-                    if i == len(shortest) - 1:
-                        end = shortest[i + 1]
-                    else:
-                        my_edge = self.path_graph.edge[path][shortest[i + 1]]
-                        # print(shortest[i + 1])
-                        dest_node = self.path_graph.node[shortest[i + 1]]
-                        pass_by = []
-                        if dest_node["type"] == "intersection":
-                            if (dest_node["a"] == start):
-                                end = dest_node["b"]
-                            elif (dest_node["b"] == start):
-                                end = dest_node["a"]
-                            else:
-                                # print(path)
-                                # print(my_edge)
-                                if last_attempt["goto"] == my_edge["goto"]:
-                                    same_direction = True
-                                    if last_attempt["start"] == dest_node["a"]:
-                                        end = dest_node["b"]
-                                    else:
-                                        end = dest_node["a"]
-                                else:
-                                    end = "{} and {}".format(dest_node["a"], dest_node["b"])
-                        else:
-                            end = shortest[i + 1]
-                        #print(path)
-                        #print(self.path_graph.edge[path])
-                        end_node = dest_node
-                        latlong = end_node["coor"].split(",")
-                        end_lat = latlong[0]
-                        end_long = latlong[1]
-
-                    if not same_direction:
-                        last_attempt = {'start': start, 'end': end, 'dist': my_edge["weight"],
-                                        'bearing': my_edge["bearing"],
-                                        'goto': my_edge["goto"], "start_lat": start_lat, "start_long": start_long,
-                                        "end_lat": end_lat, "end_long": end_long, "pass_by": []}
-                        temp_path.append(last_attempt)
-                        j += 1
-                    else:
-                        temp_path[j - 1]["end_lat"] = end_lat
-                        temp_path[j - 1]["end_long"] = end_long
-                        temp_path[j - 1]["pass_by"].append(temp_path[j - 1]["end"])
-                        temp_path[j - 1]["end"] = end
-                        temp_path[j - 1]["dist"] += my_edge["weight"]
-
-                    total_distance += my_edge["weight"]
-                    start = end
-                    # start_node = end_node
-                    start_lat = end_lat
-                    start_long = end_long
-
+            for a, b in zip(shortest, shortest[1:]):
+                total_distance += graph.edge[a][b]["weight"]
             shortest_path = (temp_path, total_distance, len(temp_path))
             all_path.append(shortest_path)
         return all_path
 
-    def shortest_path(self, where_from: str, where_to: str):
+    def iter_route_steps(self, shortest: list):
+        """
+        generator of the RouteStep records of the path node list, the edges going
+        the same direction along a street are merged into one step which is only yielded
+        once the next step starts. the coordinates come from the node coordinate array
+
+        :param shortest: node list
+        :return: generator of RouteStep
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> steps = uiuc.iter_route_steps(uiuc.find_path('Swanlund Administration Building','University YMCA'))
+        >>> next(steps)
+        RouteStep('Swanlund Administration Building', 'East John Street', 21.88, 'North')
+        >>> [(step.goto, step.end) for step in steps] # doctest: +NORMALIZE_WHITESPACE
+        [('West', 'S 6th Street'), ('South', 'East Armory Ave'), ('East', 'S Wright Street'),
+         ('North', 'University YMCA'), ('West', 'University YMCA')]
+        """
+        graph = self.graph_view()
+        graph_node = graph.node
+        graph_edge = graph.edge
+        if len(shortest) == 0:
+            return
+        start = shortest[0]
+        start_coordinate = self.node_coordinate(start)
+        start_node = start
+        last_attempt = None
+        for i in range(len(shortest) - 1):
+            my_edge = graph_edge[shortest[i]][shortest[i + 1]]
+            dest_node = graph_node[shortest[i + 1]]
+            same_direction = False
+            if dest_node["type"] == "intersection":
+                if dest_node["a"] == start:
+                    end = dest_node["b"]
+                elif dest_node["b"] == start:
+                    end = dest_node["a"]
+                elif last_attempt["goto"] == my_edge["goto"]:
+                    same_direction = True
+                    if last_attempt.start == dest_node["a"]:
+                        end = dest_node["b"]
+                    else:
+                        end = dest_node["a"]
+                else:
+                    end = "{} and {}".format(dest_node["a"], dest_node["b"])
+            else:
+                end = shortest[i + 1]
+            end_coordinate = self.node_coordinate(shortest[i + 1])
+
+            if not same_direction:
+                if last_attempt is not None:
+                    yield last_attempt
+                last_attempt = RouteStep(start, end, my_edge["weight"], my_edge["bearing"], my_edge["goto"],
+                                         start_coordinate, end_coordinate, start_node, shortest[i + 1])
+            else:
+                last_attempt.end_lat, last_attempt.end_long = end_coordinate
+                last_attempt.end_node = shortest[i + 1]
+                last_attempt.pass_by.append(last_attempt.end)
+                last_attempt.end = end
+                last_attempt.dist += my_edge["weight"]
+            start = end
+            start_coordinate = end_coordinate
+            start_node = shortest[i + 1]
+        if last_attempt is not None:
+            yield last_attempt
+
+    def shortest_path(self, where_from: str, where_to: str, depart_at=None):
         """
         given two destinations, we use the network graph to compute the shortest path
         and return the shortest node list
 
         :param where_from:
         :param where_to:
+        :param depart_at: departure time, the scheduled closures of set_schedule apply (not cached)
         :return:
         >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
         >>> uiuc.shortest_path('Swanlund Administration Building','University YMCA')# doctest: +ELLIPSIS
@@ -466,33 +2022,625 @@ class ShortestPath:
         [([{'start': 'Library and Information Sciences', ...
         """
 
-        return self.render_path([nx.shortest_path(self.path_graph, where_from, where_to, weight="weight")])
+        metrics = self.metrics
+        sampled = False
+        if metrics is not None:
+            metrics.increment("queries")
+            sampled = metrics.sampled()
+        cache = self.route_cache if depart_at is None else None
+        if cache is not None:
+            route = cache.get(where_from, where_to)
+            if route is not None:
+                if metrics is not None:
+                    metrics.increment("route_cache_hits")
+                return route
+        if sampled:
+            start = time.perf_counter()
+        path = self.find_path(where_from, where_to, depart_at)
+        if sampled:
+            searched = time.perf_counter()
+        route = self.render_path([path])
+        if sampled:
+            self.record_query(where_from, where_to, path, searched - start, time.perf_counter() - searched,
+                              depart_at is not None)
+        if cache is not None:
+            cache.put(where_from, where_to, route, path)
+        return route
 
-    def all_path(self,where_from:str,where_to:str):
+    def shortest_paths(self, where_from: str, targets: list, depart_at=None):
         """
-        given two destinations, we use the network graph to compute the shortest path
-        and return the shortest node list
+        given a source node and many destinations, return their routes like shortest_path.
+        with the plain dijkstra of the frozen engine the destinations missing from the route cache
+        share one search tree, which gives the paths of dijkstra. the other algorithms and the depart_at
+        queries answer every destination with shortest_path
+
+        :param where_from: source node
+        :param targets: destination nodes
+        :param depart_at: departure time, see shortest_path
+        :return: dictionary destination -> rendered route, None when there is no path
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.freeze_graph()
+        >>> routes = uiuc.shortest_paths('Lincoln Hall', ['Ice Arena', 'University YMCA'])
+        >>> routes['Ice Arena'] == uiuc.shortest_path('Lincoln Hall', 'Ice Arena')
+        True
+        >>> uiuc.close_road('East John Street-S 6th Street', 'East Daniel Street-S 6th Street')
+        >>> uiuc.freeze_graph("ch")
+        >>> uiuc.shortest_paths('Lincoln Hall', ['University YMCA'])['University YMCA'] == routes['University YMCA']
+        True
+        """
+        routes = {}
+        targets = list(dict.fromkeys(targets))
+        if self.engine is None or self.algorithm != "dijkstra" or depart_at is not None or len(targets) < 2:
+            for where_to in targets:
+                try:
+                    routes[where_to] = self.shortest_path(where_from, where_to, depart_at)
+                except nx.NetworkXNoPath:
+                    routes[where_to] = None
+            return routes
+        cache = self.route_cache
+        if self.metrics is not None:
+            self.metrics.increment("queries", len(targets))
+        for where_to in targets:
+            route = cache.get(where_from, where_to) if cache is not None else None
+            if route is not None:
+                routes[where_to] = route
+                if self.metrics is not None:
+                    self.metrics.increment("route_cache_hits")
+        engine = self.engine
+        missing = [where_to for where_to in targets if where_to not in routes]
+        if len(missing) == 0:
+            return routes
+        dist, pred = engine.search_tree(engine.node_index[where_from],
+                                        {engine.node_index[where_to] for where_to in missing})
+        for where_to in missing:
+            target = engine.node_index[where_to]
+            if target not in dist:
+                routes[where_to] = None
+                continue
+            path = engine.unwind(pred, target)
+            routes[where_to] = self.render_path([path])
+            if cache is not None:
+                cache.put(where_from, where_to, routes[where_to], path)
+        return routes
+
+    def record_query(self, where_from: str, where_to: str, path: list, search_seconds: float, render_seconds: float,
+                     scheduled: bool = False):
+        """
+        give the measures of a sampled shortest_path query to the metrics, the nodes settled and the
+        edges scanned are counted from the last search of the frozen engine
+
+        :param scheduled: the query used the schedule, which searches over the engine nodes
+        :return: None
+        """
+        record = {"from": where_from, "to": where_to, "search_seconds": search_seconds,
+                  "render_seconds": render_seconds, "path_nodes": len(path)}
+        if self.engine is not None:
+            # a stale hierarchy is not searched, see RoutingEngine.shortest_path
+            hierarchy = None if self.engine.hierarchy_stale else self.engine.hierarchy
+            searcher = None if scheduled else {"ch": hierarchy, "turns": self.engine.turns}.get(self.algorithm)
+            searcher = searcher or self.engine
+            record["nodes_settled"], record["edges_scanned"] = searcher.search_counts()
+        self.metrics.record_query(record)
+
+    def enable_metrics(self, sample_rate: float = 1.0, sink=None):
+        """
+        count the shortest_path queries and the route cache hits, and measure the search time, render time,
+        nodes settled and edges scanned of the sampled queries. a sample_rate of 0.01 keeps the overhead
+        far below 1% of the query time, the construction phase timings are exported as gauges
+
+        :param sample_rate: fraction of the queries measured
+        :param sink: callable given the record of every sampled query, like Metrics.JsonLinesSink
+        :return: Metrics
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.freeze_graph()
+        >>> records = []
+        >>> metrics = uiuc.enable_metrics(sink=records.append)
+        >>> _ = uiuc.shortest_path('Lincoln Hall', 'Ice Arena')
+        >>> sorted(records[0])
+        ['edges_scanned', 'from', 'nodes_settled', 'path_nodes', 'render_seconds', 'search_seconds', 'to']
+        >>> records[0]["nodes_settled"] == len(uiuc.engine.last_settled) > 0
+        True
+        >>> metrics.counters, metrics.summaries["query_path_nodes"][0]
+        ({'queries': 1}, 1)
+        >>> text = metrics.prometheus()
+        >>> 'shortestpath_queries_total 1' in text, 'shortestpath_phase_seconds{phase="freeze_graph"}' in text
+        (True, True)
+        >>> import json
+        >>> json.loads(metrics.json())["summaries"]["query_nodes_settled"]["count"]
+        1
+        """
+        self.metrics = Metrics(sample_rate, sink, self.phase_timings)
+        return self.metrics
+
+    def enable_route_cache(self, max_entries: int = 1024, store_file: str = None, store_entries: int = 100000):
+        """
+        cache the rendered routes of shortest_path, the least recently used routes are evicted
+        above max_entries. closing a road only drops the cached routes going over it,
+        reopening a road or removing a one direction rule drops every route.
+        with store_file the routes are shared with the other processes using the same file, the same
+        datasets and the same algorithm, they should apply the same road changes. the routes are pickled
+        in the file, so it should only be writable by the user running the processes
+
+        :param max_entries: number of routes kept in memory
+        :param store_file: sqlite file shared between the processes
+        :param store_entries: number of routes kept in the shared file
+        :return: RouteCache
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> cache = uiuc.enable_route_cache(max_entries=2)
+        >>> route = uiuc.shortest_path('Swanlund Administration Building','University YMCA')
+        >>> uiuc.shortest_path('Swanlund Administration Building','University YMCA') is route
+        True
+        >>> _ = uiuc.shortest_path('Library and Information Sciences','Police Training Institute')
+        >>> _ = uiuc.shortest_path('Lincoln Hall','Ice Arena')
+        >>> cache.stats()
+        {'entries': 2, 'hits': 1, 'misses': 3, 'evictions': 1, 'invalidations': 0}
+        >>> uiuc.close_road('S 6th Street-East Chalmers Street', 'East Armory Ave-S 6th Street')
+        >>> len(cache), cache.invalidations
+        (1, 1)
+        >>> import tempfile
+        >>> store_file = os.path.join(tempfile.mkdtemp(), "routes.db")
+        >>> first=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> _ = first.enable_route_cache(store_file=store_file)
+        >>> route = first.shortest_path('Lincoln Hall','Ice Arena')
+        >>> other=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> other_cache = other.enable_route_cache(store_file=store_file)
+        >>> other.shortest_path('Lincoln Hall','Ice Arena') == route, other_cache.hits
+        (True, 1)
+        >>> other.freeze_graph("ch")
+        >>> _ = other.shortest_path('Lincoln Hall','Ice Arena')
+        >>> shared = first.route_cache.store_key(('Lincoln Hall','Ice Arena'))
+        >>> other_cache.hits, first.route_cache.store.get(shared) == route
+        (1, True)
+        """
+        store = RouteStore(store_file, store_entries) if store_file is not None else None
+        self.route_cache = RouteCache(max_entries, store, self.route_scope())
+        return self.route_cache
+
+    def route_scope(self):
+        """
+        :return: scope of the routes shared by the route cache, the datasets and the algorithm
+        """
+        return "|".join([self.algorithm] + [str(file_name) for file_name in self.source_files])
+
+    def find_path(self, where_from: str, where_to: str, depart_at=None):
+        """
+        given two destinations, return the shortest node list using the CSR routing engine
+        when the graph is frozen, networkx otherwise
+
+        :param where_from:
+        :param where_to:
+        :param depart_at: departure time, the path goes over the edges open at the time they are reached.
+            the schedule search gives the shortest path of dijkstra, astar and ch, the turns are not supported
+        :return: node list
+        """
+        if depart_at is not None:
+            if self.algorithm == "turns":
+                raise ValueError("depart_at queries do not take the turn costs of the turns algorithm")
+            return self.edge_schedule().query(where_from, where_to, depart_at)
+        if self.engine is not None:
+            return self.engine.shortest_path(where_from, where_to, self.algorithm)
+        return nx.shortest_path(self.path_graph, where_from, where_to, weight="weight")
+
+    def load_schedule(self, schedule_file: str):
+        """
+        read the scheduled closures of the schedule csv file, see Schedule.py for the format
+
+        :param schedule_file: csv file with node_a, node_b, start, end and factor columns
+        :return: None
+        """
+        import pandas as pd
+        schedule = pd.read_csv(schedule_file, dtype=str, keep_default_na=False)
+        if "factor" not in schedule:
+            schedule["factor"] = ""
+        self.set_schedule(list(zip(schedule.node_a, schedule.node_b, schedule.start, schedule.end, schedule.factor)))
+
+    def set_schedule(self, rows: list):
+        """
+        set the scheduled closures and slowdowns used by the depart_at queries. the graph and the engine
+        are not changed, only the small profile and time bucket arrays of EdgeSchedule are built again
+
+        :param rows: (node_a, node_b, start, end, factor) time windows, see Schedule.py
+        :return: None
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.freeze_graph()
+        >>> engine = uiuc.engine
+        >>> path = uiuc.find_path('Lincoln Hall', 'Ice Arena')
+        >>> gate = (path[3], path[4])
+        >>> uiuc.set_schedule([gate + ("22:00", "06:00", "closed"), gate + ("Sat 12:00", "Sat 18:00", "2")])
+        >>> uiuc.find_path('Lincoln Hall', 'Ice Arena', depart_at="12:00") == path
+        True
+        >>> night = uiuc.find_path('Lincoln Hall', 'Ice Arena', depart_at="Tue 23:30")
+        >>> gate in zip(night, night[1:]), uiuc.engine is engine
+        (False, True)
+        >>> from datetime import datetime
+        >>> [uiuc.schedule.factor(*gate, when) for when in ("05:59", "06:00", datetime(2024, 6, 1, 13, 0))]
+        [inf, 1.0, 2.0]
+        >>> uiuc.schedule.bucket_minutes
+        120
+        >>> uiuc.shortest_path('Lincoln Hall', 'Ice Arena', depart_at="23:30")[0][1] > uiuc.shortest_path('Lincoln Hall', 'Ice Arena')[0][1]
+        True
+        >>> uiuc.freeze_graph("turns")
+        >>> uiuc.find_path('Lincoln Hall', 'Ice Arena', depart_at="23:30")
+        Traceback (most recent call last):
+        ...
+        ValueError: depart_at queries do not take the turn costs of the turns algorithm
+        """
+        rows = list(rows)
+        # a bad window is reported now, not by the first query
+        for row in rows:
+            week_windows(row[2], row[3])
+        self.schedule_rows = rows
+        self.schedule = None
+        self.revision += 1
+
+    def edge_schedule(self):
+        """
+        :return: EdgeSchedule of the schedule rows for the current engine, the graph is frozen when it is not
+        """
+        if self.engine is None:
+            self.freeze_graph(self.algorithm)
+        if self.schedule is None or self.schedule.engine is not self.engine:
+            self.schedule = EdgeSchedule(self.engine, self.schedule_rows)
+        return self.schedule
+
+    def freeze_graph(self, algorithm: str = "dijkstra", background: bool = False):
+        """
+        freeze the path_graph into the integer indexed CSR arrays of the RoutingEngine,
+        shortest_path will use the engine afterwards. a compiled graph uses its memory-mapped arrays.
+        the engine does not follow later changes of path_graph, freeze the graph again after changing it
+
+        :param algorithm: dijkstra, which returns the same path as networkx, astar, ch or turns.
+            ch preprocesses a contraction hierarchy and answers with bidirectional upward searches,
+            turns adds the turn costs of set_turn_costs to the distance
+        :param background: contract the hierarchy of ch in a thread, the ch queries use dijkstra until it is
+            done. the graph changes which need a new engine freeze it this way
+        :return: None
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> expected = uiuc.shortest_path('Swanlund Administration Building','University YMCA')
+        >>> uiuc.freeze_graph()
+        >>> uiuc.shortest_path('Swanlund Administration Building','University YMCA') == expected
+        True
+        >>> uiuc.freeze_graph("astar")
+        >>> uiuc.shortest_path('Swanlund Administration Building','University YMCA')[0][1] == expected[0][1]
+        True
+        >>> uiuc.find_path('Swanlund Administration Building','abc')
+        Traceback (most recent call last):
+        ...
+        KeyError: 'abc'
+        >>> uiuc.freeze_graph("ch")
+        >>> uiuc.shortest_path('Swanlund Administration Building','University YMCA')[0][1] == expected[0][1]
+        True
+        >>> import itertools
+        >>> pairs = list(itertools.permutations(uiuc.buildings["name"], 2))
+        >>> cost = lambda path: sum(uiuc.path_graph.edge[a][b]["weight"] for a, b in zip(path, path[1:]))
+        >>> all(abs(cost(uiuc.engine.shortest_path(a, b, "ch")) - cost(uiuc.engine.dijkstra(a, b))) < 1e-6
+        ...     for a, b in pairs)
+        True
+        >>> uiuc.close_road('East John Street-S 6th Street', 'East Daniel Street-S 6th Street')
+        >>> uiuc.engine.hierarchy_stale
+        True
+        >>> all(abs(cost(uiuc.engine.shortest_path(a, b, "ch")) - cost(uiuc.engine.dijkstra(a, b))) < 1e-6
+        ...     for a, b in pairs)
+        True
+        >>> uiuc.engine.contraction.join()
+        >>> uiuc.engine.hierarchy_stale
+        False
+        >>> all(abs(cost(uiuc.engine.shortest_path(a, b, "ch")) - cost(uiuc.engine.dijkstra(a, b))) < 1e-6
+        ...     for a, b in pairs)
+        True
+        """
+        if algorithm not in ("dijkstra", "astar", "ch", "turns"):
+            raise ValueError("unknown routing algorithm {}".format(algorithm))
+        if self.compiled is not None:
+            self.engine = self.run_phase("freeze_graph", RoutingEngine.from_compiled, self.compiled)
+        else:
+            self.engine = self.run_phase("freeze_graph", RoutingEngine.from_digraph, self.path_graph,
+                                         self.frozen_coordinates())
+        if algorithm == "ch":
+            if background:
+                self.engine.contract_in_background()
+            else:
+                self.run_phase("contract", self.engine.contract)
+        if algorithm == "turns":
+            self.run_phase("turn_table", self.engine.turn_table, self.edge_bearings(), **self.turn_options)
+        if algorithm != self.algorithm:
+            # another algorithm can return other paths of the same length, or longer ones with the turns
+            self.clear_caches()
+        self.algorithm = algorithm
+        self.revision += 1
+        if self.route_cache is not None:
+            self.route_cache.scope = self.route_scope()
+
+    def clear_caches(self):
+        """
+        drop the cached routes and shortest path trees after the routing rules changed
+
+        :return: None
+        """
+        for cache in (self.route_cache, self.tree_cache):
+            if cache is not None:
+                cache.clear()
+
+    def edge_bearings(self):
+        """
+        :return: bearing of every edge of the frozen engine, in its CSR order
+        """
+        if self.compiled is not None:
+            return np.asarray(self.compiled.bearing, dtype=np.float64)
+        edge = self.path_graph.edge
+        return np.array([attr["bearing"] for node in self.engine.nodes for attr in edge[node].values()],
+                        dtype=np.float64)
+
+    def set_turn_costs(self, costs: dict = None, restrictions: list = (), no_left_turn: list = ()):
+        """
+        set the turn costs of the turns algorithm, the search goes over the edges (line graph) so the
+        cost of a turn between two edges is added to the distance. the turn between two edges is straight,
+        right, left or a u-turn from their bearing difference, see TurnTable
+
+        :param costs: extra cost in meter of the straight, right, left and u_turn turns, TurnTable.TURN_COSTS
+            by default
+        :param restrictions: banned (from node, via node, to node) turns
+        :param no_left_turn: intersections where the left turns are banned
+        :return: None, freeze_graph("turns") builds the table
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.freeze_graph("turns")
+        >>> turns = uiuc.engine.turns
+        >>> path = uiuc.find_path('Lincoln Hall', 'Ice Arena')
+        >>> fewest = turns.count_turns(path)
+        >>> fewest["left"] <= turns.count_turns(uiuc.engine.dijkstra('Lincoln Hall', 'Ice Arena'))["left"]
+        True
+        >>> via = [(a, b, c) for a, b, c in zip(path, path[1:], path[2:]) if turns.turn(a, b, c) == "left"][0]
+        >>> uiuc.set_turn_costs(restrictions=[via])
+        >>> path = uiuc.find_path('Lincoln Hall', 'Ice Arena')
+        >>> uiuc.engine.turns.turn(*via), via in zip(path, path[1:], path[2:])
+        ('banned', False)
+        >>> _ = uiuc.enable_route_cache()
+        >>> route = uiuc.shortest_path('Lincoln Hall', 'Ice Arena')
+        >>> uiuc.set_turn_costs()
+        >>> uiuc.shortest_path('Lincoln Hall', 'Ice Arena') == route
+        False
+        """
+        self.turn_options = {"costs": costs, "restrictions": list(restrictions), "no_left_turn": list(no_left_turn)}
+        self.revision += 1
+        if self.algorithm == "turns":
+            self.clear_caches()
+            if self.engine is not None:
+                self.engine.turn_table(self.edge_bearings(), **self.turn_options)
+
+    def export_routes(self, pairs, file_name: str, file_format: str = "geojson", dedupe: bool = True):
+        """
+        find the routes of the pairs and write them to a GeoJSON file without a display. every route
+        is written once found and the shared segments are the graph edges, so the memory stays flat
+        for any number of pairs. the pairs without a path are skipped
+
+        :param pairs: iterable of (where_from, where_to)
+        :param file_name: output file
+        :param file_format: geojson or geojsonseq (one feature per line, for tippecanoe)
+        :param dedupe: write every shared segment once, see RouteExport.py
+        :return: number of routes exported and number of pairs without a path
+        >>> import json, os, tempfile
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> file_name = os.path.join(tempfile.mkdtemp(), "routes.geojsons")
+        >>> uiuc.export_routes([('Lincoln Hall', 'Ice Arena'), ('Ice Arena', 'Lincoln Hall')], file_name, "geojsonseq")
+        (2, 0)
+        >>> kinds = [json.loads(line[1:])["properties"]["kind"] for line in open(file_name)]
+        >>> kinds.count("segment"), kinds.count("route")
+        (9, 2)
+        """
+        graph_edge = self.graph_view().edge
+        exported = missing = 0
+        with GeoJsonExporter(file_name, file_format, dedupe) as exporter:
+            for where_from, where_to in pairs:
+                try:
+                    path = self.find_path(where_from, where_to)
+                except nx.NetworkXNoPath:
+                    missing += 1
+                    continue
+                distance = sum(graph_edge[a][b]["weight"] for a, b in zip(path, path[1:]))
+                exporter.add_path([self.node_ids[node] for node in path], self.nodes_coordinates(path), distance,
+                                  {"from": where_from, "to": where_to})
+                exported += 1
+        return exported, missing
+
+    def distance_matrix(self, origins: list, destinations: list, processes: int = 1):
+        """
+        given the origin and destination nodes, compute the walking distance from every origin
+        to every destination with one search per origin. the search uses the CSR routing engine,
+        a temporary one is frozen when the graph is not frozen yet
+
+        :param origins: origin nodes
+        :param destinations: destination nodes
+        :param processes: spread the origins over this many forked worker processes
+        :return: DistanceMatrix, distances is a len(origins) x len(destinations) numpy array
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> origins = [uiuc.search_node_by_mail_code(304), uiuc.search_node_by_mail_code(493)]
+        >>> destinations = ['University YMCA', 'Police Training Institute', 'Ice Arena']
+        >>> matrix = uiuc.distance_matrix(origins, destinations)
+        >>> matrix.distances.shape
+        (2, 3)
+        >>> bool(abs(matrix.distances[0, 0] - uiuc.shortest_path(origins[0], destinations[0])[0][1]) < 1e-6)
+        True
+        >>> matrix.render(1, 1) == uiuc.shortest_path(origins[1], destinations[1])
+        True
+        >>> bool((uiuc.distance_matrix(origins, destinations, processes=2).distances == matrix.distances).all())
+        True
+        """
+        engine = self.engine if self.engine is not None else \
+            RoutingEngine.from_digraph(self.path_graph, self.frozen_coordinates())
+        distances, trees = engine.many_to_many(origins, destinations, processes)
+        return DistanceMatrix(self, engine, origins, destinations, distances, trees)
+
+    def partition(self, cells: int = 4, processes: int = 1):
+        """
+        split the graph into the regions of a cells x cells geographic grid and precompute
+        the distances between the region boundary nodes, the region searches run in
+        processes forked workers. the partitioned graph is a snapshot, partition again after
+        changing the road rules
+
+        :param cells: grid cells along the latitude and the longitude
+        :param processes: number of worker processes
+        :return: PartitionedGraph
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> partitioned = uiuc.partition(cells=3, processes=2)
+        >>> len(partitioned.partitions)
+        9
+        >>> distance, path = partitioned.query('Lincoln Hall', 'Ice Arena')
+        >>> round(distance), path == uiuc.find_path('Lincoln Hall', 'Ice Arena')
+        (571, True)
+        >>> pairs = list(itertools.permutations(uiuc.buildings["name"], 2))
+        >>> matrix = uiuc.distance_matrix(uiuc.buildings["name"], uiuc.buildings["name"])
+        >>> index = {name: i for i, name in enumerate(uiuc.buildings["name"])}
+        >>> all(abs(distance - matrix.distances[index[a], index[b]]) < 1e-6
+        ...     for (a, b), (distance, _) in zip(pairs, partitioned.query_many(pairs)))
+        True
+        """
+        engine = self.engine if self.engine is not None else \
+            RoutingEngine.from_digraph(self.path_graph, self.frozen_coordinates())
+        return PartitionedGraph(engine, cells, processes)
+
+    def shortest_path_tree(self, root: str, reverse: bool = False):
+        """
+        compute one shortest path tree covering every node with the CSR routing engine,
+        a temporary one is frozen when the graph is not frozen yet. the tree is taken from
+        and added to the tree cache when it is enabled
+
+        :param root: source node, or target node when reverse is True
+        :param reverse: search the reversed edges for the paths from every node to the root
+        :return: ShortestPathTree
+        """
+        if self.tree_cache is not None:
+            tree = self.tree_cache.get(root, reverse)
+            if tree is not None:
+                return tree
+        engine = self.engine if self.engine is not None else \
+            RoutingEngine.from_digraph(self.path_graph, self.frozen_coordinates())
+        search = engine.reverse() if reverse else engine
+        distances, predecessors = search.tree_arrays(engine.node_index[root])
+        tree = ShortestPathTree(self, engine, root, reverse, distances, predecessors)
+        if self.tree_cache is not None:
+            self.tree_cache.put(tree)
+        return tree
+
+    def one_to_all(self, where_from: str):
+        """
+        given a starting node, compute the shortest paths to every node with one search,
+        e.g. the closest building having a mail code in a set
+
+        :param where_from: source node
+        :return: ShortestPathTree
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> tree = uiuc.one_to_all('Lincoln Hall')
+        >>> round(tree.distance('Ice Arena')), tree.render('Ice Arena') == uiuc.shortest_path('Lincoln Hall','Ice Arena')
+        (571, True)
+        >>> building, distance = tree.nearest([uiuc.search_node_by_mail_code(code) for code in (304, 382, 409)])
+        >>> building, round(distance)
+        ('University YMCA', 617)
+        """
+        return self.shortest_path_tree(where_from)
+
+    def many_to_one(self, where_to: str):
+        """
+        given a destination, compute the shortest paths from every node to it with one search
+        over the reversed edges, which keeps the one direction streets
+
+        :param where_to: target node
+        :return: ShortestPathTree
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.freeze_graph()
+        >>> tree = uiuc.many_to_one('Ice Arena')
+        >>> buildings = uiuc.buildings["name"].tolist()
+        >>> all(abs(tree.distance(building) - uiuc.shortest_path(building, 'Ice Arena')[0][1]) < 1e-6
+        ...     for building in buildings if building != 'Ice Arena')
+        True
+        >>> tree.path('Lincoln Hall')[0], tree.path('Lincoln Hall')[-1]
+        ('Lincoln Hall', 'Ice Arena')
+        """
+        return self.shortest_path_tree(where_to, reverse=True)
+
+    def enable_tree_cache(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        cache the trees of one_to_all and many_to_one for the hot origins and destinations,
+        the least recently used trees are evicted above max_bytes of tree arrays.
+        closing a road only drops the trees going over it, reopening a road drops every tree
+
+        :param max_bytes: memory budget of the cached trees
+        :return: TreeCache
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> cache = uiuc.enable_tree_cache()
+        >>> tree = uiuc.many_to_one('Ice Arena')
+        >>> uiuc.many_to_one('Ice Arena') is tree, uiuc.one_to_all('Ice Arena') is tree, cache.hits
+        (True, False, 1)
+        >>> path = tree.path('Lincoln Hall')
+        >>> uiuc.close_road(path[-3], path[-2])
+        >>> uiuc.many_to_one('Ice Arena') is tree, len(cache)
+        (False, 2)
+        """
+        self.tree_cache = TreeCache(max_bytes)
+        return self.tree_cache
+
+    def all_path(self, where_from: str, where_to: str, k: int = 10, max_detour_ratio: float = None):
+        """
+        given two destinations, we use the network graph to compute the k shortest paths
+        and return them rendered, the shortest first. enumerating every simple path grows
+        exponentially with the graph, see k_shortest_paths
 
         :param where_from:
         :param where_to:
+        :param k: maximum number of paths
+        :param max_detour_ratio: skip the paths longer than this ratio of the shortest one
         :return:
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> paths = uiuc.all_path('Swanlund Administration Building','University YMCA', k=3)
+        >>> len(paths), paths[0] == uiuc.shortest_path('Swanlund Administration Building','University YMCA')[0]
+        (3, True)
+        >>> paths[0][1] <= paths[1][1] <= paths[2][1]
+        True
+        """
+        return list(self.k_shortest_paths(where_from, where_to, k, max_detour_ratio))
+
+    def k_shortest_paths(self, where_from: str, where_to: str, k: int = 10, max_detour_ratio: float = None):
+        """
+        generator of the k shortest simple paths in cost order (Yen's algorithm),
+        the next path is only searched and rendered when it is consumed.
+        a frozen graph uses the goal directed and detour bounded searches of the routing engine
 
+        :param where_from: source node
+        :param where_to: target node
+        :param k: maximum number of paths
+        :param max_detour_ratio: stop at the first path longer than this ratio of the shortest one
+        :return: generator of the rendered paths
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> paths = uiuc.k_shortest_paths('Lincoln Hall','Ice Arena', k=5, max_detour_ratio=1.3)
+        >>> [round(path[1]) for path in paths]
+        [571, 571, 711, 711]
+        >>> uiuc.freeze_graph()
+        >>> [round(path[1]) for path in uiuc.k_shortest_paths('Lincoln Hall','Ice Arena', k=8)]
+        [571, 571, 711, 711, 747, 747, 748, 748]
         """
-        return self.render_path(nx.all_simple_paths(self.path_graph, where_from, where_to))
+        if self.engine is not None:
+            paths = self.engine.k_shortest_paths(where_from, where_to, k, max_detour_ratio)
+        else:
+            paths = itertools.islice(nx.shortest_simple_paths(self.path_graph, where_from, where_to, weight="weight"),
+                                     k)
+        shortest = None
+        for path in paths:
+            # the rendered distance is the cost, it is read from the arrays of a compiled graph
+            route = self.render_path([path])[0]
+            if shortest is None:
+                shortest = route[1]
+            elif max_detour_ratio is not None and route[1] > shortest * max_detour_ratio:
+                return
+            yield route
 
     def list_mail_code(self):
         """
-        list mail code from the buildings panda data frame
+        list mail code of the buildings, the sorted list is cached by the building index
         :return: dict = list of tuples containing the buildings name and its mailcode
         >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
         >>> uiuc.list_mail_code()# doctest: +ELLIPSIS
         [(438, '505 East Green Street'),...]
         """
-        mail_codes = []
-        self.buildings = self.buildings.sort_values("name", ascending=True)
-        for i in range(self.buildings.shape[0]):
-            mail_codes.append((self.buildings.iloc[i].mail_code, self.buildings.iloc[i]["name"]))
-        return mail_codes
+        return list(self.building_index.sorted_mail_codes())
 
     def print_mail_code(self):
         """
@@ -535,13 +2683,149 @@ class ShortestPath:
             logging.error(ex)
             return None
 
-        graph_node = self.path_graph.node
-        # print(graph_node)
-        for node in graph_node:
-            if "mail_code" in graph_node[node]:
-                if graph_node[node]["mail_code"] == mail_code:
-                    return node
-        return None
+        return self.building_index.node_by_mail_code(mail_code)
+
+    def search_node_by_name(self, name: str):
+        """
+        This function will search for the building name (case insensitive) and
+        return the respective building node
+        :return: a node if the name found, None if it is not found
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.search_node_by_name("university ymca")
+        'University YMCA'
+        >>> uiuc.search_node_by_name("Lincoln")
+        """
+        return self.building_index.node_by_name(name)
+
+    def search_buildings(self, text: str, limit: int = 10):
+        """
+        This function will search for the building nodes matching a full, partial or misspelled name
+        :return: list of building nodes, the best match first
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.search_buildings("Lincoln")
+        ['Lincoln Hall']
+        >>> uiuc.search_buildings("illini")
+        ['Illini Hall', 'Illini Union Bookstore']
+        >>> uiuc.search_buildings("Swanlnd Administraton")
+        ['Swanlund Administration Building']
+        """
+        return self.building_index.search(text, limit)
+
+    def spatial(self):
+        """
+        :return: the SpatialIndex of the nodes, built on the first call
+        """
+        if self.spatial_index is None:
+            graph_node = self.graph_view().node
+            nodes = list(self.node_ids)
+            self.spatial_index = SpatialIndex(nodes, self.nodes_coordinates(nodes),
+                                              [graph_node[node]["type"] for node in nodes])
+        return self.spatial_index
+
+    def nearest_node(self, lat: float, long: float, kind: str = "building"):
+        """
+        This function will search for the node closest to a GPS coordinate
+        :param kind: building, intersection or None for any node
+        :return: nearest node, None if there is no node of the kind
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.nearest_node(40.10936, -88.22838)
+        'Altgeld Hall'
+        >>> uiuc.nearest_node(40.10936, -88.22838, kind="intersection")
+        'Altgeld Hall-S Wright Street'
+        """
+        return self.spatial().nearest(lat, long, kind)[0]
+
+    def snap_points(self, points, kind: str = "building"):
+        """
+        This function will search for the nodes closest to many GPS coordinates in one call
+        :param points: (n, 2) array or list of (lat, long)
+        :param kind: building, intersection or None for any node
+        :return: list of the nearest nodes and array of their distances in meter
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.snap_points([(40.10936, -88.22838), (40.10657, -88.22926)])[0]
+        ['Altgeld Hall', 'University YMCA']
+        """
+        return self.spatial().nearest_many(points, kind)
+
+    def route_from_point(self, lat: float, long: float, where_to: str, kind: str = "building"):
+        """
+        given a GPS coordinate, we snap it to the nearest node and compute the shortest path to where_to
+        :param kind: kind of the starting node, building or intersection
+        :return: rendered shortest path like shortest_path
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.route_from_point(40.10936, -88.22838, 'University YMCA')# doctest: +ELLIPSIS
+        [([{'start': 'Altgeld Hall', ...
+        """
+        where_from = self.nearest_node(lat, long, kind)
+        if where_from is None:
+            raise ValueError("no {} node to start from".format(kind))
+        return self.shortest_path(where_from, where_to)
+
+    def add_building(self, name: str, coordinate: str, mail_code: int):
+        """
+        add a building node at runtime and keep the mail code and name indexes up to date,
+        the building is connected to the streets by the edges dataset rows that name it, they are
+        found with intersections_by_name. a building without such a row is only registered and can not be routed to.
+        an existing building is moved to the coordinate
+
+        :param name: building name
+        :param coordinate: "lat,long" coordinate
+        :param mail_code: building mail code
+        :return: None
+        >>> uiuc=ShortestPath(buildings_file="buildings.csv", edges_file="edges.csv", streets_file="streets.csv")
+        >>> uiuc.add_building("Foellinger Auditorium", "40.105922,-88.227167", 540)
+        >>> uiuc.search_node_by_mail_code("540"), uiuc.search_buildings("auditorium")
+        ('Foellinger Auditorium', ['Foellinger Auditorium'])
+        >>> (540, 'Foellinger Auditorium') in uiuc.list_mail_code()
+        True
+        >>> import tempfile
+        >>> buildings_file = os.path.join(tempfile.mkdtemp(), "buildings.csv")
+        >>> uiuc.buildings[uiuc.buildings["name"] != "University YMCA"].to_csv(buildings_file, index=False)
+        >>> partial = ShortestPath(buildings_file=buildings_file, edges_file="edges.csv", streets_file="streets.csv")
+        >>> partial.freeze_graph()
+        >>> partial.add_building("University YMCA", "40.106565,-88.229256", 409)
+        >>> partial.find_path('Lincoln Hall', 'University YMCA') == uiuc.find_path('Lincoln Hall', 'University YMCA')
+        True
+        >>> sorted(partial.path_graph.edges()) == sorted(uiuc.path_graph.edges())
+        True
+        """
+        import pandas as pd
+        parsed = self.parse_coordinate(coordinate)
+        if parsed is None:
+            raise ValueError("malformed coordinate {!r} for building {}".format(coordinate, name))
+        # the buildings dataframe of a streamed graph is built before the node is added
+        buildings = self.buildings[self.buildings["name"] != name]
+        graph = self.path_graph
+        engine = self.engine
+        longer = []
+        if name not in self.node_ids:
+            self.node_ids[name] = len(self.coordinates)
+            self.coordinates = np.vstack([self.coordinates, [parsed]])
+            # the routing engine and the compiled arrays have no slot for the new node
+            self.engine = None
+            self.compiled = None
+        else:
+            # the coordinates of a compiled graph are a read-only mapping
+            self.coordinates = np.array(self.coordinates)
+            self.coordinates[self.node_ids[name]] = parsed
+            longer = graph.out_edges(name) + graph.in_edges(name)
+            graph.remove_edges_from(longer)
+        graph.add_node(name, attr_dict={"type": "building", "coor": coordinate, "mail_code": mail_code})
+        self.buildings = pd.concat([buildings, pd.DataFrame({"name": [name], "coordinate": [coordinate],
+                                                                  "mail_code": [mail_code]})], ignore_index=True)
+        self.building_index.add(name, mail_code)
+        if self.spatial_index is not None:
+            self.spatial_index.add(name, parsed[0], parsed[1], "building")
+
+        # the intersections of the edges rows naming the building, without scanning the edges dataset
+        street_nodes = sorted(node for node in self.intersections_by_name().get(name, ()) if node in graph.node)
+        src, dst = self.building_street_pairs([name] * len(street_nodes), [name] * len(street_nodes), street_nodes)
+        self.add_street_edges(src, dst)
+        self.join_street_segments(street_nodes, set(self.streets["name"].astype(str).tolist()))
+        relinked_longer, relinked_shorter = self.relink_segments(set(street_nodes))
+        self.graph_changed(longer + relinked_longer, list(zip(src, dst)) + list(zip(dst, src)) + relinked_shorter)
+        if engine is not None and self.engine is None:
+            self.freeze_graph(self.algorithm, background=True)
 
     def show_path_graph(self):
         """
@@ -549,6 +2833,7 @@ class ShortestPath:
 
         :return:
         """
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(10, 10))
         return nx.draw(self.path_graph, with_labels=True)
 
@@ -0,0 +1,296 @@
+"""
+
+SpatialIndex.py grid index for snapping GPS coordinates to the nearest ShortestPath node
+"""
+
+import math
+
+import numpy as np
+
+from RoutingEngine import EARTH_RADIUS
+
+# side of a grid cell in meter when the node density is not known, about one city block
+CELL_SIZE = 100.0
+
+
+class SpatialIndex:
+    """
+    uniform grid over the node coordinates projected to meters (equirectangular around the mean
+    latitude), one grid per node kind with cells holding about one node of the kind. a query looks
+    at the cells of the grid in rings around the point and stops once no unvisited cell can hold
+    a closer node, so it only touches the nodes around the point whatever the size of the map.
+    a point outside of the map starts at the first ring reaching the grid. the candidates are
+    ranked with the haversine distance
+    """
+
+    def __init__(self, nodes: list, coordinates: np.ndarray, kinds: list, cell_size: float = None):
+        self.cell_size = cell_size
+        self.cell_sizes = {}
+        self.nodes = []
+        self.node_ids = {}
+        self.kinds = []
+        self.lat = []
+        self.long = []
+        self.grids = {}
+        self.extent = {}
+        # kind -> cells of the grid packed in arrays for nearest_many, dropped on every change
+        self.packed = {}
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.ref_lat = float(coordinates[:, 0].mean()) if len(coordinates) else 0.0
+        self.scale = math.cos(math.radians(self.ref_lat))
+        if cell_size is None:
+            self.size_cells(coordinates, kinds)
+        self.add_many(nodes, coordinates, kinds)
+
+    def project(self, lat, long):
+        """
+        :return: x, y in meter of the coordinates
+        """
+        return np.radians(long) * EARTH_RADIUS * self.scale, np.radians(lat) * EARTH_RADIUS
+
+    def size_cells(self, coordinates: np.ndarray, kinds: list):
+        """
+        choose the cell size of every kind from the area covered by its nodes
+
+        :return: None
+        """
+        kinds = np.asarray(kinds)
+        for kind in set(kinds.tolist()):
+            x, y = self.project(coordinates[kinds == kind, 0], coordinates[kinds == kind, 1])
+            area = (x.max() - x.min()) * (y.max() - y.min())
+            if area > 0:
+                self.cell_sizes[kind] = max(1.0, math.sqrt(area / len(x)))
+
+    def cell_size_of(self, kind: str):
+        """
+        :return: side of the cells of the kind in meter
+        """
+        if self.cell_size is not None:
+            return self.cell_size
+        return self.cell_sizes.setdefault(kind, CELL_SIZE)
+
+    def cells(self, lat, long, kind: str):
+        """
+        :return: integer cell x, y of the coordinates in the grid of the kind
+        """
+        x, y = self.project(lat, long)
+        cell_size = self.cell_size_of(kind)
+        return np.floor(x / cell_size).astype(np.int64), np.floor(y / cell_size).astype(np.int64)
+
+    def add_many(self, nodes: list, coordinates: np.ndarray, kinds: list):
+        """
+        add the nodes to the grids, the cells are computed for all of them at once.
+        a node already in the index is moved to its new coordinates
+
+        :param nodes: node names
+        :param coordinates: (n, 2) array of lat, long
+        :param kinds: node kind of every node, building or intersection
+        :return: None
+        """
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        kinds = list(kinds)
+        self.packed.clear()
+        cells = {}
+        for kind in set(kinds):
+            rows = np.array([kind == row_kind for row_kind in kinds])
+            cell_x, cell_y = self.cells(coordinates[rows, 0], coordinates[rows, 1], kind)
+            cells[kind] = iter(zip(cell_x.tolist(), cell_y.tolist()))
+        for node, (lat, long), kind in zip(nodes, coordinates.tolist(), kinds):
+            x, y = next(cells[kind])
+            i = self.node_ids.get(node)
+            if i is None:
+                i = self.node_ids[node] = len(self.nodes)
+                self.nodes.append(node)
+                self.kinds.append(kind)
+                self.lat.append(lat)
+                self.long.append(long)
+            else:
+                # a moved node leaves its old cell
+                old_x, old_y = self.cells(self.lat[i], self.long[i], self.kinds[i])
+                self.grids[self.kinds[i]][(int(old_x), int(old_y))].remove(i)
+                self.kinds[i], self.lat[i], self.long[i] = kind, lat, long
+            self.grids.setdefault(kind, {}).setdefault((x, y), []).append(i)
+            low_x, low_y, high_x, high_y = self.extent.get(kind, (x, y, x, y))
+            self.extent[kind] = (min(low_x, x), min(low_y, y), max(high_x, x), max(high_y, y))
+
+    def add(self, node: str, lat: float, long: float, kind: str):
+        """
+        add or move one node, only its cell changes
+
+        :return: None
+        """
+        self.add_many([node], np.array([[lat, long]]), [kind])
+
+    def remove(self, node: str):
+        """
+        remove one node from its cell, its slot stays unused
+
+        :return: None
+        """
+        i = self.node_ids.pop(node, None)
+        if i is not None:
+            self.packed.clear()
+            x, y = self.cells(self.lat[i], self.long[i], self.kinds[i])
+            self.grids[self.kinds[i]][(int(x), int(y))].remove(i)
+
+    def distance(self, lat: float, long: float, i: int):
+        """
+        :return: haversine distance in meter from the coordinates to the node i
+        """
+        lat_a, lat_b = math.radians(lat), math.radians(self.lat[i])
+        h = math.sin((lat_b - lat_a) / 2) ** 2 + \
+            math.cos(lat_a) * math.cos(lat_b) * math.sin(math.radians(self.long[i] - long) / 2) ** 2
+        return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+    def nearest(self, lat: float, long: float, kind: str = None):
+        """
+        :param lat: latitude
+        :param long: longitude
+        :param kind: building, intersection or None for any node
+        :return: nearest node and its distance in meter, (None, inf) when there is no node of the kind
+        """
+        kinds = [kind] if kind is not None else list(self.grids)
+        best, best_distance = None, math.inf
+        for grid_kind in kinds:
+            node, distance = self.nearest_in(lat, long, grid_kind)
+            if distance < best_distance:
+                best, best_distance = node, distance
+        return best, best_distance
+
+    def nearest_in(self, lat: float, long: float, kind: str):
+        """
+        ring search in the grid of one kind
+
+        :return: nearest node and its distance in meter
+        >>> index = SpatialIndex(["a", "b"], np.array([[40.1, -88.2], [40.11, -88.2]]), ["building"] * 2)
+        >>> index.nearest_in(40.109, -88.2, "building")[0], index.nearest_in(45.0, -88.2, "building")[0]
+        ('b', 'b')
+        """
+        grid = self.grids.get(kind)
+        if not grid:
+            return None, math.inf
+        cell_x, cell_y = self.cells(lat, long, kind)
+        cell_size = self.cell_size_of(kind)
+        best, best_distance = None, math.inf
+        for ring, cells in self.rings(int(cell_x), int(cell_y), kind):
+            for cell in cells:
+                for i in grid.get(cell, ()):
+                    distance = self.distance(lat, long, i)
+                    if distance < best_distance:
+                        best, best_distance = i, distance
+            # every node in the next ring is at least ring cells away, 1% covers the projection error
+            if best is not None and best_distance * 0.99 <= ring * cell_size:
+                break
+        return self.nodes[best], best_distance
+
+    def rings(self, cx: int, cy: int, kind: str):
+        """
+        the cells of the grid of the kind in rings around the cell cx, cy. the rings start at the first
+        one reaching the extent of the grid and end at the last one, only their cells inside the extent
+        are listed, so the work does not grow with the distance from a point outside of the map
+
+        :return: generator of the ring number and its cells
+        """
+        low_x, low_y, high_x, high_y = self.extent[kind]
+        first = max(0, low_x - cx, cx - high_x, low_y - cy, cy - high_y)
+        last = max(abs(cx - low_x), abs(cx - high_x), abs(cy - low_y), abs(cy - high_y))
+        for ring in range(first, last + 1):
+            if ring == 0:
+                yield ring, [(cx, cy)]
+                continue
+            xs = range(max(cx - ring, low_x), min(cx + ring, high_x) + 1)
+            ys = range(max(cy - ring + 1, low_y), min(cy + ring - 1, high_y) + 1)
+            cells = [(x, y) for y in (cy - ring, cy + ring) if low_y <= y <= high_y for x in xs]
+            cells += [(x, y) for x in (cx - ring, cx + ring) if low_x <= x <= high_x for y in ys]
+            yield ring, cells
+
+    def nearest_many(self, points: np.ndarray, kind: str = None):
+        """
+        snap many points in one call. the ring search runs for all the points at once, ring by ring,
+        every cell offset of a ring is looked up and measured for all the points still searching with
+        numpy. the points outside of the map are few and use the ring search of nearest_in
+
+        :param points: (n, 2) array of lat, long
+        :param kind: building, intersection or None for any node
+        :return: list of the nearest nodes and array of their distances in meter
+        >>> index = SpatialIndex(["a", "b"], np.array([[40.1, -88.2], [40.11, -88.2]]), ["building"] * 2)
+        >>> points = [(40.1001, -88.2), (40.1002, -88.2), (45.0, -88.2)]
+        >>> nodes, distances = index.nearest_many(points)
+        >>> nodes, np.allclose(distances, [index.nearest(lat, long)[1] for lat, long in points])
+        (['a', 'a', 'b'], True)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        best = np.full(len(points), -1, dtype=np.int64)
+        best_distance = np.full(len(points), math.inf)
+        lat, long = np.radians(points[:, 0]), np.radians(points[:, 1])
+        for grid_kind in ([kind] if kind is not None else list(self.grids)):
+            if not self.grids.get(grid_kind) or len(points) == 0:
+                continue
+            keys, starts, counts, members, node_lat, node_long = self.pack(grid_kind)
+            low_x, low_y, high_x, high_y = self.extent[grid_kind]
+            cell_size = self.cell_size_of(grid_kind)
+            cell_x, cell_y = self.cells(points[:, 0], points[:, 1], grid_kind)
+            outside = (cell_x < low_x) | (cell_x > high_x) | (cell_y < low_y) | (cell_y > high_y)
+            for row in np.flatnonzero(outside).tolist():
+                node, distance = self.nearest_in(points[row, 0], points[row, 1], grid_kind)
+                if distance < best_distance[row]:
+                    best[row], best_distance[row] = self.node_ids[node], distance
+            last = np.maximum.reduce([cell_x - low_x, high_x - cell_x, cell_y - low_y, high_y - cell_y])
+            # best of this kind only, the stop test must not use a closer node of another kind
+            kind_best = np.full(len(points), -1, dtype=np.int64)
+            kind_distance = np.full(len(points), math.inf)
+            active = np.flatnonzero(~outside)
+            ring = 0
+            while len(active) > 0:
+                for dx, dy in self.ring_offsets(ring):
+                    x, y = cell_x[active] + dx, cell_y[active] + dy
+                    valid = (x >= low_x) & (x <= high_x) & (y >= low_y) & (y <= high_y)
+                    key = (x - low_x) * (high_y - low_y + 1) + (y - low_y)
+                    position = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+                    found = valid & (keys[position] == key)
+                    rows, start, count = active[found], starts[position[found]], counts[position[found]]
+                    for k in range(int(count.max()) if len(count) else 0):
+                        has = count > k
+                        row, slot = rows[has], start[has] + k
+                        h = np.sin((node_lat[slot] - lat[row]) / 2) ** 2 + np.cos(lat[row]) * \
+                            np.cos(node_lat[slot]) * np.sin((node_long[slot] - long[row]) / 2) ** 2
+                        distance = 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(h)))
+                        closer = distance < kind_distance[row]
+                        kind_best[row[closer]] = members[slot[closer]]
+                        kind_distance[row[closer]] = distance[closer]
+                done = (kind_best[active] >= 0) & (kind_distance[active] * 0.99 <= ring * cell_size)
+                active = active[~(done | (last[active] <= ring))]
+                ring += 1
+            closer = kind_distance < best_distance
+            best[closer], best_distance[closer] = kind_best[closer], kind_distance[closer]
+        return [self.nodes[i] if i >= 0 else None for i in best.tolist()], best_distance
+
+    def pack(self, kind: str):
+        """
+        the cells of the grid of the kind as arrays, kept until the index changes
+
+        :return: sorted cell keys, start and count of the members of every cell in members,
+            members and their latitude and longitude in radians
+        """
+        if kind not in self.packed:
+            low_x, low_y, high_x, high_y = self.extent[kind]
+            cells = sorted(((x - low_x) * (high_y - low_y + 1) + (y - low_y), members)
+                           for (x, y), members in self.grids[kind].items() if members)
+            counts = np.array([len(cell_members) for _, cell_members in cells], dtype=np.int64)
+            members = np.array([i for _, cell_members in cells for i in cell_members], dtype=np.int64)
+            self.packed[kind] = (np.array([key for key, _ in cells], dtype=np.int64),
+                                 np.cumsum(counts) - counts, counts, members,
+                                 np.radians([self.lat[i] for i in members.tolist()]),
+                                 np.radians([self.long[i] for i in members.tolist()]))
+        return self.packed[kind]
+
+    @staticmethod
+    def ring_offsets(ring: int):
+        """
+        :return: the cell offsets at chebyshev distance ring
+        """
+        if ring == 0:
+            return [(0, 0)]
+        offsets = [(dx, dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+        offsets += [(dx, dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+        return offsets
@@ -0,0 +1,182 @@
+"""
+
+TurnTable.py turn classes between the CSR edges of a RoutingEngine and the edge based (line graph)
+search which adds the turn costs to the walking distance
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+import math
+
+import numpy as np
+
+from RoutingEngine import no_path, HEURISTIC_SCALE
+
+# turn classes stored in the table, BANNED turns are never taken
+STRAIGHT, RIGHT, LEFT, U_TURN, BANNED = range(5)
+TURN_NAMES = ("straight", "right", "left", "u_turn", "banned")
+# a heading change up to STRAIGHT_ANGLE degrees goes straight on, from U_TURN_ANGLE degrees it turns back
+STRAIGHT_ANGLE = 30.0
+U_TURN_ANGLE = 150.0
+# extra cost in meter of every turn class, a delivery cart avoids crossing the traffic and turning back
+TURN_COSTS = {"straight": 0.0, "right": 5.0, "left": 30.0, "u_turn": 200.0}
+
+
+class TurnTable:
+    """
+    one int8 turn class per pair of consecutive edges: the turns after edge k (u -> v) are the out edges
+    of v, their classes start at turn_offsets[k] in the same order as the out edges. the class comes from
+    the bearing difference, going back to u is always a u-turn, and the restrictions are banned.
+    the table only depends on the topology and the bearings, the engine weights are read at query time
+    so the road closures apply without building it again
+    """
+
+    def __init__(self, engine, bearings: np.ndarray, costs: dict = None, restrictions: list = (),
+                 no_left_turn: list = ()):
+        """
+        :param engine: RoutingEngine
+        :param bearings: bearing in degrees of every CSR edge
+        :param costs: extra cost of the straight, right, left and u_turn classes, TURN_COSTS by default
+        :param restrictions: banned (from node, via node, to node) turns
+        :param no_left_turn: nodes where every left turn is banned
+        """
+        self.engine = engine
+        offsets = engine.arrays["offsets"]
+        targets = engine.arrays["targets"]
+        bearings = np.asarray(bearings, dtype=np.float64)
+        degrees = np.diff(offsets)
+        sources = np.repeat(np.arange(len(engine.nodes), dtype=np.int64), degrees)
+        turn_counts = degrees[targets]
+        self.turn_offsets = np.zeros(len(targets) + 1, dtype=np.int64)
+        np.cumsum(turn_counts, out=self.turn_offsets[1:])
+        into = np.repeat(np.arange(len(targets), dtype=np.int64), turn_counts)
+        out = offsets[targets[into]] + np.arange(len(into), dtype=np.int64) - self.turn_offsets[into]
+        # heading change in (-180, 180], clockwise (a right turn) is positive
+        angle = (bearings[out] - bearings[into] + 540.0) % 360.0 - 180.0
+        classes = np.where(angle > 0, RIGHT, LEFT)
+        classes[np.abs(angle) <= STRAIGHT_ANGLE] = STRAIGHT
+        classes[(np.abs(angle) >= U_TURN_ANGLE) | (targets[out] == sources[into])] = U_TURN
+        if len(no_left_turn) > 0:
+            via = np.array([engine.node_index[node] for node in no_left_turn], dtype=np.int64)
+            classes[(classes == LEFT) & np.isin(targets[into], via)] = BANNED
+        self.turn_class = classes.astype(np.int8)
+        for node_from, via, node_to in restrictions:
+            self.turn_class[self.turn_position(node_from, via, node_to)] = BANNED
+        costs = dict(TURN_COSTS, **(costs or {}))
+        self.costs = [costs[name] for name in TURN_NAMES[:BANNED]] + [math.inf]
+        # memoryviews return python numbers like the engine arrays
+        self.classes = memoryview(self.turn_class)
+        self.starts = memoryview(self.turn_offsets)
+        # edges settled by the last query, counted by search_counts
+        self.last_settled = None
+
+    def nbytes(self):
+        """
+        :return: bytes used by the table arrays
+        """
+        return self.turn_class.nbytes + self.turn_offsets.nbytes
+
+    def search_counts(self):
+        """
+        :return: edges settled and turns scanned by the last query
+        """
+        if self.last_settled is None:
+            return 0, 0
+        settled = np.fromiter(self.last_settled, dtype=np.int64, count=len(self.last_settled))
+        return len(settled), int(np.diff(self.turn_offsets)[settled].sum())
+
+    def edge_slot(self, u: int, v: int):
+        """
+        :return: CSR position of the edge from node index u to v
+        """
+        engine = self.engine
+        for k in range(engine.offsets[u], engine.offsets[u + 1]):
+            if engine.targets[k] == v:
+                return k
+        raise KeyError((engine.nodes[u], engine.nodes[v]))
+
+    def turn_position(self, node_from: str, via: str, node_to: str):
+        """
+        :return: position in turn_class of the turn node_from -> via -> node_to
+        """
+        index = self.engine.node_index
+        k = self.edge_slot(index[node_from], index[via])
+        return self.turn_offsets[k] + self.edge_slot(index[via], index[node_to]) - self.engine.offsets[index[via]]
+
+    def turn(self, node_from: str, via: str, node_to: str):
+        """
+        :return: name of the turn class, straight, right, left, u_turn or banned
+        """
+        return TURN_NAMES[self.turn_class[self.turn_position(node_from, via, node_to)]]
+
+    def count_turns(self, path: list):
+        """
+        :param path: node list
+        :return: number of turns of every class along the path
+        """
+        counts = dict.fromkeys(TURN_NAMES, 0)
+        for node_from, via, node_to in zip(path, path[1:], path[2:]):
+            counts[self.turn(node_from, via, node_to)] += 1
+        return counts
+
+    def query(self, where_from: str, where_to: str):
+        """
+        A* over the edges, an edge is settled with the distance and the turn costs of the best
+        way to drive it so a route can come back to a node through another edge (three right turns
+        instead of a left turn). the turn costs are not negative so the great-circle heuristic of
+        RoutingEngine.astar stays admissible
+
+        :param where_from: source node
+        :param where_to: target node
+        :return: node list of the route with the lowest distance plus turn costs
+        """
+        engine = self.engine
+        offsets, targets, weights = engine.offsets, engine.targets, engine.weights
+        classes, starts, costs = self.classes, self.starts, self.costs
+        source = engine.node_index[where_from]
+        target = engine.node_index[where_to]
+        if source == target:
+            return [where_from]
+        dist = {}
+        seen = {}
+        pred = {}
+        # heuristic of the nodes, every edge into a node shares it
+        estimate = {}
+        c = count()
+        fringe = []
+        self.last_settled = dist
+        for k in range(offsets[source], offsets[source + 1]):
+            if weights[k] != math.inf and (k not in seen or weights[k] < seen[k]):
+                u = targets[k]
+                if u not in estimate:
+                    estimate[u] = HEURISTIC_SCALE * engine.great_circle(u, target)
+                seen[k] = weights[k]
+                pred[k] = -1
+                heappush(fringe, (weights[k] + estimate[u], next(c), k, weights[k]))
+        while fringe:
+            _, _, k, d = heappop(fringe)
+            if k in dist:
+                continue
+            dist[k] = d
+            v = targets[k]
+            if v == target:
+                path = []
+                while k != -1:
+                    path.append(targets[k])
+                    k = pred[k]
+                path.append(source)
+                return [engine.nodes[i] for i in reversed(path)]
+            start = starts[k] - offsets[v]
+            for j in range(offsets[v], offsets[v + 1]):
+                turn_cost = costs[classes[start + j]]
+                if turn_cost == math.inf or weights[j] == math.inf or j in dist:
+                    continue
+                dj = d + turn_cost + weights[j]
+                if j not in seen or dj < seen[j]:
+                    u = targets[j]
+                    if u not in estimate:
+                        estimate[u] = HEURISTIC_SCALE * engine.great_circle(u, target)
+                    seen[j] = dj
+                    pred[j] = k
+                    heappush(fringe, (dj + estimate[u], next(c), j, dj))
+        raise no_path(where_from, where_to)
@@ -0,0 +1,1207 @@
+"""
+
+benchmark.py benchmarks for ShortestPath on synthetic street grids
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+from ShortestPath import ShortestPath
+from RoutingEngine import EARTH_RADIUS
+from RoutingService import RoutingService
+
+# roughly 100 m between two grid intersections around the campus latitude
+LAT_STEP = 0.0009
+LONG_STEP = 0.0012
+BASE_LAT = 40.110
+BASE_LONG = -88.233
+
+# named dataset sizes in intersections, from the campus to a metro area
+CITY_SIZES = {"campus": 1000, "town": 10000, "city": 100000, "metro": 1000000}
+
+# road rules of the generated cities: every ONE_WAY_EVERY row street is one direction
+# and INACTIVE_FRACTION of the road segments are closed
+ONE_WAY_EVERY = 10
+INACTIVE_FRACTION = 0.001
+
+# measures of the suite where a lower value is better, the others are better higher
+LOWER_IS_BETTER = ("load_seconds", "peak_rss_mb", "freeze_seconds", "query_p50_ms", "query_p90_ms", "query_p99_ms")
+HIGHER_IS_BETTER = ("rows_per_second", "render_routes_per_second", "render_steps_per_second")
+# smallest absolute slowdown flagged as a regression, the run to run noise of the short measures
+# is larger than the relative threshold
+NOISE_FLOORS = {"load_seconds": 0.05, "freeze_seconds": 0.05, "peak_rss_mb": 5.0, "query_p50_ms": 0.5,
+                "query_p90_ms": 0.5, "query_p99_ms": 1.0}
+
+# heavy dependencies which importing the module must not load, they are imported when used
+LAZY_IMPORTS = {"numpy": (), "CompiledRouter": ("pandas", "networkx", "matplotlib", "pygeodesy"),
+                "ShortestPath": ("pandas", "matplotlib", "pygeodesy"),
+                "RoutingService": ("pandas", "matplotlib", "pygeodesy")}
+HEAVY_MODULES = ("numpy", "pandas", "networkx", "matplotlib", "pygeodesy")
+
+
+def intersection_name(row: int, col: int):
+    """
+    node name of the grid intersection, node_a + "-" + node_b like the edges csv
+
+    :param row: row street number
+    :param col: column street number
+    :return: intersection node name
+    """
+    return "Row {} Street-Col {} Avenue".format(row, col)
+
+
+def generate_grid(size: int, directory: str, building_every: int = 10, one_way_every: int = 0,
+                  inactive_fraction: float = 0.0, seed: int = 0):
+    """
+    generate the buildings, streets, edges, one direction and inactive road csv files for a square
+    street grid with about size intersections, a building is placed on every building_every
+    road segment of the row streets. the same arguments always give the same files
+
+    :param size: number of intersections
+    :param directory: directory to write the csv files to
+    :param building_every: one building per this many road segments
+    :param one_way_every: every one_way_every row street is one direction, eastbound and westbound in turn,
+        0 for no one direction street
+    :param inactive_fraction: fraction of the column street segments which are closed
+    :param seed: seed of the closed segments choice
+    :return: buildings, streets and edges file names, the road rule files are written next to them
+    """
+    side = int(math.ceil(math.sqrt(size)))
+    streets = ["Row {} Street".format(i) for i in range(side)] + ["Col {} Avenue".format(j) for j in range(side)]
+
+    edges = []
+    buildings = []
+    for i in range(side):
+        lat = BASE_LAT - i * LAT_STEP
+        for j in range(side):
+            long = BASE_LONG + j * LONG_STEP
+            edges.append(("Row {} Street".format(i), "Col {} Avenue".format(j), intersection_name(i, j),
+                          "{:.6f},{:.6f}".format(lat, long),
+                          intersection_name(i - 1, j) if i > 0 else "",
+                          intersection_name(i + 1, j) if i + 1 < side else "",
+                          intersection_name(i, j + 1) if j + 1 < side else "",
+                          intersection_name(i, j - 1) if j > 0 else ""))
+            if j + 1 < side and (i * side + j) % building_every == 0:
+                name = "Building {}-{}".format(i, j)
+                buildings.append((name, "{:.6f},{:.6f}".format(lat + LAT_STEP / 4, long + LONG_STEP / 2),
+                                  100000 + len(buildings)))
+                edges.append((name, "Row {} Street".format(i), name + "-Row {} Street".format(i),
+                              "{:.6f},{:.6f}".format(lat, long + LONG_STEP / 2), "", "",
+                              intersection_name(i, j + 1), intersection_name(i, j)))
+
+    one_direction = []
+    if one_way_every > 0:
+        for number, i in enumerate(range(one_way_every // 2, side, one_way_every)):
+            for j in range(side - 1):
+                pair = (intersection_name(i, j), intersection_name(i, j + 1))
+                one_direction.append(pair if number % 2 == 0 else pair[::-1])
+    # the closed segments are on the column streets so they do not meet the one direction rules
+    rng = random.Random(seed)
+    segments = side * (side - 1)
+    inactive = [(intersection_name(k % (side - 1), k // (side - 1)), intersection_name(k % (side - 1) + 1,
+                                                                                       k // (side - 1)))
+                for k in sorted(rng.sample(range(segments), int(math.ceil(segments * inactive_fraction))))] if side > 1 else []
+
+    files = (os.path.join(directory, "buildings.csv"), os.path.join(directory, "streets.csv"),
+             os.path.join(directory, "edges.csv"))
+    pd.DataFrame(buildings, columns=["name", "coordinate", "mail_code"]).to_csv(files[0], index=False)
+    pd.DataFrame(streets, columns=["name"]).to_csv(files[1], index=False)
+    pd.DataFrame(edges, columns=["node_a", "node_b", "node_name", "intersection", "N", "S", "E", "W"]) \
+        .to_csv(files[2], index=False)
+    pd.DataFrame(one_direction, columns=["node_a", "node_b"]).to_csv(os.path.join(directory, "one_direction.csv"),
+                                                                     index=False)
+    pd.DataFrame(inactive, columns=["node_a", "node_b"]).to_csv(os.path.join(directory, "inactive_road.csv"),
+                                                                index=False)
+    return files
+
+
+def city_size(size: str):
+    """
+    :param size: name of CITY_SIZES or number of intersections
+    :return: number of intersections
+    """
+    return CITY_SIZES[size] if size in CITY_SIZES else int(size)
+
+
+def time_construction(files: tuple, directory: str, **kwargs):
+    """
+    build a ShortestPath from the generated files and measure the elapsed time
+
+    :param files: buildings, streets and edges file names
+    :param directory: directory of the generated dataset with its one direction and inactive road files
+    :return: elapsed seconds and the ShortestPath object
+    """
+    start = time.perf_counter()
+    graph = ShortestPath(buildings_file=files[0], streets_file=files[1], edges_file=files[2],
+                         one_direction_file=os.path.join(directory, "one_direction.csv"),
+                         inactive_road_file=os.path.join(directory, "inactive_road.csv"), **kwargs)
+    return time.perf_counter() - start, graph
+
+
+def percentiles(latencies: list):
+    """
+    :param latencies: query latencies in seconds
+    :return: p50 and p99 in milliseconds
+    """
+    return np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+def traced_memory(build):
+    """
+    measure the memory allocated by build
+
+    :param build: function to call
+    :return: allocated bytes and the result of build
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def benchmark_load(args):
+    """
+    compare the row by row and the bulk graph loader
+    """
+    print("{:>10} {:>10} {:>10} {:>12} {:>12} {:>12}".format("size", "nodes", "edges", "row by row", "bulk",
+                                                             "bulk exact"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            legacy = "skipped"
+            if size <= args.legacy_max:
+                legacy = "{:.2f} s".format(time_construction(files, directory)[0])
+            bulk, graph = time_construction(files, directory, bulk=True)
+            exact, _ = time_construction(files, directory, bulk=True, exact=True)
+            print("{:>10} {:>10} {:>10} {:>12} {:>12} {:>12}".format(
+                size, graph.path_graph.number_of_nodes(), graph.path_graph.number_of_edges(), legacy,
+                "{:.2f} s".format(bulk), "{:.2f} s".format(exact)))
+
+
+def benchmark_query(args):
+    """
+    compare the query latency and memory of the networkx backend and the CSR routing engine
+    """
+    print("{:>10} {:>10} {:>14} {:>14} {:>14} {:>14}".format("size", "backend", "p50 ms", "p99 ms",
+                                                             "graph MB", "speedup p50"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        pairs = [tuple(rng.sample(buildings, 2)) for _ in range(args.queries)]
+
+        nx_memory, _ = traced_memory(graph.path_graph.copy)
+        engine_memory, _ = traced_memory(graph.freeze_graph)
+        results = []
+        for backend, algorithm in (("networkx", None), ("dijkstra", "dijkstra"), ("astar", "astar")):
+            if algorithm is None:
+                graph.engine = None
+            else:
+                graph.freeze_graph(algorithm)
+            latencies = []
+            for where_from, where_to in pairs:
+                start = time.perf_counter()
+                graph.find_path(where_from, where_to)
+                latencies.append(time.perf_counter() - start)
+            results.append((backend, percentiles(latencies)))
+        for backend, (p50, p99) in results:
+            memory = nx_memory if backend == "networkx" else engine_memory
+            print("{:>10} {:>10} {:>14.3f} {:>14.3f} {:>14.1f} {:>14.1f}".format(
+                size, backend, p50, p99, memory / 2 ** 20, results[0][1][0] / p50))
+
+
+def path_cost(graph: ShortestPath, path: list):
+    """
+    :return: total weight of the node list in the path_graph
+    """
+    return sum(graph.path_graph.edge[a][b]["weight"] for a, b in zip(path, path[1:]))
+
+
+def benchmark_ch(args):
+    """
+    check the contraction hierarchy answers against plain dijkstra on random building pairs
+    and compare the query throughput
+    """
+    print("{:>10} {:>12} {:>12} {:>12} {:>14} {:>14}".format("size", "preprocess", "shortcuts", "mismatches",
+                                                             "dijkstra q/s", "ch q/s"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        pairs = [tuple(rng.sample(buildings, 2)) for _ in range(args.queries)]
+
+        graph.freeze_graph()
+        start = time.perf_counter()
+        hierarchy = graph.engine.contract()
+        preprocess = time.perf_counter() - start
+
+        throughput = {}
+        answers = {}
+        for algorithm in ("dijkstra", "ch"):
+            start = time.perf_counter()
+            answers[algorithm] = [graph.engine.shortest_path(a, b, algorithm) for a, b in pairs]
+            throughput[algorithm] = len(pairs) / (time.perf_counter() - start)
+        mismatches = sum(abs(path_cost(graph, ch) - path_cost(graph, plain)) > 1e-6
+                         for ch, plain in zip(answers["ch"], answers["dijkstra"]))
+        print("{:>10} {:>12} {:>12} {:>12} {:>14.1f} {:>14.1f}".format(
+            size, "{:.2f} s".format(preprocess), hierarchy.shortcut_count, mismatches, throughput["dijkstra"],
+            throughput["ch"]))
+
+
+def benchmark_update(args):
+    """
+    close and reopen random roads on a frozen graph, measure the update latency
+    and the latency of the first query after every update
+    """
+    print("{:>10} {:>10} {:>14} {:>14} {:>14} {:>14}".format("size", "update", "p50 ms", "p99 ms",
+                                                             "query p50 ms", "query p99 ms"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        graph.freeze_graph()
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        roads = [(a, b) for a, b in graph.path_graph.edges()
+                 if graph.path_graph.node[a]["type"] == graph.path_graph.node[b]["type"] == "intersection"]
+        updates = {"close": graph.close_road, "reopen": graph.reopen_road,
+                   "one way": graph.set_one_way, "two way": graph.clear_one_way}
+        latencies = {name: ([], []) for name in updates}
+        for road in rng.sample(roads, min(args.updates, len(roads))):
+            for name in ("close", "reopen", "one way", "two way"):
+                where_from, where_to = rng.sample(buildings, 2)
+                start = time.perf_counter()
+                updates[name](*road)
+                middle = time.perf_counter()
+                try:
+                    graph.find_path(where_from, where_to)
+                except nx.NetworkXNoPath:
+                    pass
+                latencies[name][0].append(middle - start)
+                latencies[name][1].append(time.perf_counter() - middle)
+        for name, (update, query) in latencies.items():
+            print("{:>10} {:>10} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.3f}".format(
+                size, name, *(percentiles(update) + percentiles(query))))
+
+
+def benchmark_k_shortest(args):
+    """
+    latency of the first path and of the k paths of k_shortest_paths on growing grids,
+    the trips have about the same length on every grid so only the graph size changes
+    """
+    print("{:>10} {:>10} {:>14} {:>14} {:>14} {:>14}".format("size", "k", "first p50 ms", "first p99 ms",
+                                                             "all p50 ms", "all p99 ms"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        if not args.networkx:
+            graph.freeze_graph()
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        coordinates = graph.parse_coordinates(graph.buildings["coordinate"])
+        first, complete = [], []
+        for _ in range(args.queries):
+            origin = rng.randrange(len(buildings))
+            distance, _ = graph.haversine_inverse(np.repeat(coordinates[origin:origin + 1], len(buildings), axis=0),
+                                                  coordinates)
+            nearby = np.flatnonzero((distance > args.trip_length / 2) & (distance <= args.trip_length))
+            if len(nearby) == 0:
+                continue
+            where_from, where_to = buildings[origin], buildings[rng.choice(nearby.tolist())]
+            start = time.perf_counter()
+            paths = graph.k_shortest_paths(where_from, where_to, args.k, args.max_detour_ratio)
+            next(paths)
+            first.append(time.perf_counter() - start)
+            for _ in paths:
+                pass
+            complete.append(time.perf_counter() - start)
+        print("{:>10} {:>10} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.3f}".format(
+            size, args.k, *(percentiles(first) + percentiles(complete))))
+
+
+async def service_client(port: int, requests: list, deadline_ms: float, results: list):
+    """
+    closed loop client, send one request and wait for its response before sending the next one
+
+    :param port: localhost port of the routing service
+    :param requests: (where_from, where_to) building names
+    :param deadline_ms: deadline of every request
+    :param results: (status, latency) of every response are appended
+    :return: None
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for i, (where_from, where_to) in enumerate(requests):
+        start = time.perf_counter()
+        writer.write(json.dumps({"id": i, "from": where_from, "to": where_to, "deadline_ms": deadline_ms})
+                     .encode("utf-8") + b"\n")
+        response = json.loads((await reader.readline()).decode("utf-8"))
+        results.append((response["status"], time.perf_counter() - start))
+    writer.close()
+
+
+def benchmark_service(args):
+    """
+    run the routing service and a closed loop load generator on localhost,
+    report the latency, the throughput and the response status counts per number of clients
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        files = generate_grid(args.size, directory)
+        _, graph = time_construction(files, directory, bulk=True)
+    graph.freeze_graph()
+    service = RoutingService(graph, args.workers, args.batch_size, args.batch_window_ms / 1000, args.max_pending)
+    rng = random.Random(args.seed)
+    buildings = graph.buildings["name"].tolist()
+    # a few popular origins, like the buildings people ask most for
+    origins = rng.sample(buildings, min(len(buildings), args.origins))
+
+    async def run(clients: int):
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        results = []
+        start = time.perf_counter()
+        await asyncio.gather(*[service_client(port, [(rng.choice(origins), rng.choice(buildings))
+                                                     for _ in range(args.requests)], args.deadline_ms, results)
+                               for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+        server.close()
+        await server.wait_closed()
+        service.batcher_task.cancel()
+        return results, elapsed
+
+    print("{:>8} {:>10} {:>12} {:>12} {:>12} {:>10} {:>10}".format("clients", "req/s", "p50 ms", "p99 ms",
+                                                                   "ok", "timeout", "busy"))
+    for clients in [int(x) for x in args.clients.split(",")]:
+        results, elapsed = asyncio.run(run(clients))
+        p50, p99 = percentiles([latency for _, latency in results])
+        statuses = [status for status, _ in results]
+        print("{:>8} {:>10.1f} {:>12.3f} {:>12.3f} {:>12} {:>10} {:>10}".format(
+            clients, len(results) / elapsed, p50, p99, statuses.count("ok"), statuses.count("timeout"),
+            statuses.count("busy")))
+    service.executor.shutdown()
+
+
+def benchmark_render(args):
+    """
+    compare the rendering throughput of the list of dictionaries and of the RouteStep stream
+    """
+    print("{:>10} {:>14} {:>14} {:>14}".format("size", "dicts route/s", "stream route/s", "speedup"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        graph.freeze_graph()
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        paths = []
+        while len(paths) < args.routes:
+            try:
+                paths.append(graph.find_path(*rng.sample(buildings, 2)))
+            except nx.NetworkXNoPath:
+                pass
+        start = time.perf_counter()
+        for path in paths:
+            graph.render_path([path])
+        dicts = len(paths) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for path in paths:
+            for _ in graph.iter_route_steps(path):
+                pass
+        stream = len(paths) / (time.perf_counter() - start)
+        print("{:>10} {:>14.1f} {:>14.1f} {:>14.1f}".format(size, dicts, stream, stream / dicts))
+
+
+def benchmark_snap(args):
+    """
+    compare snapping random GPS points with the grid index and with a scan of all the nodes
+    """
+    print("{:>10} {:>10} {:>12} {:>14} {:>14} {:>10}".format("size", "nodes", "index build", "grid point/s",
+                                                            "scan point/s", "mismatch"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        start = time.perf_counter()
+        index = graph.spatial()
+        build = time.perf_counter() - start
+        rng = np.random.RandomState(args.seed)
+        low, high = graph.coordinates.min(axis=0), graph.coordinates.max(axis=0)
+        points = rng.uniform(low, high, size=(args.points, 2))
+        start = time.perf_counter()
+        nodes, distances = graph.snap_points(points, args.kind)
+        grid = len(points) / (time.perf_counter() - start)
+        candidates = np.array([i for i, kind in enumerate(index.kinds) if kind == args.kind])
+        lat, long = np.radians(np.array(index.lat)[candidates]), np.radians(np.array(index.long)[candidates])
+        scan_points = points[:args.scan_points]
+        start = time.perf_counter()
+        mismatch = 0
+        for (point_lat, point_long), distance in zip(np.radians(scan_points).tolist(), distances.tolist()):
+            h = np.sin((lat - point_lat) / 2) ** 2 + \
+                np.cos(point_lat) * np.cos(lat) * np.sin((long - point_long) / 2) ** 2
+            best = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(h)).min()
+            mismatch += abs(best - distance) > 1e-6
+        scan = len(scan_points) / (time.perf_counter() - start)
+        print("{:>10} {:>10} {:>12} {:>14.1f} {:>14.1f} {:>10}".format(
+            size, len(index.nodes), "{:.2f} s".format(build), grid, scan, mismatch))
+
+
+def benchmark_tree(args):
+    """
+    route every building to a few destinations with one many to one tree per destination
+    and with one search per building
+    """
+    print("{:>10} {:>10} {:>14} {:>14} {:>14}".format("size", "buildings", "per pair s", "tree s", "cached tree s"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        graph.freeze_graph()
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        destinations = rng.sample(buildings, args.destinations)
+        sources = rng.sample(buildings, min(args.sources, len(buildings)))
+        start = time.perf_counter()
+        for destination in destinations:
+            for source in sources:
+                try:
+                    graph.find_path(source, destination)
+                except nx.NetworkXNoPath:
+                    pass
+        pairs = time.perf_counter() - start
+        graph.enable_tree_cache()
+        timings = []
+        for _ in range(2):
+            start = time.perf_counter()
+            for destination in destinations:
+                tree = graph.many_to_one(destination)
+                for source in sources:
+                    tree.path(source)
+            timings.append(time.perf_counter() - start)
+        print("{:>10} {:>10} {:>14.3f} {:>14.3f} {:>14.3f}".format(size, len(sources), pairs, *timings))
+
+
+def load_in_process(job: tuple):
+    """
+    build a graph in a fresh process so its peak rss only counts this loader
+
+    :param job: directory of the csv files, loader (bulk or stream) and chunk size
+    :return: seconds, rows and peak rss in MB before and after the loading
+    """
+    directory, loader, chunk_size = job
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    graph = ShortestPath(buildings_file=os.path.join(directory, "buildings.csv"),
+                         streets_file=os.path.join(directory, "streets.csv"),
+                         edges_file=os.path.join(directory, "edges.csv"),
+                         one_direction_file=os.path.join(directory, "one_direction.csv"),
+                         inactive_road_file=os.path.join(directory, "inactive_road.csv"),
+                         bulk=loader == "bulk", stream=loader == "stream", chunk_size=chunk_size)
+    seconds = time.perf_counter() - start
+    rows = graph.buildings.shape[0] + graph.edges.shape[0]
+    return seconds, rows, baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_stream(args):
+    """
+    compare the peak rss and the rows per second of the bulk and the streaming loader,
+    every load runs in its own spawned process
+    """
+    print("{:>10} {:>8} {:>10} {:>12} {:>10} {:>14} {:>14}".format("size", "loader", "rows", "rows/s", "csv MB",
+                                                                  "baseline MB", "peak rss MB"))
+    context = multiprocessing.get_context("spawn")
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            csv_size = sum(os.path.getsize(file) for file in files) / 1024 / 1024
+            for loader in ("bulk", "stream"):
+                with context.Pool(1) as pool:
+                    seconds, rows, baseline, peak = pool.apply(load_in_process, ((directory, loader, args.chunk_size),))
+                print("{:>10} {:>8} {:>10} {:>12.0f} {:>10.1f} {:>14.1f} {:>14.1f}".format(
+                    size, loader, rows, rows / seconds, csv_size, baseline, peak))
+
+
+def benchmark_partition(args):
+    """
+    check the partitioned graph answers against the whole graph on random building pairs
+    and compare the throughput, the region searches run in the worker processes
+    """
+    print("{:>10} {:>8} {:>10} {:>10} {:>12} {:>12} {:>10}".format("size", "regions", "boundary", "tables s",
+                                                                  "whole q/s", "regions q/s", "mismatch"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        graph.freeze_graph()
+        engine = graph.engine
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        pairs = [tuple(rng.sample(buildings, 2)) for _ in range(args.queries)]
+        start = time.perf_counter()
+        partitioned = graph.partition(args.cells, args.processes)
+        tables = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = []
+        for where_from, where_to in pairs:
+            target = engine.node_index[where_to]
+            dist, _ = engine.search_tree(engine.node_index[where_from], {target})
+            expected.append(dist.get(target, math.inf))
+        whole = len(pairs) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        answers = partitioned.query_many(pairs)
+        regions = len(pairs) / (time.perf_counter() - start)
+        mismatch = 0
+        for distance, (answer, path) in zip(expected, answers):
+            # the closed roads weigh 9e9, the sums in another order only match relatively
+            if path is not None and not math.isclose(path_cost(graph, path), answer, rel_tol=1e-12, abs_tol=1e-6):
+                mismatch += 1
+            elif not (distance == answer or math.isclose(distance, answer, rel_tol=1e-12, abs_tol=1e-6)):
+                mismatch += 1
+        print("{:>10} {:>8} {:>10} {:>10.2f} {:>12.1f} {:>12.1f} {:>10}".format(
+            size, len(partitioned.partitions), sum(len(region.boundary) for region in partitioned.partitions),
+            tables, whole, regions, mismatch))
+
+
+def benchmark_metrics(args):
+    """
+    measure the shortest_path throughput without metrics and with the sampled and full
+    instrumentation, the modes are run in turns and the best round of each is kept
+    """
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory)
+            _, graph = time_construction(files, directory, bulk=True)
+        graph.freeze_graph()
+        print("construction phases of {} intersections (s): {}".format(
+            size, ", ".join("{} {:.2f}".format(phase, seconds) for phase, seconds in graph.phase_timings.items())))
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        pairs = [tuple(rng.sample(buildings, 2)) for _ in range(args.queries)]
+        modes = (("off", None), ("sampled", args.sample_rate), ("full", 1.0))
+        best = {mode: math.inf for mode, _ in modes}
+        for _ in range(args.rounds):
+            for mode, sample_rate in modes:
+                graph.metrics = None if sample_rate is None else graph.enable_metrics(sample_rate)
+                start = time.perf_counter()
+                for where_from, where_to in pairs:
+                    graph.shortest_path(where_from, where_to)
+                best[mode] = min(best[mode], time.perf_counter() - start)
+        # the throughput differences are within the run to run noise, the instrumentation is also timed alone:
+        # the counters of every query and the record of a sampled query after a search
+        path = graph.find_path(*pairs[0])
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            graph.metrics.increment("queries")
+            graph.metrics.sampled()
+        counters = (time.perf_counter() - start) / args.queries
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            graph.record_query(pairs[0][0], pairs[0][1], path, 0.0, 0.0)
+        record = (time.perf_counter() - start) / args.queries
+        query = best["off"] / len(pairs)
+        print("{:>10} {:>10} {:>12} {:>12} {:>12} {:>14}".format("size", "metrics", "sample rate", "q/s", "overhead %",
+                                                                 "timed cost %"))
+        for mode, sample_rate in modes:
+            cost = 0.0 if sample_rate is None else (counters + sample_rate * record) / query * 100
+            print("{:>10} {:>10} {:>12} {:>12.1f} {:>12.2f} {:>14.4f}".format(
+                size, mode, "-" if sample_rate is None else sample_rate, len(pairs) / best[mode],
+                (best[mode] / best["off"] - 1) * 100, cost))
+        graph.metrics.counters["queries"] -= args.queries
+        print(graph.metrics.prometheus(), end="")
+
+
+def generate_city(args):
+    """
+    write a generated city dataset to a directory, to run the other tools on it
+    """
+    os.makedirs(args.directory, exist_ok=True)
+    files = generate_grid(city_size(args.size), args.directory, one_way_every=args.one_way_every,
+                          inactive_fraction=args.inactive_fraction, seed=args.seed)
+    for file_name in files + (os.path.join(args.directory, "one_direction.csv"),
+                              os.path.join(args.directory, "inactive_road.csv")):
+        print("{} {:.1f} MB".format(file_name, os.path.getsize(file_name) / 2 ** 20))
+
+
+def git_commit():
+    """
+    :return: short hash of the checked out commit, None outside of a git work tree
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def suite_in_process(job: tuple):
+    """
+    measure one generated city in a fresh process, so the peak rss only counts its graph
+
+    :param job: directory of the dataset, number of queries and seed
+    :return: dictionary of the measures
+    """
+    directory, queries, seed = job
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    graph = ShortestPath(buildings_file=os.path.join(directory, "buildings.csv"),
+                         streets_file=os.path.join(directory, "streets.csv"),
+                         edges_file=os.path.join(directory, "edges.csv"),
+                         one_direction_file=os.path.join(directory, "one_direction.csv"),
+                         inactive_road_file=os.path.join(directory, "inactive_road.csv"), bulk=True)
+    load = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    graph.freeze_graph()
+    freeze = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    buildings = graph.buildings["name"].tolist()
+    latencies, paths, no_path = [], [], 0
+    for _ in range(queries):
+        where_from, where_to = rng.sample(buildings, 2)
+        start = time.perf_counter()
+        try:
+            paths.append(graph.find_path(where_from, where_to))
+        except nx.NetworkXNoPath:
+            no_path += 1
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    steps = sum(len(graph.render_path([path])[0][0]) for path in paths)
+    render = time.perf_counter() - start
+
+    rows = graph.buildings.shape[0] + graph.edges.shape[0]
+    p50, p90, p99 = (float(x) * 1000 for x in np.percentile(latencies, [50, 90, 99]))
+    return {"nodes": graph.path_graph.number_of_nodes(), "edges": graph.path_graph.number_of_edges(),
+            "rows": rows, "load_seconds": load, "rows_per_second": rows / load, "peak_rss_mb": peak,
+            "graph_rss_mb": peak - baseline, "freeze_seconds": freeze, "query_p50_ms": p50, "query_p90_ms": p90,
+            "query_p99_ms": p99, "query_max_ms": max(latencies) * 1000, "no_path": no_path,
+            "render_routes_per_second": len(paths) / render if render > 0 else 0.0,
+            "render_steps_per_second": steps / render if render > 0 else 0.0}
+
+
+def read_history(file_name: str):
+    """
+    :return: list of the records of the history file, empty when there is no file
+    """
+    if not os.path.exists(file_name):
+        return []
+    with open(file_name) as history:
+        return [json.loads(line) for line in history if line.strip()]
+
+
+def median_record(runs: list):
+    """
+    :param runs: measures of the repeated runs
+    :return: the measures of the first run with the median of every float measure
+    """
+    record = dict(runs[0])
+    for measure, value in runs[0].items():
+        if isinstance(value, float):
+            record[measure] = float(np.median([run[measure] for run in runs]))
+    return record
+
+
+def regressions(record: dict, previous: list, threshold: float):
+    """
+    compare the record with the median of the previous runs, a measure is flagged when it is worse
+    than the threshold and, for the short measures, worse by more than its NOISE_FLOORS value
+
+    :param previous: previous records of the same size, queries, seed and machine
+    :param threshold: allowed relative slowdown, 0.2 flags a measure 20% worse than the previous runs
+    :return: list of (measure, median of the previous runs, new value) which got worse than the threshold
+    """
+    baseline = median_record(previous)
+    flagged = []
+    for measure in LOWER_IS_BETTER:
+        if record[measure] > baseline[measure] * (1 + threshold) and \
+                record[measure] - baseline[measure] > NOISE_FLOORS.get(measure, 0.0):
+            flagged.append((measure, baseline[measure], record[measure]))
+    for measure in HIGHER_IS_BETTER:
+        if record[measure] * (1 + threshold) < baseline[measure]:
+            flagged.append((measure, baseline[measure], record[measure]))
+    return flagged
+
+
+def benchmark_suite(args):
+    """
+    generate the city datasets, measure their load time, memory, query latency distribution and
+    rendering throughput, append the results to the history file and flag the measures which got
+    worse than the previous runs of the same size, queries and seed on the same machine.
+    every size is measured repeats times in fresh processes and the history keeps the medians,
+    they are compared with the median of the last baseline_runs records
+    """
+    history = read_history(args.history)
+    commit = git_commit()
+    context = multiprocessing.get_context("spawn")
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        "size", "nodes", "load s", "rss MB", "p50 ms", "p90 ms", "p99 ms", "render r/s"))
+    flagged = []
+    for size in args.sizes.split(","):
+        intersections = city_size(size)
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            generate_grid(intersections, directory, one_way_every=ONE_WAY_EVERY, inactive_fraction=INACTIVE_FRACTION,
+                          seed=args.seed)
+            generate = time.perf_counter() - start
+            # a fresh process for every repeat, so the peak rss only counts its graph
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                runs = pool.map(suite_in_process, [(directory, args.queries, args.seed)] * args.repeats)
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit, "python": platform.python_version(),
+                  "machine": platform.node(), "size": size, "intersections": intersections, "queries": args.queries,
+                  "seed": args.seed, "generate_seconds": generate, "repeats": args.repeats}
+        record.update(median_record(runs))
+        print("{:>8} {:>10} {:>10.2f} {:>10.1f} {:>10.3f} {:>10.3f} {:>10.3f} {:>12.1f}".format(
+            size, record["nodes"], record["load_seconds"], record["peak_rss_mb"], record["query_p50_ms"],
+            record["query_p90_ms"], record["query_p99_ms"], record["render_routes_per_second"]))
+        same = [previous for previous in history
+                if all(previous.get(key) == record[key] for key in ("intersections", "queries", "seed", "machine"))]
+        if same:
+            baseline = same[-args.baseline_runs:]
+            for measure, before, after in regressions(record, baseline, args.threshold):
+                flagged.append((size, measure, before, after, len(baseline), baseline[-1]["commit"]))
+        history.append(record)
+        with open(args.history, "a") as history_file:
+            history_file.write(json.dumps(record, sort_keys=True) + "\n")
+    for size, measure, before, after, runs, previous_commit in flagged:
+        print("regression {} {}: {:.3f} -> {:.3f} (median of {} previous runs, last at {})".format(
+            size, measure, before, after, runs, previous_commit))
+    if flagged and args.fail_on_regression:
+        sys.exit(1)
+
+
+def import_in_process(module: str):
+    """
+    import the module in a fresh interpreter
+
+    :return: import seconds and the heavy modules it loaded
+    """
+    code = ("import sys, time; start = time.perf_counter(); import {}; seconds = time.perf_counter() - start; "
+            "print(seconds); print(','.join(m for m in {!r} if m in sys.modules))").format(module, HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    seconds, loaded = output.decode().splitlines()
+    return float(seconds), [m for m in loaded.split(",") if m]
+
+
+def benchmark_imports(args):
+    """
+    measure the import time of the entry points in fresh interpreters and check that the heavy
+    dependencies stay lazy, exit with status 1 when one is loaded at import or a time is over budget
+    """
+    print("{:>16} {:>10} {:>10}  {}".format("module", "best s", "median s", "heavy modules loaded"))
+    failures = []
+    for module, lazy in LAZY_IMPORTS.items():
+        runs = [import_in_process(module) for _ in range(args.rounds)]
+        seconds = [run[0] for run in runs]
+        loaded = runs[-1][1]
+        print("{:>16} {:>10.3f} {:>10.3f}  {}".format(module, min(seconds), float(np.median(seconds)),
+                                                      ", ".join(loaded) or "-"))
+        failures += ["{} imports {}".format(module, dependency) for dependency in lazy if dependency in loaded]
+        if module == "CompiledRouter" and args.max_seconds is not None and min(seconds) > args.max_seconds:
+            failures.append("{} imports in {:.3f} s, over the {:.3f} s budget".format(module, min(seconds),
+                                                                                   args.max_seconds))
+    for failure in failures:
+        print("regression: {}".format(failure))
+    if failures:
+        sys.exit(1)
+
+
+def benchmark_turns(args):
+    """
+    compare the node based dijkstra and the turn aware edge based search on random building pairs:
+    throughput, longer distance and the left turns and u-turns per route. the turn search without
+    turn costs is checked against dijkstra
+    """
+    print("{:>10} {:>10} {:>10} {:>10} {:>10} {:>12} {:>10} {:>10} {:>10}".format(
+        "size", "algorithm", "q/s", "table MB", "build s", "distance %", "left/r", "u-turn/r", "mismatch"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory, one_way_every=ONE_WAY_EVERY, inactive_fraction=INACTIVE_FRACTION,
+                                  seed=args.seed)
+            _, graph = time_construction(files, directory, bulk=True)
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        pairs = [tuple(rng.sample(buildings, 2)) for _ in range(args.queries)]
+        graph.set_turn_costs(restrictions=[])
+        results = {}
+        for algorithm in ("dijkstra", "turns"):
+            start = time.perf_counter()
+            graph.freeze_graph(algorithm)
+            build = time.perf_counter() - start
+            start = time.perf_counter()
+            paths = []
+            for where_from, where_to in pairs:
+                try:
+                    paths.append(graph.find_path(where_from, where_to))
+                except nx.NetworkXNoPath:
+                    paths.append(None)
+            results[algorithm] = (len(pairs) / (time.perf_counter() - start), build, paths)
+        turns = graph.engine.turns
+        graph.set_turn_costs(costs={"right": 0.0, "left": 0.0, "u_turn": 0.0})
+        mismatch = 0
+        for (where_from, where_to), path in zip(pairs, results["dijkstra"][2]):
+            other = graph.find_path(where_from, where_to) if path is not None else None
+            if path is not None and not math.isclose(path_cost(graph, path), path_cost(graph, other), rel_tol=1e-12,
+                                                     abs_tol=1e-6):
+                mismatch += 1
+        found = [i for i, path in enumerate(results["dijkstra"][2]) if path is not None]
+        base = sum(path_cost(graph, results["dijkstra"][2][i]) for i in found)
+        for algorithm, (throughput, build, paths) in results.items():
+            counts = [turns.count_turns(paths[i]) for i in found]
+            print("{:>10} {:>10} {:>10.1f} {:>10} {:>10.2f} {:>12.2f} {:>10.2f} {:>10.2f} {:>10}".format(
+                size, algorithm, throughput, "{:.1f}".format(turns.nbytes() / 2 ** 20) if algorithm == "turns" else "-",
+                build, (sum(path_cost(graph, paths[i]) for i in found) / base - 1) * 100,
+                sum(count["left"] for count in counts) / len(found),
+                sum(count["u_turn"] for count in counts) / len(found),
+                mismatch if algorithm == "turns" else "-"))
+
+
+def benchmark_schedule(args):
+    """
+    schedule night closures and rush hour slowdowns on a fraction of the streets, compare the throughput
+    of the depart_at queries with the plain dijkstra and the time to set a new schedule with the freeze
+    time. the depart_at queries without a schedule are checked against dijkstra
+    """
+    print("{:>10} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12} {:>10} {:>10}".format(
+        "size", "scheduled", "depart", "q/s", "build s", "profiles KB", "distance %", "changed", "mismatch"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory, one_way_every=ONE_WAY_EVERY, inactive_fraction=INACTIVE_FRACTION,
+                                  seed=args.seed)
+            _, graph = time_construction(files, directory, bulk=True)
+        rng = random.Random(args.seed)
+        buildings = graph.buildings["name"].tolist()
+        pairs = [tuple(rng.sample(buildings, 2)) for _ in range(args.queries)]
+        start = time.perf_counter()
+        graph.freeze_graph()
+        freeze = time.perf_counter() - start
+        building_names = set(buildings)
+        streets = [(a, b) for a, b in graph.path_graph.edges() if a not in building_names and b not in building_names]
+        streets = rng.sample(streets, int(len(streets) * args.fraction))
+        rows = []
+        for i, (node_a, node_b) in enumerate(streets):
+            if i % 2 == 0:
+                rows.append((node_a, node_b, "22:00", "06:00", "closed"))
+            else:
+                rows += [(node_a, node_b, "07:30", "09:00", "2.5"), (node_a, node_b, "16:30", "18:30", "2.5")]
+
+        def run(depart_at):
+            start = time.perf_counter()
+            paths = []
+            for where_from, where_to in pairs:
+                try:
+                    paths.append(graph.find_path(where_from, where_to, depart_at))
+                except nx.NetworkXNoPath:
+                    paths.append(None)
+            return len(pairs) / (time.perf_counter() - start), paths
+
+        throughput, base = run(None)
+        found = [i for i, path in enumerate(base) if path is not None]
+        base_cost = sum(path_cost(graph, base[i]) for i in found)
+        print("{:>10} {:>10} {:>10} {:>10.1f} {:>10.2f} {:>12} {:>12} {:>10} {:>10}".format(
+            size, 0, "-", throughput, freeze, "-", "-", "-", "-"))
+        graph.set_schedule([])
+        throughput, paths = run("Mon 12:00")
+        mismatch = sum(1 for i in found if not math.isclose(path_cost(graph, base[i]), path_cost(graph, paths[i]),
+                                                            rel_tol=1e-12, abs_tol=1e-6))
+        print("{:>10} {:>10} {:>10} {:>10.1f} {:>10.2f} {:>12.1f} {:>12.2f} {:>10} {:>10}".format(
+            size, 0, "Mon 12:00", throughput, 0.0, graph.schedule.nbytes() / 2 ** 10, 0.0, 0, mismatch))
+        engine = graph.engine
+        start = time.perf_counter()
+        graph.set_schedule(rows)
+        graph.edge_schedule()
+        build = time.perf_counter() - start
+        assert graph.engine is engine
+        for depart_at in ("Mon 08:00", "Mon 12:00", "Mon 23:30"):
+            throughput, paths = run(depart_at)
+            changed = sum(1 for i in found if paths[i] != base[i])
+            cost = sum(path_cost(graph, paths[i]) for i in found if paths[i] is not None)
+            print("{:>10} {:>10} {:>10} {:>10.1f} {:>10.2f} {:>12.1f} {:>12.2f} {:>10} {:>10}".format(
+                size, len(streets), depart_at, throughput, build, graph.schedule.nbytes() / 2 ** 10,
+                (cost / base_cost - 1) * 100, changed, "-"))
+
+
+def benchmark_export(args):
+    """
+    export growing numbers of random routes to GeoJSON: routes per second, file size, segments written
+    and the peak traced memory of the export, which should not grow with the number of routes
+    """
+    print("{:>10} {:>8} {:>10} {:>8} {:>10} {:>10} {:>10} {:>12}".format(
+        "size", "routes", "format", "dedupe", "routes/s", "file MB", "segments", "peak KB"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory, one_way_every=ONE_WAY_EVERY, inactive_fraction=INACTIVE_FRACTION,
+                                  seed=args.seed)
+            _, graph = time_construction(files, directory, bulk=True)
+            graph.freeze_graph()
+            rng = random.Random(args.seed)
+            buildings = graph.buildings["name"].tolist()
+            for routes in [int(x) for x in args.routes.split(",")]:
+                pairs = [tuple(rng.sample(buildings, 2)) for _ in range(routes)]
+                for file_format, dedupe in (("geojson", True), ("geojson", False), ("geojsonseq", True)):
+                    file_name = os.path.join(directory, "routes." + file_format)
+                    start = time.perf_counter()
+                    exported, _ = graph.export_routes(iter(pairs), file_name, file_format, dedupe)
+                    seconds = time.perf_counter() - start
+                    tracemalloc.start()
+                    graph.export_routes(iter(pairs), file_name, file_format, dedupe)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    with open(file_name) as exported_file:
+                        segments = sum(1 for line in exported_file if '"kind": "segment"' in line)
+                    print("{:>10} {:>8} {:>10} {:>8} {:>10.1f} {:>10.2f} {:>10} {:>12.0f}".format(
+                        size, exported, file_format, str(dedupe), exported / seconds,
+                        os.path.getsize(file_name) / 2 ** 20, segments, peak / 1024))
+
+
+def mutate_city(directory: str, target: str, changes: int, seed: int = 0):
+    """
+    write a copy of the generated city with about changes edits: moved buildings, newly closed road
+    segments and removed one direction rules
+
+    :return: buildings, streets, edges, one direction and inactive road file names of the copy
+    """
+    rng = random.Random(seed)
+    names = ("buildings.csv", "streets.csv", "edges.csv", "one_direction.csv", "inactive_road.csv")
+    buildings = pd.read_csv(os.path.join(directory, names[0]))
+    edges = pd.read_csv(os.path.join(directory, names[2])).fillna("")
+    one_direction = pd.read_csv(os.path.join(directory, names[3]))
+    inactive_road = pd.read_csv(os.path.join(directory, names[4]))
+    moved = rng.sample(range(buildings.shape[0]), min(changes, buildings.shape[0]))
+    coordinates = buildings.coordinate.str.split(",", expand=True).astype(float).values
+    coordinates[moved] += LAT_STEP / 10
+    buildings["coordinate"] = ["{:.6f},{:.6f}".format(lat, long) for lat, long in coordinates.tolist()]
+    # a closure against a one direction street would close an edge the rule removed
+    one_way = set(one_direction.node_a) | set(one_direction.node_b)
+    streets = edges[(edges.E != "") & ~edges.node_a.isin(buildings["name"]) & ~edges.node_b.isin(buildings["name"])]
+    streets = streets[~(streets.node_a + "-" + streets.node_b).isin(one_way) & ~streets.E.isin(one_way)]
+    closed = streets.iloc[rng.sample(range(streets.shape[0]), min(changes, streets.shape[0]))]
+    inactive_road = pd.concat([inactive_road, pd.DataFrame({"node_a": closed.node_a + "-" + closed.node_b,
+                                                            "node_b": closed.E.tolist()})], ignore_index=True)
+    inactive_road = inactive_road.drop_duplicates()
+    one_direction = one_direction.drop(rng.sample(range(one_direction.shape[0]), min(changes, one_direction.shape[0])))
+    os.makedirs(target, exist_ok=True)
+    for name, dataset in zip(names, (buildings, None, edges, one_direction, inactive_road)):
+        if dataset is None:
+            shutil.copy(os.path.join(directory, name), target)
+        else:
+            dataset.to_csv(os.path.join(target, name), index=False)
+    return [os.path.join(target, name) for name in names]
+
+
+def benchmark_reload(args):
+    """
+    apply growing dataset changes to a running graph with reload_datasets and compare with a full
+    construction, the reloaded graph is checked against a graph built from the changed files
+    """
+    print("{:>10} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "size", "changes", "build s", "read s", "diff s", "apply s", "speedup", "mismatch"))
+    for size in [int(x) for x in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            files = generate_grid(size, directory, one_way_every=ONE_WAY_EVERY, inactive_fraction=INACTIVE_FRACTION,
+                                  seed=args.seed)
+            build, graph = time_construction(files, directory, bulk=True)
+            graph.freeze_graph()
+            base = [os.path.join(directory, name) for name in ("buildings.csv", "streets.csv", "edges.csv",
+                                                               "one_direction.csv", "inactive_road.csv")]
+            for changes in [int(x) for x in args.changes.split(",")]:
+                changed = mutate_city(directory, os.path.join(directory, "changed{}".format(changes)), changes,
+                                      args.seed)
+                before = dict(graph.phase_timings)
+                graph.reload_datasets(*changed)
+                seconds = {phase: graph.phase_timings.get(phase, 0.0) - before.get(phase, 0.0)
+                           for phase in ("read_datasets", "validate_datasets", "diff_datasets", "apply_dataset_diff")}
+                mismatch = "-"
+                if args.check:
+                    rebuilt = ShortestPath(*changed, bulk=True)
+                    edge = graph.path_graph.edge
+                    mismatch = len(set(graph.path_graph.edges()) ^ set(rebuilt.path_graph.edges())) + sum(
+                        1 for a, b, w in rebuilt.path_graph.edges(data=True)
+                        if b in edge.get(a, {}) and not math.isclose(edge[a][b]["weight"], w["weight"],
+                                                                     rel_tol=1e-12, abs_tol=1e-6))
+                reload = sum(seconds.values())
+                print("{:>10} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.1f} {:>10}".format(
+                    size, changes, build, seconds["read_datasets"] + seconds["validate_datasets"],
+                    seconds["diff_datasets"], seconds["apply_dataset_diff"], build / reload, mismatch))
+                # back to the generated city for the next change size
+                graph.reload_datasets(*base)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ShortestPath benchmarks on synthetic street grids")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    load = commands.add_parser("load", help="compare the row by row and the bulk graph loader")
+    load.add_argument("--sizes", default="10000,100000,1000000", help="comma separated number of intersections")
+    load.add_argument("--legacy-max", type=int, default=100000,
+                      help="skip the row by row loader above this number of intersections")
+    load.set_defaults(run=benchmark_load)
+
+    query = commands.add_parser("query", help="compare the networkx backend and the CSR routing engine")
+    query.add_argument("--sizes", default="10000,100000", help="comma separated number of intersections")
+    query.add_argument("--queries", type=int, default=200, help="number of random building pairs")
+    query.add_argument("--seed", type=int, default=0)
+    query.set_defaults(run=benchmark_query)
+
+    ch = commands.add_parser("ch", help="check and benchmark the contraction hierarchy against dijkstra")
+    ch.add_argument("--sizes", default="1000,2500", help="comma separated number of intersections")
+    ch.add_argument("--queries", type=int, default=500, help="number of random building pairs")
+    ch.add_argument("--seed", type=int, default=0)
+    ch.set_defaults(run=benchmark_ch)
+
+    update = commands.add_parser("update", help="measure the road closure and one direction update latency")
+    update.add_argument("--sizes", default="10000,100000", help="comma separated number of intersections")
+    update.add_argument("--updates", type=int, default=100, help="number of random roads to change")
+    update.add_argument("--seed", type=int, default=0)
+    update.set_defaults(run=benchmark_update)
+
+    k_shortest = commands.add_parser("k-shortest", help="measure the k shortest paths latency")
+    k_shortest.add_argument("--sizes", default="1000,10000,100000", help="comma separated number of intersections")
+    k_shortest.add_argument("--queries", type=int, default=20, help="number of random building pairs")
+    k_shortest.add_argument("--k", type=int, default=5, help="number of paths per query")
+    k_shortest.add_argument("--max-detour-ratio", type=float, default=1.5)
+    k_shortest.add_argument("--trip-length", type=float, default=1000, help="maximum trip length in meter")
+    k_shortest.add_argument("--networkx", action="store_true", help="use networkx instead of the routing engine")
+    k_shortest.add_argument("--seed", type=int, default=0)
+    k_shortest.set_defaults(run=benchmark_k_shortest)
+
+    service = commands.add_parser("service", help="load test the routing service on localhost")
+    service.add_argument("--size", type=int, default=10000, help="number of intersections")
+    service.add_argument("--clients", default="1,8,32,128", help="comma separated number of concurrent clients")
+    service.add_argument("--requests", type=int, default=50, help="requests per client")
+    service.add_argument("--origins", type=int, default=20, help="number of popular origin buildings")
+    service.add_argument("--workers", type=int, default=2)
+    service.add_argument("--batch-size", type=int, default=32)
+    service.add_argument("--batch-window-ms", type=float, default=2)
+    service.add_argument("--max-pending", type=int, default=1024)
+    service.add_argument("--deadline-ms", type=float, default=1000)
+    service.add_argument("--seed", type=int, default=0)
+    service.set_defaults(run=benchmark_service)
+
+    render = commands.add_parser("render", help="compare the dictionary and the streaming path rendering")
+    render.add_argument("--sizes", default="10000", help="comma separated number of intersections")
+    render.add_argument("--routes", type=int, default=200, help="number of random routes")
+    render.add_argument("--seed", type=int, default=0)
+    render.set_defaults(run=benchmark_render)
+
+    snap = commands.add_parser("snap", help="compare the grid index and a node scan for GPS point snapping")
+    snap.add_argument("--sizes", default="10000,100000,1000000", help="comma separated number of intersections")
+    snap.add_argument("--points", type=int, default=10000, help="number of random points snapped by the grid")
+    snap.add_argument("--scan-points", type=int, default=1000, help="number of points checked with the scan")
+    snap.add_argument("--kind", default="building", choices=["building", "intersection"])
+    snap.add_argument("--seed", type=int, default=0)
+    snap.set_defaults(run=benchmark_snap)
+
+    tree = commands.add_parser("tree", help="compare many to one trees and one search per building")
+    tree.add_argument("--sizes", default="10000,100000", help="comma separated number of intersections")
+    tree.add_argument("--destinations", type=int, default=5, help="number of destination buildings")
+    tree.add_argument("--sources", type=int, default=200, help="number of buildings routed to every destination")
+    tree.add_argument("--seed", type=int, default=0)
+    tree.set_defaults(run=benchmark_tree)
+
+    stream = commands.add_parser("stream", help="compare the peak rss of the bulk and the streaming loader")
+    stream.add_argument("--sizes", default="100000,1000000", help="comma separated number of intersections")
+    stream.add_argument("--chunk-size", type=int, default=100000, help="rows per chunk of the streaming loader")
+    stream.set_defaults(run=benchmark_stream)
+
+    partition = commands.add_parser("partition", help="check and benchmark the partitioned graph")
+    partition.add_argument("--sizes", default="10000,100000", help="comma separated number of intersections")
+    partition.add_argument("--cells", type=int, default=8, help="grid cells along each axis")
+    partition.add_argument("--processes", type=int, default=4, help="worker processes")
+    partition.add_argument("--queries", type=int, default=200, help="number of random building pairs")
+    partition.add_argument("--seed", type=int, default=0)
+    partition.set_defaults(run=benchmark_partition)
+
+    generate = commands.add_parser("generate", help="write a generated city dataset with its road rules")
+    generate.add_argument("--size", default="campus",
+                          help="{} or a number of intersections".format(", ".join(CITY_SIZES)))
+    generate.add_argument("--directory", default="generated", help="directory of the csv files")
+    generate.add_argument("--one-way-every", type=int, default=ONE_WAY_EVERY,
+                          help="every this many row streets is one direction, 0 for none")
+    generate.add_argument("--inactive-fraction", type=float, default=INACTIVE_FRACTION,
+                          help="fraction of the column street segments which are closed")
+    generate.add_argument("--seed", type=int, default=0)
+    generate.set_defaults(run=generate_city)
+
+    suite = commands.add_parser("suite", help="measure the generated cities and keep the results in a history file")
+    suite.add_argument("--sizes", default="campus,town,city",
+                       help="comma separated {} or numbers of intersections".format(", ".join(CITY_SIZES)))
+    suite.add_argument("--queries", type=int, default=200, help="number of random building pairs")
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--history", default="benchmark_history.jsonl", help="json lines file of the results")
+    suite.add_argument("--repeats", type=int, default=3, help="runs of every size, the history keeps the medians")
+    suite.add_argument("--baseline-runs", type=int, default=5,
+                       help="compare with the median of this many previous records")
+    suite.add_argument("--threshold", type=float, default=0.2,
+                       help="flag a measure this much worse than the median of the previous runs, 0.2 is 20%%")
+    suite.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on a regression")
+    suite.set_defaults(run=benchmark_suite)
+
+    imports = commands.add_parser("imports", help="measure the import time and check the lazy dependencies")
+    imports.add_argument("--rounds", type=int, default=5, help="fresh interpreters per module")
+    imports.add_argument("--max-seconds", type=float, default=None,
+                         help="import time budget of the numpy only CompiledRouter")
+    imports.set_defaults(run=benchmark_imports)
+
+    turns = commands.add_parser("turns", help="compare the turn aware routing and the node based dijkstra")
+    turns.add_argument("--sizes", default="10000,100000", help="comma separated number of intersections")
+    turns.add_argument("--queries", type=int, default=200, help="number of random building pairs")
+    turns.add_argument("--seed", type=int, default=0)
+    turns.set_defaults(run=benchmark_turns)
+
+    schedule = commands.add_parser("schedule", help="compare the depart_at queries of a schedule and dijkstra")
+    schedule.add_argument("--sizes", default="10000", help="comma separated number of intersections")
+    schedule.add_argument("--queries", type=int, default=100, help="random building pairs")
+    schedule.add_argument("--fraction", type=float, default=0.02, help="fraction of the streets with a schedule")
+    schedule.add_argument("--seed", type=int, default=0)
+    schedule.set_defaults(run=benchmark_schedule)
+
+    export = commands.add_parser("export", help="measure the GeoJSON route export throughput and memory")
+    export.add_argument("--sizes", default="1000", help="comma separated number of intersections")
+    export.add_argument("--routes", default="100,1000", help="comma separated numbers of random routes")
+    export.add_argument("--seed", type=int, default=0)
+    export.set_defaults(run=benchmark_export)
+
+    reload = commands.add_parser("reload", help="compare the dataset reload of a few changes and a full build")
+    reload.add_argument("--sizes", default="10000,100000", help="comma separated number of intersections")
+    reload.add_argument("--changes", default="1,10,100,1000", help="comma separated numbers of edits")
+    reload.add_argument("--check", action="store_true", help="compare with a graph built from the changed files")
+    reload.add_argument("--seed", type=int, default=0)
+    reload.set_defaults(run=benchmark_reload)
+
+    metrics = commands.add_parser("metrics", help="measure the overhead of the query metrics")
+    metrics.add_argument("--sizes", default="10000", help="comma separated number of intersections")
+    metrics.add_argument("--queries", type=int, default=500, help="number of random building pairs")
+    metrics.add_argument("--sample-rate", type=float, default=0.01, help="sample rate of the sampled mode")
+    metrics.add_argument("--rounds", type=int, default=5, help="turns of the three modes")
+    metrics.add_argument("--seed", type=int, default=0)
+    metrics.set_defaults(run=benchmark_metrics)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()